@@ -1,5 +1,176 @@
-def main():
-    print("Hello from cloud-cost-analyzer!")
+"""
+Cloud cost analyzer command line (`cloud-cost`).
+
+Only argparse is imported at startup, every subcommand imports its modules when it runs,
+so `--help` and argument errors return quickly (`python main.py bench` checks the budget).
+
+Usage:
+    python main.py etl                          # load AWS, GCP and Stripe concurrently, then normalize
+    python main.py etl --sources aws gcp        # only some sources
+    python main.py ingest --sources stripe      # same as etl
+    DLT_DESTINATION=clickhouse python main.py etl
+    python main.py daemon                       # keep running, each source at its own interval
+    python main.py webhook                      # receive Stripe webhooks, load them in micro-batches
+    python main.py normalize aws gcp            # normalize the loaded parquet files
+    python main.py generate-dashboards aws gcp  # generate the Rill dashboards
+    python main.py anonymize                    # anonymize the ClickHouse demo data
+    python main.py clear clickhouse --dry-run   # drop the dlt tables of a destination
+    python main.py bench                        # measure the CLI startup time
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parent
+
+SOURCES = ["aws", "gcp", "stripe"]
+VIZ_SOURCES = ["aws", "gcp"]
+
+# commands timed by `bench`, none of them may import more than argparse
+BENCH_COMMANDS = [
+    ["--help"],
+    ["etl", "--help"],
+    ["daemon", "--help"],
+    ["webhook", "--help"],
+    ["normalize", "--help"],
+    ["generate-dashboards", "--help"],
+    ["clear", "--help"],
+]
+
+
+def _add_sources_argument(parser: argparse.ArgumentParser, choices: list, help: str) -> None:
+    parser.add_argument("--sources", nargs="+", choices=choices, default=choices, help=help)
+
+
+def _add_normalize_arguments(parser: argparse.ArgumentParser) -> None:
+    normalize = parser.add_mutually_exclusive_group()
+    normalize.add_argument(
+        "--normalize",
+        dest="normalize",
+        action="store_true",
+        default=None,
+        help="Normalize after loading (default: only for the filesystem destination)",
+    )
+    normalize.add_argument("--no-normalize", dest="normalize", action="store_false")
+
+
+def _add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="viz_rill/profiles",
+        metavar="DIR",
+        help="Profile every DuckDB statement and write a ranked report to DIR (default: viz_rill/profiles)",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cloud-cost", description="Cloud cost analyzer")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    etl = subparsers.add_parser(
+        "etl", aliases=["ingest"], help="Run the source pipelines concurrently and normalize their output"
+    )
+    _add_sources_argument(etl, SOURCES, "Sources to load (default: all)")
+    etl.add_argument(
+        "--timeout",
+        type=float,
+        help="Timeout in seconds per stage (default: [orchestrator] config, 3600)",
+    )
+    _add_normalize_arguments(etl)
+
+    daemon = subparsers.add_parser(
+        "daemon", help="Run the source pipelines at their [daemon.intervals] in one long running process"
+    )
+    _add_sources_argument(daemon, SOURCES, "Sources to schedule (default: all)")
+    _add_normalize_arguments(daemon)
+
+    webhook = subparsers.add_parser(
+        "webhook", help="Receive Stripe webhooks and load them into the Stripe dataset in micro-batches"
+    )
+    webhook.add_argument("--host", help="Interface to listen on (default: [stripe_webhook] host, 127.0.0.1)")
+    webhook.add_argument("--port", type=int, help="Port to listen on (default: [stripe_webhook] port, 8787)")
+
+    normalize = subparsers.add_parser("normalize", help="Normalize the loaded AWS and GCP parquet files")
+    normalize.add_argument("sources", nargs="*", choices=VIZ_SOURCES, help="Sources to normalize (default: all)")
+    _add_profile_argument(normalize)
+
+    dashboards = subparsers.add_parser(
+        "generate-dashboards", help="Generate the Rill dashboards from the normalized parquet files"
+    )
+    dashboards.add_argument("sources", nargs="*", choices=VIZ_SOURCES, help="Sources to generate (default: all)")
+    _add_profile_argument(dashboards)
+
+    subparsers.add_parser("anonymize", help="Anonymize the cost data in ClickHouse for public demos")
+
+    clear = subparsers.add_parser("clear", help="Drop the dlt tables or schemas of a destination")
+    clear.add_argument("destination", choices=["clickhouse", "motherduck"])
+    clear.add_argument("--dry-run", action="store_true", help="Show what would be dropped")
+
+    bench = subparsers.add_parser("bench", help="Measure the startup time of the CLI commands")
+    bench.add_argument("--runs", type=int, default=10, help="Runs per command (default: 10)")
+    bench.add_argument(
+        "--budget-ms", type=float, default=150, help="Allowed median startup time per command (default: 150)"
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    # pipelines read .dlt/ relative to the working directory
+    os.chdir(ROOT_DIR)
+
+    # the viz commands run inside viz_rill, keep a relative profile dir relative to the project
+    profile_dir = str(ROOT_DIR / args.profile) if getattr(args, "profile", None) else None
+
+    if args.command in ("etl", "ingest"):
+        from pipelines.orchestrator import run_etl
+
+        ok = run_etl(args.sources, normalize=args.normalize, timeout=args.timeout)
+        sys.exit(0 if ok else 1)
+    elif args.command == "daemon":
+        from pipelines.daemon import run_daemon
+
+        run_daemon(args.sources, normalize=args.normalize)
+    elif args.command == "webhook":
+        from pipelines.stripe_webhook import run_webhook
+
+        run_webhook(host=args.host, port=args.port)
+    elif args.command == "normalize":
+        from pipelines.viz import normalize
+
+        for source in args.sources or VIZ_SOURCES:
+            normalize(source, profile_dir=profile_dir)
+    elif args.command == "generate-dashboards":
+        from pipelines.viz import generate_dashboards
+
+        for source in args.sources or VIZ_SOURCES:
+            generate_dashboards(source, profile_dir=profile_dir)
+    elif args.command == "anonymize":
+        from dotenv import load_dotenv
+
+        load_dotenv(ROOT_DIR / ".env")
+        sys.path.insert(0, str(ROOT_DIR / "scripts"))
+        import anonymize_clickhouse
+
+        anonymize_clickhouse.main()
+    elif args.command == "clear":
+        sys.path.insert(0, str(ROOT_DIR / "scripts"))
+        if args.destination == "clickhouse":
+            import clear_clickhouse as clear_script
+        else:
+            import clear_motherduck as clear_script
+
+        clear_script.main(["--dry-run"] if args.dry_run else [])
+    elif args.command == "bench":
+        from pipelines.bench import run_bench
+
+        ok = run_bench(BENCH_COMMANDS, runs=args.runs, budget_ms=args.budget_ms)
+        sys.exit(0 if ok else 1)
 
 
 if __name__ == "__main__":
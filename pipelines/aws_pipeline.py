@@ -5,11 +5,132 @@
 
 # From: https://dlthub.com/docs/dlt-ecosystem/verified-sources/filesystem/basic
 
+import argparse
 import os
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
 import dlt
-from dlt.sources.filesystem import filesystem, read_parquet
+from dlt.sources.filesystem import filesystem
+
+from helpers.aws_cur import cur_billing_period_files, merge_filesystem_table, read_cur_parquet
+from helpers.aws_cur.helpers import (
+    account_table_name,
+    add_account_column,
+    export_path_from_glob,
+    union_all_sql,
+)
+from helpers.aws_cur.staging import WORK_QUEUE_HANDLERS
+from helpers.column_encoding import configure_parquet_row_groups, low_cardinality_clickhouse, print_bytes_report
+from helpers.pipeline_metrics import record_metrics
+from helpers.pipeline_state import source_lock, source_pipeline
+from helpers.work_queue import default_worker_id, open_work_queue, run_worker
+from helpers.aws_cur.settings import (
+    ACCOUNT_WORKERS,
+    BILLING_PERIOD_KEY,
+    CACHE_MAX_SIZE_GB,
+    COMBINED_VIEW_NAME,
+    LOW_CARDINALITY_COLUMNS,
+    OPEN_BILLING_PERIODS,
+    PRIMARY_KEY,
+    READER_MAX_WORKERS,
+    READER_PREFETCH,
+)
+
+
+def get_cur_accounts(defaults: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Returns the CUR exports to load.
+
+    Without `[[sources.aws_cur.accounts]]` this is the single export configured in `[sources.aws_cur]`.
+    Otherwise every account entry needs a `name` and overrides the `[sources.aws_cur]` values it sets,
+    e.g. `bucket_url`, `file_glob`, `export_path`, `table_name` or `initial_start_date`.
+    The table name defaults to `cur_<name>`.
+
+    Args:
+        defaults (Dict[str, Any]): Export settings of `[sources.aws_cur]`.
+
+    Returns:
+        List[Dict[str, Any]]: One dict of export settings per account.
+    """
+    try:
+        accounts = dlt.config["sources.aws_cur.accounts"]
+    except KeyError:
+        return [dict(defaults, name=None)]
+
+    resolved = []
+    for account in accounts:
+        settings = dict(defaults, table_name=account_table_name(account["name"]))
+        if "file_glob" in account:
+            # the default export path belongs to the default file_glob
+            settings["export_path"] = None
+        settings.update(account)
+        resolved.append(settings)
+    table_names = [a["table_name"] for a in resolved]
+    if len(set(table_names)) != len(table_names):
+        raise ValueError(f"CUR accounts must load into distinct tables, got {table_names}")
+    return resolved
+
+
+def get_work_queue_config() -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns the work queue url and the staging directory from `[sources.aws_cur]`.
+
+    The staging directory defaults to `staging` next to the queue, it must be reachable by all workers.
+    """
+    try:
+        work_queue = dlt.config["sources.aws_cur.work_queue"]
+    except KeyError:
+        return None, None
+    try:
+        staging_dir = dlt.config["sources.aws_cur.staging_dir"]
+    except KeyError:
+        queue_path = pathlib.Path(work_queue.split("://", 1)[1])
+        staging_dir = str((queue_path.parent if work_queue.startswith("sqlite") else queue_path) / "staging")
+    return work_queue, staging_dir
+
+
+def run_aws_worker() -> None:
+    """Works on the CUR download and normalization tasks of the work queue until it stays empty."""
+    work_queue, _ = get_work_queue_config()
+    if work_queue is None:
+        raise SystemExit("No work queue configured, set work_queue under [sources.aws_cur]")
+
+    try:
+        idle_timeout = dlt.config["sources.aws_cur.worker_idle_timeout"]
+    except KeyError:
+        idle_timeout = 60
+
+    print(f"Worker {default_worker_id()} serving {work_queue}")
+    completed = run_worker(open_work_queue(work_queue), WORK_QUEUE_HANDLERS, idle_timeout=idle_timeout)
+    print(f"Worker completed {completed} task(s), queue idle for {idle_timeout}s")
+
+
+def create_combined_view(pipeline: dlt.Pipeline, table_names: List[str], view_name: str) -> None:
+    """Creates or replaces a view over the account tables that exist in the destination."""
+    schema = pipeline.default_schema
+    with pipeline.sql_client() as client:
+        tables = {
+            client.make_qualified_table_name(table_name): [
+                client.escape_column_name(column) for column in schema.get_table_columns(table_name)
+            ]
+            for table_name in table_names
+            if schema.get_table_columns(table_name)
+        }
+        if not tables:
+            return
+        client.execute_sql(
+            f"CREATE OR REPLACE VIEW {client.make_qualified_table_name(view_name)} AS\n"
+            + union_all_sql(tables)
+        )
+    print(f"Created view {view_name} over {len(tables)} account table(s)")
+
+
+@source_lock("aws")
+def load_aws_costs() -> None:
+    """Load AWS CUR files from S3 with environment-driven destination"""
 
-if __name__ == "__main__":
     # Determine destination from environment variable (default: filesystem for local dev)
     destination = os.getenv("DLT_DESTINATION", "filesystem")
 
@@ -18,63 +139,256 @@ if __name__ == "__main__":
     file_glob = dlt.config["sources.aws_cur.file_glob"]
     table_name = dlt.config["sources.aws_cur.table_name"]
 
+    try:
+        export_path = dlt.config["sources.aws_cur.export_path"]
+    except KeyError:
+        export_path = None
+
     # Optional config with defaults
     try:
         dataset_name = dlt.config["sources.aws_cur.dataset_name"]
     except KeyError:
         dataset_name = "aws_costs"
 
+    # Get initial start date from config (optional)
     try:
-        pipeline_name = dlt.config["pipeline.pipeline_name"]
+        initial_start_date_str = dlt.config["sources.aws_cur.initial_start_date"]
     except KeyError:
-        pipeline_name = "cloud_cost_analytics"
+        initial_start_date_str = None
 
-    # Get initial start date from config (optional)
+    # How to pick CUR files: "billing_period" (CUR 2.0 manifests) or "modification_date" (legacy)
     try:
-        from dlt.common import pendulum
-        initial_start_date_str = dlt.config["sources.aws_cur.initial_start_date"]
-        initial_start_date = pendulum.parse(initial_start_date_str)
+        file_selection = dlt.config["sources.aws_cur.file_selection"]
+    except KeyError:
+        file_selection = "billing_period"
+
+    # Parallel range reads: concurrent requests and row groups fetched ahead of the loader
+    try:
+        max_workers = dlt.config["sources.aws_cur.max_workers"]
+    except KeyError:
+        max_workers = READER_MAX_WORKERS
+
+    try:
+        prefetch = dlt.config["sources.aws_cur.prefetch"]
+    except KeyError:
+        prefetch = READER_PREFETCH
+
+    # Opt-in local cache of downloaded CUR files, keyed by S3 ETag + size
+    try:
+        cache_dir = dlt.config["sources.aws_cur.cache_dir"]
+    except KeyError:
+        cache_dir = None
+
+    try:
+        cache_max_size_gb = dlt.config["sources.aws_cur.cache_max_size_gb"]
+    except KeyError:
+        cache_max_size_gb = CACHE_MAX_SIZE_GB
+
+    # Optional work queue that shards the CUR files over `aws_pipeline.py --worker` processes/hosts
+    work_queue, staging_dir = get_work_queue_config()
+
+    try:
+        open_periods = dlt.config["sources.aws_cur.open_billing_periods"]
+    except KeyError:
+        open_periods = OPEN_BILLING_PERIODS
+
+    # Multi-account fan-out: number of CUR exports extracted at the same time
+    try:
+        account_workers = dlt.config["sources.aws_cur.account_workers"]
+    except KeyError:
+        account_workers = ACCOUNT_WORKERS
+
+    # Optional column projection and row filter, pushed down into the parquet scan
+    # The identity_* keys and the billing period are always kept for merges
+    try:
+        columns = dlt.config["sources.aws_cur.columns"]
     except KeyError:
-        initial_start_date = None
+        columns = None
 
-    # Configure filesystem resource with optional start date
-    filesystem_resource = filesystem(
-        bucket_url=bucket_url,
-        file_glob=file_glob,
-        incremental=dlt.sources.incremental("modification_date", initial_value=initial_start_date),
+    try:
+        exclude_columns = dlt.config["sources.aws_cur.exclude_columns"]
+    except KeyError:
+        exclude_columns = None
+
+    try:
+        row_filter = dlt.config["sources.aws_cur.row_filter"]
+    except KeyError:
+        row_filter = None
+
+    # Typed usage_start / usage_end / date columns parsed from identity_time_interval at extract time
+    try:
+        time_columns = dlt.config["sources.aws_cur.time_columns"]
+    except KeyError:
+        time_columns = True
+
+    # Optional daily rollup of hourly line items before the load, merges dedupe on a synthetic line item id
+    try:
+        daily_rollup = dlt.config["sources.aws_cur.daily_rollup"]
+    except KeyError:
+        daily_rollup = False
+
+    # Repetitive string columns (service codes, regions, usage types, ...) as LowCardinality on ClickHouse
+    try:
+        low_cardinality = dlt.config["sources.aws_cur.low_cardinality"]
+    except KeyError:
+        low_cardinality = True
+
+    accounts = get_cur_accounts(
+        dict(
+            bucket_url=bucket_url,
+            file_glob=file_glob,
+            export_path=export_path,
+            table_name=table_name,
+            initial_start_date=initial_start_date_str,
+        )
     )
+    multi_account = len(accounts) > 1 or accounts[0]["name"] is not None
+
+    def cur_account_resource(account: Dict[str, Any]) -> Any:
+        """Lists and reads the CUR files of one export into its own table, with its own cursor."""
+        account_bucket_url = account["bucket_url"]
+        # Size the botocore connection pool to the reader so it never limits concurrent requests
+        fs_kwargs = (
+            {"config_kwargs": {"max_pool_connections": max_workers}}
+            if account_bucket_url.startswith("s3://")
+            else None
+        )
+
+        if file_selection == "billing_period":
+            # Only open billing periods are checked, a re-export replaces exactly that period
+            filesystem_resource = cur_billing_period_files(
+                bucket_url=account_bucket_url,
+                export_path=account["export_path"] or export_path_from_glob(account["file_glob"]),
+                initial_start_date=account["initial_start_date"],
+                open_periods=open_periods,
+                kwargs=fs_kwargs,
+            )
+            merge_key = [BILLING_PERIOD_KEY]
+        else:
+            from dlt.common import pendulum
 
-    # Pipe to parquet reader
-    filesystem_pipe = filesystem_resource | read_parquet()
+            # Configure filesystem resource with optional start date
+            start_date = account["initial_start_date"]
+            filesystem_resource = filesystem(
+                bucket_url=account_bucket_url,
+                file_glob=account["file_glob"],
+                kwargs=fs_kwargs,
+                incremental=dlt.sources.incremental(
+                    "modification_date", initial_value=pendulum.parse(start_date) if start_date else None
+                ),
+            )
+            merge_key = list(PRIMARY_KEY)
 
+        # Pipe to parquet reader
+        filesystem_pipe = filesystem_resource | read_cur_parquet(
+            columns=columns,
+            exclude_columns=exclude_columns,
+            row_filter=row_filter,
+            max_workers=max_workers,
+            prefetch=prefetch,
+            cache_dir=cache_dir,
+            cache_max_size_gb=cache_max_size_gb,
+            work_queue=work_queue,
+            staging_dir=staging_dir,
+            bucket_url=account_bucket_url,
+            time_columns=time_columns,
+            daily_rollup=daily_rollup,
+        )
+
+        # Load the data with merge mode and composite primary key for deduplication
+        # AWS CUR records are uniquely identified by line_item_id + time_interval
+        # Using merge instead of append to enforce primary key constraint
+        # With billing period selection the merge key is the billing period, so the rows of a
+        # re-exported period are deleted and replaced as a whole
+        resource = filesystem_pipe.with_name(account["table_name"])
+        resource.apply_hints(
+            primary_key=list(PRIMARY_KEY),
+            write_disposition="merge",
+            merge_key=merge_key
+        )
+        if multi_account:
+            resource.add_map(lambda items: add_account_column(items, account["name"]))
+            # read the accounts in dlt's extract thread pool instead of one after another
+            resource.parallelize()
+        return resource
+
+    resources = [cur_account_resource(account) for account in accounts]
+    table_names = [account["table_name"] for account in accounts]
     # Create pipeline with environment-driven destination
     # Local: destination="filesystem" writes parquet to viz_rill/data/
     # Production: destination="clickhouse" writes directly to ClickHouse Cloud
-    pipeline = dlt.pipeline(
-        pipeline_name=pipeline_name,
-        destination=destination,
-        dataset_name=dataset_name,
-        # export_schema_path="exported_schema/aws_cost_schema.json",
-    )
-
-    # Load the data with merge mode and composite primary key for deduplication
-    # AWS CUR records are uniquely identified by line_item_id + time_interval
-    # Using merge instead of append to enforce primary key constraint
-    resource = filesystem_pipe.with_name(table_name)
-    resource.apply_hints(
-        primary_key=["identity_line_item_id", "identity_time_interval"],
-        write_disposition="merge",
-        merge_key=["identity_line_item_id", "identity_time_interval"]
+    # The pipeline has its own name and state, cursors of the shared pipeline are migrated once
+    # (state of the file listing resource is kept under "<listing resource>_<table>")
+    pipeline = source_pipeline(
+        "aws",
+        destination,
+        dataset_name,
+        resource_names=[
+            f"{prefix}{name}"
+            for name in table_names
+            for prefix in ("", "cur_billing_period_files_", "filesystem_")
+        ],
     )
+    if multi_account:
+        # scoped to this pipeline, the daemon runs other sources on threads of the same process
+        dlt.config[f"{pipeline.pipeline_name}.extract.workers"] = account_workers
+        print(f"Loading {len(accounts)} CUR accounts with {account_workers} workers")
 
     # For filesystem destination, use parquet format
     # For clickhouse destination, format is handled automatically
     if destination == "filesystem":
-        load_info = pipeline.run(resource, loader_file_format="parquet")
+        # larger row groups, each holds one dictionary per column
+        configure_parquet_row_groups(pipeline)
+        load_info = pipeline.run(resources, loader_file_format="parquet")
+
+        # The filesystem destination appends instead of merging plain parquet tables,
+        # so upsert the new files into billing-period partitions ourselves
+        try:
+            filesystem_merge = dlt.config["sources.aws_cur.filesystem_merge"]
+        except KeyError:
+            filesystem_merge = True
+
+        if filesystem_merge:
+            output_dir = dlt.config["destination.filesystem.bucket_url"].removeprefix("file://")
+
+            def merge_table(name: str) -> int:
+                table_dir = pathlib.Path(output_dir) / dataset_name / name
+                print(f"Merging {table_dir} by {', '.join(PRIMARY_KEY)}...")
+                merged_periods = merge_filesystem_table(
+                    table_dir, replace_periods=file_selection == "billing_period"
+                )
+                print(f"Merged {len(merged_periods)} billing period(s) of {name}")
+                return len(merged_periods)
+
+            with ThreadPoolExecutor(max_workers=max(1, account_workers)) as executor:
+                list(executor.map(merge_table, table_names))
     else:
-        load_info = pipeline.run(resource)
+        load_info = pipeline.run(resources)
+
+        # One view over all account tables, rows are told apart by the cur_account column
+        if multi_account:
+            create_combined_view(pipeline, table_names, COMBINED_VIEW_NAME)
+
+        if destination == "clickhouse" and low_cardinality:
+            for name in table_names:
+                report = low_cardinality_clickhouse(pipeline, name, LOW_CARDINALITY_COLUMNS)
+                print_bytes_report(f"{name} as LowCardinality", report)
+
+    # Stage durations, rows and bytes to the _pipeline_metrics table
+    record_metrics(pipeline, "aws")
 
     # Print concise summary instead of full schema
     print(f"\nPipeline {pipeline.pipeline_name} completed successfully")
     print(f"Loaded to: {pipeline.destination}")
     print(f"Dataset: {pipeline.dataset_name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load AWS CUR files")
+    parser.add_argument(
+        "--worker", action="store_true", help="Process work queue tasks instead of running the pipeline"
+    )
+    if parser.parse_args().worker:
+        run_aws_worker()
+    else:
+        load_aws_costs()
@@ -0,0 +1,111 @@
+"""
+Startup time benchmark of the `main.py` CLI.
+
+Every command is run in fresh interpreters and its best and median wall time is compared
+to a budget. Commands that only parse arguments (`--help`) must not import dlt, duckdb,
+pyarrow or any client library, `-X importtime` is used to list such imports when they
+sneak into the CLI module or its top-level imports.
+
+Usage:
+    python main.py bench
+    python main.py bench --runs 20 --budget-ms 100
+"""
+
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Sequence
+
+MAIN_PY = pathlib.Path(__file__).resolve().parent.parent / "main.py"
+
+DEFAULT_BUDGET_MS = 150
+DEFAULT_RUNS = 10
+# packages that take tens to hundreds of milliseconds to import
+HEAVY_MODULES = (
+    "dlt",
+    "duckdb",
+    "pyarrow",
+    "pandas",
+    "jinja2",
+    "google",
+    "stripe",
+    "clickhouse_connect",
+    "dotenv",
+)
+
+
+def time_command(args: Sequence[str], runs: int) -> List[float]:
+    """Runs `main.py <args>` `runs` times, returns the wall times in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, str(MAIN_PY), *args], stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def heavy_imports(args: Sequence[str]) -> Dict[str, float]:
+    """Returns the heavy top-level packages imported by `main.py <args>` with their cumulative import time in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(MAIN_PY), *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    imports: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:") :].split("|"))
+        if name in HEAVY_MODULES:
+            imports[name] = int(cumulative) / 1000
+    return imports
+
+
+def run_bench(
+    commands: Sequence[Sequence[str]], runs: int = DEFAULT_RUNS, budget_ms: float = DEFAULT_BUDGET_MS
+) -> bool:
+    """
+    Benchmarks the startup of CLI commands against a time budget.
+
+    Args:
+        commands (Sequence[Sequence[str]]): Arguments of each command, e.g. `["--help"]`.
+        runs (int): Fresh interpreters started per command.
+        budget_ms (float): Allowed median wall time in milliseconds.
+
+    Returns:
+        bool: True if every command is within the budget and imports no heavy package.
+    """
+    baseline = statistics.median(_time_interpreter(runs))
+    print(f"⏱️  {runs} runs per command, budget {budget_ms:.0f} ms, bare interpreter {baseline:.1f} ms")
+    print(f"{'command':<32} {'best ms':>9} {'median ms':>10}  status")
+    print("-" * 64)
+
+    ok = True
+    for args in commands:
+        timings = time_command(args, runs)
+        median = statistics.median(timings)
+        heavy = heavy_imports(args)
+        status = "ok"
+        if median > budget_ms:
+            status = "over budget"
+        if heavy:
+            status = "imports " + ", ".join(f"{name} ({ms:.0f} ms)" for name, ms in heavy.items())
+        ok = ok and status == "ok"
+        print(f"{' '.join(args):<32} {min(timings):>9.1f} {median:>10.1f}  {status}")
+    print("-" * 64)
+    print("✅ Startup within budget" if ok else "❌ Startup budget exceeded")
+    return ok
+
+
+def _time_interpreter(runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
@@ -0,0 +1,209 @@
+"""
+Long running scheduler for the source pipelines.
+
+Unlike `python main.py etl`, which starts cold processes for every run, the daemon keeps one
+process alive: dlt, the pipeline modules and their config are imported once, dlt pipelines are
+reused between runs (`helpers.pipeline_state`), the BigQuery client is created once and Stripe
+keeps its HTTP session. Each source runs at its own interval with random jitter; a source is
+never started while its previous run is still going (and `source_lock` keeps other processes
+out). Durations and results of the last runs are written to a JSON status file.
+
+Usage:
+    python main.py daemon
+    python main.py daemon --sources stripe gcp
+"""
+
+import importlib
+import json
+import os
+import pathlib
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import dlt
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.tracing import child_env, span  # noqa: E402
+from orchestrator import SOURCES  # noqa: E402
+
+# Default interval per source: Stripe hourly, GCP billing export every 4 hours, CUR every 8 hours
+DEFAULT_INTERVALS = {"aws": "8h", "gcp": "4h", "stripe": "1h"}
+DEFAULT_JITTER = "5m"
+DEFAULT_STATUS_FILE = ".dlt/daemon_status.json"
+# Number of past runs kept per source in the status file
+STATUS_HISTORY = 10
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_interval(value: Any) -> float:
+    """Parses seconds or a duration like "90s", "15m", "8h" or "1d" into seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    if value[-1:] in _UNITS:
+        return float(value[:-1]) * _UNITS[value[-1]]
+    return float(value)
+
+
+def get_interval(source: str) -> float:
+    """Interval of a source from `[daemon.intervals]`."""
+    try:
+        return parse_interval(dlt.config[f"daemon.intervals.{source}"])
+    except KeyError:
+        return parse_interval(DEFAULT_INTERVALS[source])
+
+
+def _config(key: str, default: Any) -> Any:
+    try:
+        return dlt.config[f"daemon.{key}"]
+    except KeyError:
+        return default
+
+
+class SourceSchedule:
+    """Schedule and run history of one source."""
+
+    def __init__(self, source: str, interval: float, jitter: float) -> None:
+        self.source = source
+        self.interval = interval
+        self.jitter = jitter
+        # spread the first runs so the sources do not all start at the same second
+        self.next_run = time.time() + random.uniform(0, jitter)
+        self.future: Optional[Future] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.history: List[Dict[str, Any]] = []
+
+    @property
+    def running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def finish(self) -> None:
+        """Records the result of the finished run and schedules the next one."""
+        error = self.future.exception()
+        finished = self.finished
+        self.history.append(
+            dict(
+                started=self.started,
+                duration_seconds=round(finished - self.started, 3),
+                status="ok" if error is None else "failed",
+                error=None if error is None else repr(error),
+            )
+        )
+        del self.history[:-STATUS_HISTORY]
+        self.future = None
+        # fixed cadence from the start of the run, a run longer than the interval is followed right away
+        self.next_run = max(finished, self.started + self.interval) + random.uniform(0, self.jitter)
+        run = self.history[-1]
+        icon = "✅" if run["status"] == "ok" else "❌"
+        print(
+            f"{icon} {self.source} {run['status']} in {run['duration_seconds']:.1f}s,"
+            f" next run in {self.next_run - time.time():.0f}s"
+            + (f": {run['error']}" if run["error"] else "")
+        )
+
+    def start(self, executor: ThreadPoolExecutor, normalize: bool) -> None:
+        print(f"▶️  starting {self.source}")
+        self.started = time.time()
+        self.future = executor.submit(run_source, self.source, normalize)
+        # the scheduler polls once a second, take the duration from the run itself
+        self.future.add_done_callback(lambda _f: setattr(self, "finished", time.time()))
+
+    def status(self) -> Dict[str, Any]:
+        return dict(
+            interval_seconds=self.interval,
+            running=self.running,
+            running_since=self.started if self.running else None,
+            next_run=None if self.running else self.next_run,
+            last_run=self.history[-1] if self.history else None,
+            last_runs=self.history,
+        )
+
+
+def run_source(source: str, normalize: bool) -> None:
+    """Runs the load of a source in this process, then its normalizer."""
+    spec = SOURCES[source]
+    # imported once, later runs reuse the module and its cached clients
+    with span(f"{source}.run", source=source):
+        module = importlib.import_module(spec["module"])
+        getattr(module, spec["function"])()
+        if normalize and spec["normalize"]:
+            # the normalizer changes into viz_rill, so it gets its own process instead of a thread
+            subprocess.run(
+                [sys.executable, "main.py", "normalize", source],
+                cwd=PIPELINES_DIR.parent,
+                check=True,
+                env=child_env(),
+            )
+
+
+def write_status(path: pathlib.Path, schedules: Sequence[SourceSchedule]) -> None:
+    """Writes the schedule and last run durations of all sources."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(
+        json.dumps(
+            dict(updated=time.time(), pid=os.getpid(), sources={s.source: s.status() for s in schedules}),
+            indent=2,
+        )
+    )
+    os.replace(tmp, path)
+
+
+def run_daemon(sources: Sequence[str] = tuple(SOURCES), normalize: Optional[bool] = None) -> None:
+    """
+    Runs the sources at their intervals until SIGINT or SIGTERM.
+
+    Config (`[daemon]` in .dlt/config.toml):
+        intervals: per source, seconds or "15m", "1h", "8h"
+        jitter: random delay added to every scheduled run, defaults to "5m"
+        status_file: JSON file with next runs and last run durations, defaults to .dlt/daemon_status.json
+
+    Args:
+        sources (Sequence[str]): Sources to schedule, any of "aws", "gcp", "stripe".
+        normalize (Optional[bool]): Run the normalizers after the loads. Defaults to None which
+            normalizes only for the local filesystem destination.
+    """
+    if normalize is None:
+        normalize = os.getenv("DLT_DESTINATION", "filesystem") == "filesystem"
+
+    jitter = parse_interval(_config("jitter", DEFAULT_JITTER))
+    status_file = pathlib.Path(_config("status_file", DEFAULT_STATUS_FILE))
+    schedules = [SourceSchedule(source, get_interval(source), jitter) for source in sources]
+    for schedule in schedules:
+        print(f"⏱️  {schedule.source} every {schedule.interval:.0f}s (+ up to {jitter:.0f}s jitter)")
+
+    stop = threading.Event()
+
+    def request_stop(signum: int, _frame: Any) -> None:
+        print(f"\nReceived signal {signum}, waiting for running loads to finish...")
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    with ThreadPoolExecutor(max_workers=len(schedules), thread_name_prefix="daemon") as executor:
+        while not stop.is_set() or any(s.future is not None for s in schedules):
+            changed = False
+            for schedule in schedules:
+                if schedule.future is not None and schedule.future.done():
+                    schedule.finish()
+                    changed = True
+                if not stop.is_set() and not schedule.running and time.time() >= schedule.next_run:
+                    schedule.start(executor, normalize)
+                    changed = True
+            if changed:
+                write_status(status_file, schedules)
+            stop.wait(1)
+    write_status(status_file, schedules)
+    print("Daemon stopped")
@@ -1,7 +1,11 @@
 # flake8: noqa
+import functools
 import humanize
-from typing import Any
+import json
+from typing import Any, Dict, Iterator, List, Set
 import os
+import pathlib
+import time
 
 import dlt
 from dlt.common import pendulum
@@ -9,59 +13,410 @@ from dlt.common import pendulum
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+from helpers.column_encoding import configure_parquet_row_groups, low_cardinality_clickhouse, print_bytes_report
+from helpers.gcp_billing import (
+    EXPORT_TABLE_KEY,
+    LOW_CARDINALITY_COLUMNS,
+    MERGE_KEY,
+    USAGE_DATE_KEY,
+    LookbackDatasetError,
+    filesystem_rows_without_merge_key,
+    replace_filesystem_days,
+)
+from helpers.pipeline_metrics import record_metrics
+from helpers.pipeline_state import source_lock, source_pipeline
+from helpers.tracing import record_span, span
+
+@functools.lru_cache(maxsize=None)
+def get_bigquery_client(project_id: str) -> bigquery.Client:
+    """
+    Returns a BigQuery client, created once per process.
+
+    The daemon reuses the client (and its authorized HTTP session) across runs.
+    """
+    # Get service account credentials from .dlt/secrets.toml
+    service_account_info = {
+        "project_id": dlt.secrets.get('source.bigquery.credentials.project_id'),
+        "private_key": dlt.secrets.get('source.bigquery.credentials.private_key'),
+        "client_email": dlt.secrets.get('source.bigquery.credentials.client_email'),
+        "token_uri": dlt.secrets.get('source.bigquery.credentials.token_uri'),
+    }
+    credentials = service_account.Credentials.from_service_account_info(service_account_info)
+    return bigquery.Client(credentials=credentials, project=project_id)
+
+
+# Columns the GCP dashboards group by, kept by the daily granularity ("record.field" for nested columns)
+DAILY_DIMENSIONS = (
+    "billing_account_id",
+    "service.id",
+    "service.description",
+    "sku.id",
+    "sku.description",
+    "project.id",
+    "project.number",
+    "project.name",
+    "location.location",
+    "location.country",
+    "location.region",
+    "currency",
+    "cost_type",
+    "transaction_type",
+    "usage.unit",
+    "usage.pricing_unit",
+)
+# Columns summed per day and dimensions
+DAILY_MEASURES = ("cost", "cost_at_list", "usage.amount", "usage.amount_in_pricing_units")
+# Days of partitions scanned before the cursor. Exports partition by day but a row's partition may be
+# its usage day, and usage days keep receiving rows (late usage, credits) until the invoice month closes
+DEFAULT_PARTITION_SLACK_DAYS = 31
+
+
+class BytesBudgetExceededError(RuntimeError):
+    """The query of a billing table would process more bytes than `max_bytes_billed` allows."""
+
+
+def get_table_columns(table: bigquery.Table) -> Set[str]:
+    """Returns the columns of a table, nested fields as "record.field"."""
+    columns = set()
+    for field in table.schema:
+        columns.add(field.name)
+        if field.field_type in ("RECORD", "STRUCT") and field.mode != "REPEATED":
+            columns.update(f"{field.name}.{sub.name}" for sub in field.fields)
+    return columns
+
+
+def partition_predicate(table: bigquery.Table, bound: str, slack_days: int = 0) -> str:
+    """
+    Prunes the partitions of an ingestion-time partitioned export older than `bound`.
+
+    Billing exports are partitioned by `_PARTITIONTIME`, which a filter on `export_time` or
+    `usage_start_time` alone does not prune. Tables partitioned by a column get no predicate:
+    `export_time` prunes itself, other columns cannot be bounded by the cursor.
+    """
+    partitioning = table.time_partitioning
+    if partitioning is None or partitioning.field:
+        return ""
+    return (
+        "AND _PARTITIONTIME >= TIMESTAMP_SUB("
+        f"TIMESTAMP_TRUNC({bound}, DAY), INTERVAL {int(slack_days)} DAY)"
+    )
+
+
+def incremental_filter(table: bigquery.Table, slack_days: int = DEFAULT_PARTITION_SLACK_DAYS) -> str:
+    """Rows exported after the `@last_value` cursor."""
+    return f"export_time > @last_value {partition_predicate(table, '@last_value', slack_days)}"
+
+
+def lookback_filter(table: bigquery.Table) -> str:
+    """
+    Whole usage days from `@window_start` on, so they can replace the stored days.
+
+    A row is exported after its usage started, so neither partitioning scheme (export or usage
+    day) puts a row of the window into a partition before `@window_start`.
+    """
+    return f"usage_start_time >= @window_start {partition_predicate(table, '@window_start')}"
+
+
+def merge_key_columns(table: bigquery.Table) -> List[str]:
+    """The lookback merge key of a row: its usage day and the export table it comes from."""
+    return [f"DATE(usage_start_time) AS {USAGE_DATE_KEY}", f"'{table.table_id}' AS {EXPORT_TABLE_KEY}"]
+
+
+def build_raw_query(table: bigquery.Table, where: str, usage_date: bool = False) -> str:
+    """Every line item of the export."""
+    select = ", ".join(["*"] + merge_key_columns(table)) if usage_date else "*"
+    return f"""
+            SELECT {select} FROM `{table.project}.{table.dataset_id}.{table.table_id}`
+            WHERE {where}
+            ORDER BY export_time
+        """
+
+
+def build_daily_query(table: bigquery.Table, where: str, usage_date: bool = False) -> str:
+    """
+    Line items grouped to day x dashboard dimensions x labels, with cost, usage and credits summed.
+
+    Only the columns of DAILY_DIMENSIONS and DAILY_MEASURES present in the table are projected.
+    Nested columns are aliased as "record__field" and nested again by `_daily_row`; labels are
+    grouped by their JSON so every label set stays its own row.
+    """
+    columns = get_table_columns(table)
+    day = "TIMESTAMP_TRUNC(usage_start_time, DAY)"
+    keys = [
+        f"{day} AS usage_start_time",
+        f"TIMESTAMP_ADD({day}, INTERVAL 1 DAY) AS usage_end_time",
+    ]
+    if usage_date:
+        keys.append(f"DATE(usage_start_time) AS {USAGE_DATE_KEY}")
+    keys += [
+        f"{column} AS {column.replace('.', '__')}" if "." in column else column
+        for column in DAILY_DIMENSIONS
+        if column in columns
+    ]
+    if "labels" in columns:
+        keys.append("TO_JSON_STRING(labels) AS labels_json")
+    sums = [f"SUM({column}) AS {column.replace('.', '__')}" for column in DAILY_MEASURES if column in columns]
+    if "credits" in columns:
+        sums.append("SUM((SELECT SUM(c.amount) FROM UNNEST(credits) AS c)) AS credits_amount")
+    sums += ["COUNT(*) AS line_items", "MAX(export_time) AS export_time"]
+    if usage_date:
+        # a constant, not grouped by
+        sums.append(f"'{table.table_id}' AS {EXPORT_TABLE_KEY}")
+
+    select = ",\n              ".join(keys + sums)
+    group_by = ", ".join(str(i) for i in range(1, len(keys) + 1))
+    return f"""
+            SELECT
+              {select}
+            FROM `{table.project}.{table.dataset_id}.{table.table_id}`
+            WHERE {where}
+            GROUP BY {group_by}
+            ORDER BY export_time
+        """
+
+
+def build_query(table: bigquery.Table, granularity: str, where: str, usage_date: bool = False) -> str:
+    """The query of a billing table for a granularity, "raw" or "daily"."""
+    if granularity == "daily":
+        return build_daily_query(table, where, usage_date)
+    return build_raw_query(table, where, usage_date)
+
+
+def estimate_bytes(client: bigquery.Client, query: str, query_parameters: List[Any]) -> int:
+    """Bytes the query would process, from a dry run that is neither billed nor cached."""
+    job_config = bigquery.QueryJobConfig(
+        dry_run=True, use_query_cache=False, query_parameters=query_parameters
+    )
+    return client.query(query, job_config=job_config).total_bytes_processed
+
+
+def _daily_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Nests the "record__field" columns of a daily row back, so dlt names them like the raw export."""
+    item: Dict[str, Any] = {}
+    for key, value in row.items():
+        if key == "labels_json":
+            item["labels"] = json.loads(value) if value else []
+        elif "__" in key:
+            record, field = key.split("__", 1)
+            item.setdefault(record, {})[field] = value
+        else:
+            item[key] = value
+    return item
+
+
+def query_billing_table(
+    client: bigquery.Client,
+    table: bigquery.Table,
+    granularity: str,
+    where: str,
+    query_parameters: List[Any],
+    max_bytes_billed: int = None,
+    on_budget_exceeded: str = "abort",
+    usage_date: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Runs the query of a billing table within the bytes budget and yields its rows.
+
+    The query is dry-run first. If it would process more than `max_bytes_billed`, it fails
+    with BytesBudgetExceededError, or with `on_budget_exceeded = "downshift"` a raw query falls
+    back to the daily one if that fits. BigQuery enforces the budget on the query as well.
+    """
+    table_name = table.table_id
+    mode = granularity
+    query = build_query(table, mode, where, usage_date)
+    estimated_bytes = estimate_bytes(client, query, query_parameters)
+    print(f"🔍 {table_name}: {mode} query will process {humanize.naturalsize(estimated_bytes)}")
+    if max_bytes_billed and estimated_bytes > max_bytes_billed:
+        budget = humanize.naturalsize(max_bytes_billed)
+        if on_budget_exceeded == "downshift" and mode == "raw":
+            mode = "daily"
+            query = build_query(table, mode, where, usage_date)
+            estimated_bytes = estimate_bytes(client, query, query_parameters)
+            print(
+                f"⚠️  {table_name}: over the budget of {budget}, downshifted to the daily query"
+                f" ({humanize.naturalsize(estimated_bytes)})"
+            )
+        if estimated_bytes > max_bytes_billed:
+            raise BytesBudgetExceededError(
+                f"Query of {table_name} would process {humanize.naturalsize(estimated_bytes)},"
+                f" more than max_bytes_billed ({budget})"
+            )
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=query_parameters, maximum_bytes_billed=max_bytes_billed or None
+    )
+    with span(
+        "bigquery.query",
+        **{
+            "db.system": "bigquery",
+            "db.statement": query,
+            "bigquery.table": table_name,
+            "bigquery.granularity": mode,
+            "bigquery.estimated_bytes": estimated_bytes,
+        },
+    ) as query_span:
+        job = client.query(query, job_config=job_config)
+        result = job.result()
+        query_span.set_attributes(
+            {
+                "bigquery.job_id": job.job_id,
+                "bigquery.total_bytes_processed": job.total_bytes_processed,
+                "bigquery.total_bytes_billed": job.total_bytes_billed,
+                "rows": result.total_rows,
+            }
+        )
+
+    # the rows are paged in while dlt consumes them, traced once they are all yielded
+    fetch_started = time.time()
+    rows = 0
+    for row in result:
+        rows += 1
+        if mode == "daily":
+            yield _daily_row(row)
+        else:
+            yield {key: value for key, value in row.items()}
+    record_span(
+        "bigquery.fetch",
+        fetch_started,
+        time.time(),
+        **{"db.system": "bigquery", "bigquery.table": table_name, "bigquery.job_id": job.job_id, "rows": rows},
+    )
+
+
 def bigquery_billing_table(
     table_name: str,
     dataset: str = None,
     project_id: str = None,
     initial_start_date: str = None,
+    granularity: str = "raw",
+    max_bytes_billed: int = None,
+    on_budget_exceeded: str = "abort",
+    partition_slack_days: int = DEFAULT_PARTITION_SLACK_DAYS,
+    lookback_days: int = 0,
 ):
     """
     Load a BigQuery billing table incrementally using export_time as cursor
+
+    With granularity "daily" the query groups the line items to day x service, SKU, project,
+    region and labels in BigQuery, which bills, transfers and loads a fraction of the rows.
+    Rows exported late for a day already loaded are appended as additional rows, sums stay exact.
+
+    With `lookback_days` the table is not loaded by export_time but by usage day: every run
+    re-extracts the usage days from `lookback_days` before the previous run on and replaces
+    them at the destination (merge on `export_table` and `usage_date`, so each export table
+    only replaces its own days), and corrections Google exports for recent days replace the
+    rows they correct. The first run of a table loads from `initial_start_date`.
+
+    Ingestion-time partitioned exports are only scanned from `partition_slack_days` before the
+    cursor, or from the start of the lookback window. See `query_billing_table` for the budget.
     """
+    if granularity not in ("raw", "daily"):
+        raise ValueError(f"Unknown granularity {granularity!r}, use 'raw' or 'daily'")
+    if on_budget_exceeded not in ("abort", "downshift"):
+        raise ValueError(f"Unknown on_budget_exceeded {on_budget_exceeded!r}, use 'abort' or 'downshift'")
     # Set up incremental loading with initial start date from config
     if initial_start_date:
         initial_value = pendulum.parse(initial_start_date)
     else:
         initial_value = pendulum.parse("2000-01-01T00:00:00Z")
+    budget = dict(max_bytes_billed=max_bytes_billed, on_budget_exceeded=on_budget_exceeded)
 
-    # Create the dlt resource with incremental loading decorator
-    @dlt.resource(write_disposition="append")
-    def _load_table(
-        incremental: dlt.sources.incremental[str] = dlt.sources.incremental("export_time", initial_value=initial_value)
-    ):
-        # Get service account credentials from .dlt/secrets.toml
-        service_account_info = {
-            "project_id": dlt.secrets.get('source.bigquery.credentials.project_id'),
-            "private_key": dlt.secrets.get('source.bigquery.credentials.private_key'),
-            "client_email": dlt.secrets.get('source.bigquery.credentials.client_email'),
-            "token_uri": dlt.secrets.get('source.bigquery.credentials.token_uri'),
-        }
-        credentials = service_account.Credentials.from_service_account_info(service_account_info)
-        client = bigquery.Client(credentials=credentials, project=project_id)
-
-        # Get the last loaded value for incremental loading
-        last_value = incremental.last_value
-
-        query = f"""
-            SELECT * FROM `{project_id}.{dataset}.{table_name}`
-            WHERE export_time > @last_value
-            ORDER BY export_time
-        """
+    if lookback_days:
 
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("last_value", "TIMESTAMP", last_value)
-            ]
-        )
+        @dlt.resource(write_disposition="merge", merge_key=list(MERGE_KEY))
+        def _load_table():
+            client = get_bigquery_client(project_id)
+            # a free metadata call, for the partitioning and the columns of the daily projection
+            table = client.get_table(f"{project_id}.{dataset}.{table_name}")
 
-        print(f'Loading {table_name} (incremental from {last_value})...')
-        for row in client.query(query, job_config=job_config):
-            yield {key: value for key, value in row.items()}
+            # the tables of all exports load into one resource, keep the last run per table
+            last_runs = dlt.current.resource_state().setdefault("lookback_last_run", {})
+            if table_name in last_runs:
+                window_start = pendulum.parse(last_runs[table_name]).subtract(days=lookback_days)
+            else:
+                window_start = initial_value
+            window_start = window_start.start_of("day")
+            run_day = pendulum.now("UTC").start_of("day")
+
+            print(f"Loading {table_name} ({granularity}, usage days from {window_start.to_date_string()})...")
+            yield from query_billing_table(
+                client,
+                table,
+                granularity,
+                lookback_filter(table),
+                [bigquery.ScalarQueryParameter("window_start", "TIMESTAMP", window_start)],
+                usage_date=True,
+                **budget,
+            )
+            last_runs[table_name] = run_day.isoformat()
+
+    else:
+
+        # Create the dlt resource with incremental loading decorator
+        @dlt.resource(write_disposition="append")
+        def _load_table(
+            incremental: dlt.sources.incremental[str] = dlt.sources.incremental("export_time", initial_value=initial_value)
+        ):
+            client = get_bigquery_client(project_id)
+            table = client.get_table(f"{project_id}.{dataset}.{table_name}")
+
+            # Get the last loaded value for incremental loading
+            last_value = incremental.last_value
+
+            print(f'Loading {table_name} ({granularity}, incremental from {last_value})...')
+            yield from query_billing_table(
+                client,
+                table,
+                granularity,
+                incremental_filter(table, partition_slack_days),
+                [bigquery.ScalarQueryParameter("last_value", "TIMESTAMP", last_value)],
+                **budget,
+            )
 
     # Set the resource name to 'bigquery_billing_table' to maintain consistent output directory
     return _load_table.with_name("bigquery_billing_table")
 
 
+def check_lookback_table(pipeline: dlt.Pipeline, table_dir: pathlib.Path = None) -> None:
+    """
+    Refuses the lookback mode on a billing table that holds rows without the merge key.
+
+    Rows loaded in append mode (or by lookback runs before the export table was part of the
+    merge key) are never replaced, the re-extracted usage days would be stored twice.
+
+    Args:
+        pipeline (dlt.Pipeline): The GCP pipeline, for SQL destinations.
+        table_dir (pathlib.Path): Directory of the table with the filesystem destination.
+
+    Raises:
+        LookbackDatasetError: If the table has rows without export table or usage day.
+    """
+    table_name = "bigquery_billing_table"
+    if table_dir is not None:
+        rows = filesystem_rows_without_merge_key(table_dir)
+    else:
+        with pipeline.destination_client() as client:
+            exists, columns = client.get_storage_table(table_name)
+        if not exists:
+            return
+        with pipeline.sql_client() as client:
+            where = (
+                " OR ".join(f"{key} IS NULL" for key in MERGE_KEY)
+                if all(key in columns for key in MERGE_KEY)
+                else "1 = 1"
+            )
+            rows = client.execute_sql(
+                f"SELECT COUNT(*) FROM {client.make_qualified_table_name(table_name)} WHERE {where}"
+            )[0][0]
+    if rows:
+        raise LookbackDatasetError(
+            f"{table_name} of dataset {pipeline.dataset_name} has {rows} row(s) without"
+            f" {' and '.join(MERGE_KEY)}, lookback_days would load their usage days a second time."
+            " Load the lookback mode into a new dataset_name or set lookback_days = 0."
+        )
+
+
+@source_lock("gcp")
 def load_standalone_table_resource() -> None:
     """Load BigQuery billing export tables with environment-driven destination"""
 
@@ -69,11 +424,6 @@ def load_standalone_table_resource() -> None:
     destination = os.getenv("DLT_DESTINATION", "filesystem")
 
     # Load configuration from config.toml
-    try:
-        pipeline_name = dlt.config["pipeline.pipeline_name"]
-    except KeyError:
-        pipeline_name = "cloud_cost_analytics"
-
     try:
         dataset_name = dlt.config["sources.gcp_billing.dataset_name"]
     except KeyError:
@@ -85,6 +435,38 @@ def load_standalone_table_resource() -> None:
     except KeyError:
         initial_start_date = None
 
+    # "daily" aggregates the line items in BigQuery, "raw" loads every line item
+    try:
+        granularity = dlt.config["sources.gcp_billing.granularity"]
+    except KeyError:
+        granularity = "raw"
+
+    # Budget of bytes processed per query, checked with a dry run (optional)
+    try:
+        max_bytes_billed = int(dlt.config["sources.gcp_billing.max_bytes_billed"])
+    except KeyError:
+        max_bytes_billed = None
+    try:
+        on_budget_exceeded = dlt.config["sources.gcp_billing.on_budget_exceeded"]
+    except KeyError:
+        on_budget_exceeded = "abort"
+    try:
+        partition_slack_days = int(dlt.config["sources.gcp_billing.partition_slack_days"])
+    except KeyError:
+        partition_slack_days = DEFAULT_PARTITION_SLACK_DAYS
+
+    # Re-extract the usage days of this many days before the last run and replace them (0: off)
+    try:
+        lookback_days = int(dlt.config["sources.gcp_billing.lookback_days"])
+    except KeyError:
+        lookback_days = 0
+
+    # Repetitive string columns (services, SKUs, regions, ...) as LowCardinality on ClickHouse
+    try:
+        low_cardinality = dlt.config["sources.gcp_billing.low_cardinality"]
+    except KeyError:
+        low_cardinality = True
+
     project_id = dlt.secrets.get('source.bigquery.credentials.project_id')
     dataset = dlt.config["sources.gcp_billing.dataset"]
     table_names = dlt.config["sources.gcp_billing.table_names"]
@@ -92,21 +474,51 @@ def load_standalone_table_resource() -> None:
     # Create pipeline with environment-driven destination
     # Local: destination="filesystem" writes parquet to viz_rill/data/
     # Production: destination="clickhouse" writes directly to ClickHouse Cloud
-    pipeline = dlt.pipeline(
-        pipeline_name=pipeline_name,
-        destination=destination,
-        dataset_name=dataset_name,
-        # export_schema_path="exported_schema/google_cost_schema.json"
+    # The pipeline has its own name and state, cursors of the shared pipeline are migrated once
+    pipeline = source_pipeline(
+        "gcp", destination, dataset_name, resource_names=["bigquery_billing_table"]
     )
 
     # Create resources for each table with initial start date
-    resources = [bigquery_billing_table(table_name, dataset=dataset, project_id=project_id, initial_start_date=initial_start_date) for table_name in table_names]
+    resources = [
+        bigquery_billing_table(
+            table_name,
+            dataset=dataset,
+            project_id=project_id,
+            initial_start_date=initial_start_date,
+            granularity=granularity,
+            max_bytes_billed=max_bytes_billed,
+            on_budget_exceeded=on_budget_exceeded,
+            partition_slack_days=partition_slack_days,
+            lookback_days=lookback_days,
+        )
+        for table_name in table_names
+    ]
 
     # Run the pipeline with incremental (append) write disposition
     # This will only load new records based on export_time
+    # With lookback_days the re-extracted usage days are merged (delete-insert on export_table and usage_date)
     # Use loader_file_format="parquet" in run() to generate parquet files
+    dataset_dir = None
+    if destination == "filesystem":
+        output_dir = dlt.config["destination.filesystem.bucket_url"].removeprefix("file://")
+        dataset_dir = pathlib.Path(output_dir) / dataset_name
+        # larger row groups, each holds one dictionary per column
+        configure_parquet_row_groups(pipeline)
+    if lookback_days:
+        check_lookback_table(pipeline, dataset_dir / "bigquery_billing_table" if dataset_dir else None)
     info = pipeline.run(resources, loader_file_format="parquet")
 
+    if lookback_days and dataset_dir:
+        # The filesystem destination appends plain parquet instead of merging,
+        # so replace the re-extracted usage days ourselves
+        days = replace_filesystem_days(dataset_dir, "bigquery_billing_table")
+        print(f"Replaced {len(days)} export table usage day(s) of bigquery_billing_table")
+    if destination == "clickhouse" and low_cardinality:
+        report = low_cardinality_clickhouse(pipeline, "bigquery_billing_table", LOW_CARDINALITY_COLUMNS)
+        print_bytes_report("bigquery_billing_table as LowCardinality", report)
+    record_metrics(pipeline, "gcp")
+
     # Print concise summary
     print(f"Pipeline {pipeline.pipeline_name} load step completed in {info}")
     print(f"Successfully loaded {len(table_names)} tables to {pipeline.destination} (incremental)")
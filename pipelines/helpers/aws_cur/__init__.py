@@ -0,0 +1,96 @@
+"""AWS Cost and Usage Report (CUR) helpers"""
+
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import dlt
+from dlt.sources.credentials import FileSystemCredentials
+from dlt.sources.filesystem import FileItemDict, fsspec_filesystem, glob_files
+from dlt.sources.filesystem.helpers import FilesystemConfigurationResource
+from fsspec import AbstractFileSystem
+
+from .helpers import (
+    list_manifests,
+    manifest_data_files,
+    manifest_execution_id,
+    read_manifest,
+    select_open_periods,
+)
+from .merge import merge_filesystem_table
+from .readers import read_cur_parquet
+from .settings import (
+    BILLING_PERIOD_DIR,
+    BILLING_PERIOD_KEY,
+    OPEN_BILLING_PERIODS,
+    PRIMARY_KEY,
+)
+
+
+@dlt.resource(section="filesystem", spec=FilesystemConfigurationResource, primary_key="file_url")
+def cur_billing_period_files(
+    bucket_url: str = dlt.secrets.value,
+    credentials: Union[FileSystemCredentials, AbstractFileSystem] = dlt.secrets.value,
+    export_path: str = None,
+    initial_start_date: Optional[str] = None,
+    open_periods: int = OPEN_BILLING_PERIODS,
+    kwargs: Optional[Dict[str, Any]] = None,
+    client_kwargs: Optional[Dict[str, Any]] = None,
+) -> Iterator[List[FileItemDict]]:
+    """
+    Lists the data files of CUR 2.0 billing periods that were (re-)exported since the last run.
+
+    AWS rewrites all files of a `BILLING_PERIOD=YYYY-MM` folder whenever it updates that month.
+    Instead of tracking file modification dates over the whole bucket, this resource reads the
+    manifest of each open billing period and yields the period's files only when the manifest
+    `executionId` changed. Files that are not listed in the manifest are superseded leftovers of
+    an earlier export and are skipped. Each period is yielded as one page, so combined with
+    `merge_key=BILLING_PERIOD_KEY` the destination replaces exactly that period.
+
+    Credentials are resolved from `[sources.filesystem.credentials]`, same as the dlt filesystem source.
+
+    Args:
+        bucket_url (str): The url to the bucket, e.g. s3://my-cur-bucket.
+        credentials (Union[FileSystemCredentials, AbstractFileSystem]): The credentials to the filesystem or a fsspec client.
+        export_path (str): Path of the CUR 2.0 export inside the bucket, e.g. cur/my-export.
+        initial_start_date (Optional[str]): Ignore billing periods before this date. Format: YYYY-MM-DD.
+        open_periods (int): Number of most recent billing periods that are checked for re-exports on every run.
+            Older periods are only loaded once.
+        kwargs (Optional[Dict[str, Any]]): Additional arguments passed to fsspec constructor ie. dict(config_kwargs={"max_pool_connections": 16}) for s3fs
+        client_kwargs (Optional[Dict[str, Any]]): Additional arguments passed to underlying fsspec native client ie. dict(endpoint_url="http://localhost:9000")
+
+    Yields:
+        List[FileItemDict]: The data files of one changed billing period.
+    """
+    if isinstance(credentials, AbstractFileSystem):
+        fs_client = credentials
+    else:
+        fs_client = fsspec_filesystem(
+            bucket_url, credentials, kwargs=kwargs, client_kwargs=client_kwargs
+        )[0]
+
+    loaded_periods = dlt.current.resource_state().setdefault("billing_periods", {})
+    manifests = list_manifests(fs_client, bucket_url, export_path)
+    start_period = initial_start_date[:7] if initial_start_date else None
+
+    for period in select_open_periods(manifests, loaded_periods, start_period, open_periods):
+        manifest = manifests[period]
+        content = read_manifest(fs_client, manifest)
+        execution_id = manifest_execution_id(manifest, content)
+        if loaded_periods.get(period, {}).get("execution_id") == execution_id:
+            continue
+
+        data_files = set(manifest_data_files(content))
+        period_glob = f"{export_path}/data/{BILLING_PERIOD_DIR}{period}/*.parquet"
+        files = []
+        for file_model in glob_files(fs_client, bucket_url, period_glob):
+            if data_files and file_model["file_name"] not in data_files:
+                print(f"  – skip superseded {file_model['relative_path']}")
+                continue
+            files.append(FileItemDict(file_model, fs_client))
+
+        print(f"Billing period {period}: export {execution_id} with {len(files)} file(s)")
+        if files:
+            yield files
+        loaded_periods[period] = {
+            "execution_id": execution_id,
+            "files": [f["file_name"] for f in files],
+        }
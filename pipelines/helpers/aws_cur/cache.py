@@ -0,0 +1,128 @@
+"""
+Local content-addressed cache for CUR files downloaded from S3.
+
+Files are stored under `<cache_dir>/<key[:2]>/<key>.parquet` where the key is derived from the
+S3 ETag and size, so a file is downloaded once no matter how often dlt state is cleared or
+`initial_start_date` is moved. Every entry has a `.sha256` sidecar that is checked before the
+entry is used, recently used entries are kept and the least recently used ones are evicted
+once the cache grows over its size cap.
+"""
+
+import hashlib
+import os
+import pathlib
+import threading
+from typing import Tuple
+
+from dlt.sources.filesystem import FileItemDict
+
+_HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _file_digests(path: pathlib.Path) -> Tuple[str, str]:
+    """Returns the md5 and sha256 hex digests of a file."""
+    md5, sha256 = hashlib.md5(), hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            md5.update(chunk)
+            sha256.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest()
+
+
+class CurFileCache:
+    """
+    Opt-in local cache for remote CUR files with LRU eviction and integrity checks.
+
+    Args:
+        cache_dir (pathlib.Path): Directory that holds the cached files.
+        max_size_bytes (int): Size cap, least recently used files are evicted above it.
+        verify (bool): Check the sha256 of an entry before every use. Defaults to True.
+    """
+
+    def __init__(self, cache_dir: pathlib.Path, max_size_bytes: int, verify: bool = True) -> None:
+        self.cache_dir = pathlib.Path(cache_dir).expanduser()
+        self.max_size_bytes = max_size_bytes
+        self.verify = verify
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def cache_key(self, file_obj: FileItemDict) -> Tuple[str, str, int]:
+        """
+        Derives the cache key of a remote file from its ETag and size.
+
+        Returns:
+            Tuple[str, str, int]: The key, the ETag (empty if the filesystem has none) and the size in bytes.
+        """
+        fs_client = file_obj.fsspec
+        info = fs_client.info(fs_client._strip_protocol(file_obj["file_url"]))
+        etag = str(info.get("ETag") or info.get("etag") or "").strip('"')
+        size = int(info.get("size") or file_obj.get("size_in_bytes") or 0)
+        # without an ETag fall back to the modification date to detect new content
+        version = etag or file_obj["modification_date"].isoformat()
+        key = hashlib.sha256(f"{version}:{size}".encode()).hexdigest()
+        return key, etag, size
+
+    def _is_valid(self, path: pathlib.Path, checksum_path: pathlib.Path, size: int) -> bool:
+        if not path.exists() or not checksum_path.exists():
+            return False
+        if path.stat().st_size != size:
+            return False
+        if self.verify:
+            return _file_digests(path)[1] == checksum_path.read_text().strip()
+        return True
+
+    def fetch(self, file_obj: FileItemDict) -> pathlib.Path:
+        """
+        Returns a local path with the content of `file_obj`, downloading it on a cache miss.
+
+        A download is written to a temp file, its size and (for single part uploads) its md5
+        are checked against the S3 listing before it is moved into place.
+
+        Raises:
+            IOError: If the downloaded file does not match the remote size or ETag.
+        """
+        key, etag, size = self.cache_key(file_obj)
+        path = self.cache_dir / key[:2] / f"{key}.parquet"
+        checksum_path = path.with_suffix(".sha256")
+
+        if self._is_valid(path, checksum_path, size):
+            os.utime(path)  # mark as recently used
+            print(f"  cache hit {file_obj['file_name']}")
+            return path
+        if path.exists():
+            print(f"  ⚠ cache entry for {file_obj['file_name']} failed verification, downloading again")
+            path.unlink()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        fs_client = file_obj.fsspec
+        fs_client.get_file(fs_client._strip_protocol(file_obj["file_url"]), str(tmp))
+
+        md5, sha256 = _file_digests(tmp)
+        # multipart ETags ("<md5>-<parts>") are not the md5 of the content
+        if tmp.stat().st_size != size or (etag and "-" not in etag and md5 != etag):
+            tmp.unlink()
+            raise IOError(f"Downloaded {file_obj['file_url']} does not match its size or ETag")
+
+        checksum_path.write_text(sha256)
+        os.replace(tmp, path)
+        print(f"  cached {file_obj['file_name']} ({size / 1024 / 1024:.1f} MB)")
+        return path
+
+    def evict(self) -> int:
+        """
+        Deletes the least recently used entries until the cache is under its size cap.
+
+        Returns:
+            int: Number of evicted files.
+        """
+        entries = [(p, p.stat()) for p in self.cache_dir.glob("*/*.parquet")]
+        total = sum(stat.st_size for _p, stat in entries)
+        evicted = 0
+        for path, stat in sorted(entries, key=lambda e: e[1].st_mtime):
+            if total <= self.max_size_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".sha256").unlink(missing_ok=True)
+            total -= stat.st_size
+            evicted += 1
+        return evicted
@@ -0,0 +1,211 @@
+"""AWS CUR source helpers"""
+
+import fnmatch
+import json
+import posixpath
+import re
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from dlt.common.storages.fsspec_filesystem import FileItem, FileItemDict, glob_files
+from fsspec import AbstractFileSystem
+
+from .settings import ACCOUNT_COLUMN, BILLING_PERIOD_DIR, MANIFEST_GLOB, TIME_COLUMNS, TIME_INTERVAL_COLUMN
+
+
+def export_path_from_glob(file_glob: str) -> str:
+    """
+    Derives the CUR 2.0 export root from a data file glob.
+
+    Example: "cur/CUR-export-test/data/**/*.parquet" -> "cur/CUR-export-test"
+    """
+    return file_glob.split("/data/", 1)[0].rstrip("/")
+
+
+def billing_period_of(path: str) -> Optional[str]:
+    """Returns the YYYY-MM billing period of a path containing a BILLING_PERIOD=YYYY-MM folder."""
+    for part in path.split("/"):
+        if part.startswith(BILLING_PERIOD_DIR):
+            return part[len(BILLING_PERIOD_DIR):]
+    return None
+
+
+def list_manifests(
+    fs_client: AbstractFileSystem, bucket_url: str, export_path: str
+) -> Dict[str, FileItem]:
+    """
+    Lists the manifest of every billing period of an export.
+
+    Only the metadata folder is listed (one small object per month), the data
+    folders are not touched until a period is known to have changed.
+
+    Returns:
+        Dict[str, FileItem]: Manifest file items keyed by billing period.
+    """
+    manifests: Dict[str, FileItem] = {}
+    file_glob = f"{export_path}/metadata/{BILLING_PERIOD_DIR}*/{MANIFEST_GLOB}"
+    for item in glob_files(fs_client, bucket_url, file_glob):
+        period = billing_period_of(item["relative_path"])
+        if period:
+            manifests[period] = item
+    return manifests
+
+
+def select_open_periods(
+    periods: Iterable[str],
+    loaded_periods: Dict[str, Any],
+    start_period: Optional[str] = None,
+    open_periods: int = 2,
+) -> List[str]:
+    """
+    Picks the billing periods that need their manifest checked.
+
+    A period is open if it is one of the `open_periods` most recent ones or if it was never loaded.
+    Older periods that were already loaded are considered closed and are skipped entirely.
+
+    Args:
+        periods (Iterable[str]): All billing periods found in the export (YYYY-MM).
+        loaded_periods (Dict[str, Any]): Billing periods already loaded, from the resource state.
+        start_period (Optional[str]): Ignore periods before this one (YYYY-MM).
+        open_periods (int): Number of most recent periods that are always checked.
+
+    Returns:
+        List[str]: Open billing periods in ascending order.
+    """
+    periods = sorted(p for p in periods if start_period is None or p >= start_period)
+    recent = set(periods[-open_periods:]) if open_periods > 0 else set()
+    return [p for p in periods if p in recent or p not in loaded_periods]
+
+
+def read_manifest(fs_client: AbstractFileSystem, manifest: FileItem) -> Dict[str, Any]:
+    """Reads a CUR 2.0 manifest JSON file."""
+    return json.loads(FileItemDict(manifest, fs_client).read_bytes())
+
+
+def manifest_execution_id(manifest: FileItem, content: Dict[str, Any]) -> str:
+    """Identifies an export run, falls back to the manifest modification date."""
+    return content.get("executionId") or manifest["modification_date"].isoformat()
+
+
+def manifest_data_files(content: Dict[str, Any]) -> List[str]:
+    """Returns the file names of the data files that make up the current export of a period."""
+    return [posixpath.basename(url) for url in content.get("dataFiles", [])]
+
+
+def select_columns(
+    names: Sequence[str],
+    columns: Optional[Sequence[str]] = None,
+    exclude_columns: Optional[Sequence[str]] = None,
+    required: Sequence[str] = (),
+) -> List[str]:
+    """
+    Applies a column allowlist and denylist to the columns of a CUR file.
+
+    Both lists accept exact names and glob patterns (e.g. "product_*"). `required` columns
+    that exist in the file are always kept, so the merge keys survive any projection.
+
+    Args:
+        names (Sequence[str]): Column names of the file, in file order.
+        columns (Optional[Sequence[str]]): Columns to keep. Defaults to None which keeps all.
+        exclude_columns (Optional[Sequence[str]]): Columns to drop after applying `columns`.
+        required (Sequence[str]): Columns that are never dropped.
+
+    Returns:
+        List[str]: Selected column names, in file order.
+    """
+
+    def matches(name: str, patterns: Sequence[str]) -> bool:
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+    selected = []
+    for name in names:
+        if name in required:
+            selected.append(name)
+        elif columns and not matches(name, columns):
+            continue
+        elif exclude_columns and matches(name, exclude_columns):
+            continue
+        else:
+            selected.append(name)
+    return selected
+
+
+def prefetch_map(
+    executor: Executor, fn: Callable[..., Any], tasks: Iterable[Tuple[Any, ...]], window: int
+) -> Iterator[Any]:
+    """
+    Like `executor.map` but lazy: at most `window` tasks are submitted ahead of the consumer.
+
+    Results are yielded in submission order, `tasks` is only advanced as results are consumed,
+    which bounds both the number of in-flight requests and the memory held by finished results.
+    """
+    pending: Deque[Future] = deque()
+    for args in tasks:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def account_table_name(account: str) -> str:
+    """Derives a table name from an account name, e.g. "Payer-A" -> "cur_payer_a"."""
+    return "cur_" + re.sub(r"[^0-9a-z]+", "_", account.lower()).strip("_")
+
+
+def add_account_column(items: Any, account: str) -> Any:
+    """Adds the account name to a CUR row (dict) or to an Arrow `RecordBatch` of rows."""
+    if isinstance(items, dict):
+        items[ACCOUNT_COLUMN] = account
+        return items
+    import pyarrow as pa
+
+    return items.append_column(ACCOUNT_COLUMN, pa.array([account] * items.num_rows, pa.string()))
+
+
+def add_time_columns(batch: Any) -> Any:
+    """
+    Adds the typed `usage_start`, `usage_end` (UTC timestamps) and `date` columns to an Arrow
+    `RecordBatch` of CUR rows, parsed from the `identity_time_interval` string.
+
+    Intervals that cannot be parsed give nulls, the rows are loaded anyway.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if TIME_INTERVAL_COLUMN not in batch.schema.names:
+        return batch
+    # a null struct for intervals without "/", strptime then gives nulls as well
+    bounds = pc.extract_regex(batch[TIME_INTERVAL_COLUMN], r"^(?P<start>[^/]*)/(?P<end>.*)$")
+    usage_start, usage_end = [
+        pc.strptime(pc.struct_field(bounds, [i]), format="%Y-%m-%dT%H:%M:%SZ", unit="s", error_is_null=True)
+        .cast(pa.timestamp("s", tz="UTC"))
+        for i in (0, 1)
+    ]
+    for name, column in zip(TIME_COLUMNS, (usage_start, usage_end, usage_start.cast(pa.date32()))):
+        batch = batch.append_column(name, column)
+    return batch
+
+
+def union_all_sql(tables: Dict[str, Sequence[str]]) -> str:
+    """
+    Builds a UNION ALL over tables whose columns differ, e.g. CUR exports with different tag columns.
+
+    Every select lists the union of all columns, a column missing in a table is selected as NULL.
+    Plain UNION ALL is used (not UNION ALL BY NAME) so the view works on ClickHouse as well.
+
+    Args:
+        tables (Dict[str, Sequence[str]]): Qualified table names mapped to their (escaped) column names.
+
+    Returns:
+        str: The SELECT statement.
+    """
+    all_columns: List[str] = []
+    for columns in tables.values():
+        all_columns.extend(c for c in columns if c not in all_columns)
+    selects = []
+    for table, columns in tables.items():
+        select_list = ", ".join(c if c in columns else f"NULL AS {c}" for c in all_columns)
+        selects.append(f"SELECT {select_list} FROM {table}")
+    return "\nUNION ALL\n".join(selects)
@@ -0,0 +1,111 @@
+"""
+Local merge for AWS CUR tables written by the dlt filesystem destination.
+
+dlt only supports `write_disposition="merge"` on the filesystem destination for
+delta/iceberg tables, for plain parquet it silently falls back to append. CUR files
+re-exported by AWS during the month therefore land as duplicates.
+
+`merge_filesystem_table` runs after each load: it takes the parquet files dlt just
+wrote, finds the billing periods they touch and upserts them by primary key into one
+compacted file per billing period. Periods not present in the new files are not rewritten.
+When the new files hold complete billing periods (see `cur_billing_period_files`), the
+periods are replaced instead, which also drops line items AWS removed in the re-export.
+"""
+
+import os
+import pathlib
+from typing import List, Sequence
+
+import duckdb
+
+from .settings import BILLING_PERIOD_SQL, PARTITION_FILE_PREFIX, PRIMARY_KEY, TIME_COLUMNS_SQL
+
+
+def _sql_list(paths: Sequence[pathlib.Path]) -> str:
+    return "[" + ", ".join(f"'{p.as_posix()}'" for p in paths) + "]"
+
+
+def merge_filesystem_table(
+    table_dir: pathlib.Path,
+    primary_key: Sequence[str] = PRIMARY_KEY,
+    replace_periods: bool = False,
+) -> List[str]:
+    """
+    Upsert freshly loaded parquet files into billing-period partition files.
+
+    Rows are deduplicated on `primary_key`, the row from the most recent `_dlt_load_id` wins.
+    Each affected partition is written to a temp file first and swapped in atomically, the
+    fresh dlt files are deleted only after all partitions are written, so a crashed run is
+    simply merged again on the next run.
+
+    Args:
+        table_dir (pathlib.Path): Directory of the table, e.g. viz_rill/data/aws_costs/cur_export_test_00001.
+        primary_key (Sequence[str]): Columns identifying a CUR line item.
+        replace_periods (bool): If True the new files are complete billing periods and replace
+            the existing partition instead of being upserted into it.
+
+    Returns:
+        List[str]: Billing periods (YYYY-MM) that were rewritten.
+    """
+    table_dir = pathlib.Path(table_dir)
+    if not table_dir.exists():
+        return []
+
+    fresh_files = sorted(
+        p for p in table_dir.glob("*.parquet") if not p.name.startswith(PARTITION_FILE_PREFIX)
+    )
+    if not fresh_files:
+        return []
+
+    con = duckdb.connect(database=":memory:")
+    con.execute(
+        f"""
+        CREATE VIEW fresh AS
+          SELECT *, {BILLING_PERIOD_SQL} AS _billing_period
+          FROM read_parquet({_sql_list(fresh_files)}, union_by_name = true)
+        """
+    )
+    periods = [
+        row[0]
+        for row in con.execute("SELECT DISTINCT _billing_period FROM fresh ORDER BY 1").fetchall()
+    ]
+
+    # rows of partitions written before the typed time columns were extracted get them here, once
+    fresh_columns = {row[0] for row in con.execute("DESCRIBE SELECT * FROM fresh").fetchall()}
+    backfill = [name for name in TIME_COLUMNS_SQL if name in fresh_columns]
+    select_sql = (
+        "* REPLACE ("
+        + ", ".join(f'COALESCE("{name}", {TIME_COLUMNS_SQL[name]}) AS "{name}"' for name in backfill)
+        + ")"
+        if backfill
+        else "*"
+    )
+    # partitions sorted by time keep the parquet row group statistics of date filters tight
+    order_sql = 'ORDER BY "usage_start"' if "usage_start" in backfill else ""
+
+    key_sql = ", ".join(f'"{k}"' for k in primary_key)
+    for period in periods:
+        target = table_dir / f"{PARTITION_FILE_PREFIX}{period}.parquet"
+        tmp = table_dir / f"{target.name}.tmp"
+        period_literal = period.replace("'", "''")
+
+        union_sql = f"SELECT * EXCLUDE (_billing_period) FROM fresh WHERE _billing_period = '{period_literal}'"
+        if target.exists() and not replace_periods:
+            union_sql += f"\nUNION ALL BY NAME\nSELECT * FROM read_parquet('{target.as_posix()}')"
+
+        con.execute(
+            f"""
+            COPY (
+              SELECT {select_sql} FROM ({union_sql})
+              QUALIFY ROW_NUMBER() OVER (PARTITION BY {key_sql} ORDER BY _dlt_load_id DESC) = 1
+              {order_sql}
+            ) TO '{tmp.as_posix()}' (FORMAT PARQUET)
+            """
+        )
+        os.replace(tmp, target)
+        print(f"  ✓ merged billing period {period} → {target.name}")
+
+    con.close()
+    for path in fresh_files:
+        path.unlink()
+    return periods
@@ -0,0 +1,223 @@
+"""Parquet reader for AWS CUR files with column projection, predicate pushdown and parallel range reads"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import dlt
+from dlt.common.typing import TDataItems
+from dlt.sources.filesystem import FileItemDict
+
+from ..work_queue import open_work_queue, run_until_done
+from .cache import CurFileCache
+from .helpers import add_time_columns, prefetch_map, select_columns
+from .rollup import rollup_daily
+from .settings import (
+    CACHE_MAX_SIZE_GB,
+    READER_BATCH_SIZE,
+    READER_MAX_WORKERS,
+    READER_PREFETCH,
+    REQUIRED_COLUMNS,
+)
+from .staging import CUR_FILES_QUEUE, cur_file_task, stage_cur_file
+
+
+def _split_row_groups(
+    file_obj: FileItemDict,
+    columns: Optional[Sequence[str]],
+    exclude_columns: Optional[Sequence[str]],
+    filter_expression: Any,
+    cache: Optional[CurFileCache] = None,
+) -> Tuple[FileItemDict, Any, List[str], List[Any]]:
+    """
+    Reads the footer of a CUR file and splits it into one fragment per row group.
+
+    Row groups whose statistics cannot match `filter_expression` are dropped here,
+    before any of their data is requested. With a `cache` remote files are read
+    from (or first downloaded to) the local cache instead.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow.fs import FSSpecHandler, PyFileSystem
+
+    fs_client = file_obj.fsspec
+    if "file" in fs_client.protocol:
+        dataset = ds.dataset(file_obj.local_file_path, format="parquet")
+    elif cache is not None:
+        dataset = ds.dataset(str(cache.fetch(file_obj)), format="parquet")
+    else:
+        dataset = ds.dataset(
+            fs_client._strip_protocol(file_obj["file_url"]),
+            format="parquet",
+            filesystem=PyFileSystem(FSSpecHandler(fs_client)),
+        )
+    projection = select_columns(
+        dataset.schema.names, columns, exclude_columns, required=REQUIRED_COLUMNS
+    )
+    row_groups = []
+    for fragment in dataset.get_fragments():
+        row_groups.extend(fragment.split_by_row_group(filter_expression))
+    print(
+        f"  reading {file_obj['file_name']}: {len(projection)} of {len(dataset.schema.names)} columns,"
+        f" {len(row_groups)} row group(s)"
+        + (f", filter {filter_expression}" if filter_expression is not None else "")
+    )
+    return file_obj, dataset.schema, projection, row_groups
+
+
+def _read_row_group(fragment: Any, schema: Any, projection: List[str], filter_expression: Any) -> Any:
+    """Fetches the projected column chunks of one row group with byte-range requests."""
+    return fragment.to_table(schema=schema, columns=projection, filter=filter_expression)
+
+
+def _read_cur_parquet(
+    items: Iterable[FileItemDict],
+    columns: Optional[Sequence[str]] = None,
+    exclude_columns: Optional[Sequence[str]] = None,
+    row_filter: Optional[List[Any]] = None,
+    chunksize: int = READER_BATCH_SIZE,
+    use_pyarrow: bool = False,
+    max_workers: int = READER_MAX_WORKERS,
+    prefetch: int = READER_PREFETCH,
+    cache_dir: Optional[str] = None,
+    cache_max_size_gb: float = CACHE_MAX_SIZE_GB,
+    work_queue: Optional[str] = None,
+    staging_dir: Optional[str] = None,
+    bucket_url: Optional[str] = None,
+    time_columns: bool = True,
+    daily_rollup: bool = False,
+) -> Iterator[TDataItems]:
+    """
+    Reads CUR parquet files with Arrow, row group by row group and in parallel.
+
+    Unlike `read_parquet`, which streams every column of every row group through a single
+    connection, each file is split into row groups that are fetched concurrently with
+    byte-range requests for the projected column chunks only. Row groups whose statistics
+    cannot match `row_filter` are never requested. Footers of all files in a page are read
+    concurrently as well, so several files are downloaded in parallel.
+
+    At most `max_workers` requests run at the same time and at most `prefetch` row groups
+    are held in memory ahead of the consumer. Results are yielded in file and row group order.
+
+    Args:
+        items (Iterable[FileItemDict]): CUR files to read.
+        columns (Optional[Sequence[str]]): Columns to keep, names or glob patterns. Defaults to None which keeps all.
+        exclude_columns (Optional[Sequence[str]]): Columns to drop, names or glob patterns.
+        row_filter (Optional[List[Any]]): Rows to keep in pyarrow `filters` notation, e.g.
+            [["line_item_unblended_cost", "!=", 0]]. A list of such lists is OR-ed. Defaults to None.
+        chunksize (int, optional): The number of records to process at once, defaults to 10000.
+        use_pyarrow (bool, optional): When False (default) batches are converted to Python
+            lists of dictionaries, when True `pyarrow` `RecordBatch` objects are yielded.
+        max_workers (int, optional): Size of the download thread pool, defaults to 8. Use 1 to read sequentially.
+        prefetch (int, optional): Number of row groups fetched ahead of the consumer, defaults to 16.
+        cache_dir (Optional[str], optional): Local directory to cache remote files in, keyed by ETag and size.
+            Defaults to None which disables the cache.
+        cache_max_size_gb (float, optional): Size cap of the cache, least recently used files are evicted above it.
+        work_queue (Optional[str], optional): Url of a work queue (sqlite:///... or file:///...). When set, the files
+            are read by `aws_pipeline.py --worker` processes (and this one) into `staging_dir` and loaded from there.
+        staging_dir (Optional[str], optional): Directory of the staged files, shared by all workers.
+        bucket_url (Optional[str], optional): Bucket of the files, workers open them with their own credentials.
+        time_columns (bool, optional): Add the typed `usage_start`, `usage_end` and `date` columns parsed from
+            `identity_time_interval` to every batch, before it is converted to dictionaries. Defaults to True.
+        daily_rollup (bool, optional): Roll up the hourly line items of the page to one row per day and line
+            item key (see `rollup.py`). Defaults to False.
+
+    Returns:
+        TDataItem: The file content
+    """
+    from pyarrow import parquet as pq
+
+    if work_queue:
+        yield from _read_staged_cur_parquet(
+            items,
+            columns,
+            exclude_columns,
+            row_filter,
+            chunksize,
+            use_pyarrow,
+            work_queue,
+            staging_dir,
+            bucket_url,
+            time_columns,
+            daily_rollup,
+        )
+        return
+
+    filter_expression = pq.filters_to_expression(row_filter) if row_filter else None
+    cache = CurFileCache(cache_dir, int(cache_max_size_gb * 1024**3)) if cache_dir else None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="cur_reader") as executor:
+        opened_files = prefetch_map(
+            executor,
+            _split_row_groups,
+            ((file_obj, columns, exclude_columns, filter_expression, cache) for file_obj in items),
+            window=max(1, max_workers),
+        )
+        row_group_tasks = (
+            (fragment, schema, projection, filter_expression)
+            for _file_obj, schema, projection, row_groups in opened_files
+            for fragment in row_groups
+        )
+        batches = (
+            batch
+            for table in prefetch_map(executor, _read_row_group, row_group_tasks, window=max(1, prefetch))
+            for batch in table.to_batches(max_chunksize=chunksize)
+        )
+        yield from _output_batches(batches, chunksize, use_pyarrow, time_columns, daily_rollup)
+
+    if cache is not None and (evicted := cache.evict()):
+        print(f"  evicted {evicted} file(s) from the CUR cache")
+
+
+def _read_staged_cur_parquet(
+    items: Iterable[FileItemDict],
+    columns: Optional[Sequence[str]],
+    exclude_columns: Optional[Sequence[str]],
+    row_filter: Optional[List[Any]],
+    chunksize: int,
+    use_pyarrow: bool,
+    work_queue: str,
+    staging_dir: str,
+    bucket_url: str,
+    time_columns: bool,
+    daily_rollup: bool,
+) -> Iterator[TDataItems]:
+    """
+    Shards a page of CUR files over the work queue and yields the staged files in file order.
+
+    Staged files are deleted once yielded, dlt keeps the extracted data in its load package.
+    """
+    from pyarrow import parquet as pq
+
+    tasks = dict(
+        cur_file_task(file_obj, bucket_url, staging_dir, columns, exclude_columns, row_filter)
+        for file_obj in items
+    )
+    print(f"  sharding {len(tasks)} file(s) over work queue {work_queue}")
+    results = run_until_done(open_work_queue(work_queue), CUR_FILES_QUEUE, tasks, stage_cur_file)
+
+    def staged_batches() -> Iterator[Any]:
+        for task_id, payload in tasks.items():
+            output = results[task_id]["output"]
+            if not os.path.exists(output):
+                # done in an earlier run whose staged file was already consumed
+                output = stage_cur_file(payload)["output"]
+            yield from pq.ParquetFile(output).iter_batches(batch_size=chunksize)
+            os.remove(output)
+
+    yield from _output_batches(staged_batches(), chunksize, use_pyarrow, time_columns, daily_rollup)
+
+
+def _output_batches(
+    batches: Iterator[Any], chunksize: int, use_pyarrow: bool, time_columns: bool, daily_rollup: bool
+) -> Iterator[TDataItems]:
+    """Rolls up, adds the time columns to and converts the Arrow batches read from a page of CUR files."""
+    if daily_rollup:
+        batches = rollup_daily(batches, chunksize)
+    for batch in batches:
+        if batch.num_rows:
+            if time_columns:
+                batch = add_time_columns(batch)
+            yield batch if use_pyarrow else batch.to_pylist()
+
+
+read_cur_parquet = dlt.transformer()(_read_cur_parquet)
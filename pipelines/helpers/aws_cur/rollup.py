@@ -0,0 +1,183 @@
+"""
+Daily rollup of hourly CUR line items, between extraction and load.
+
+Hourly CUR exports hold a row per line item and hour, while the dashboards group by day.
+`rollup_daily` aggregates the Arrow batches of one page of CUR files (a billing period with the
+manifest file selection) to one row per day and `DAILY_KEY_COLUMNS` with DuckDB, streaming:
+cost and usage columns are summed, the usage start/end dates span the day and all other columns
+keep the value of one of the rows (`DAILY_ADDITIVE_BY_LINE_ITEM_TYPE` sums some of them on
+certain line item types).
+
+A file of the page with columns the previous files did not have (e.g. a new resource tag
+column) starts a new segment: the daily rows of every segment are rolled up once more over the
+columns of all of them, which is exact as the rollup of daily rows returns them unchanged.
+
+Rolled up rows keep the CUR primary key columns, so merges deduplicate as before:
+`identity_line_item_id` is a synthetic id derived from the key values (stable across runs and
+days) and `identity_time_interval` the day, e.g. "2025-11-03T00:00:00Z/2025-11-04T00:00:00Z".
+A group must be complete within a page, which holds when a re-export replaces whole billing
+periods; with the `modification_date` file selection all files of a re-exported period have to
+be listed in the same run.
+"""
+
+import fnmatch
+import itertools
+from typing import Iterable, Iterator, List, Optional
+
+import duckdb
+import pyarrow as pa
+
+from .settings import (
+    DAILY_ADDITIVE_BY_LINE_ITEM_TYPE,
+    DAILY_KEY_COLUMNS,
+    DAILY_LINE_ITEM_ID_PREFIX,
+    DAILY_NON_ADDITIVE_COLUMNS,
+    PRIMARY_KEY,
+    READER_BATCH_SIZE,
+    TIME_INTERVAL_COLUMN,
+)
+
+_LINE_ITEM_ID_COLUMN = PRIMARY_KEY[0]
+_LINE_ITEM_TYPE_COLUMN = "line_item_line_item_type"
+
+# usage dates of a rolled up row span the hours it was aggregated from
+_SPAN_AGGREGATES = {"line_item_usage_start_date": "MIN", "line_item_usage_end_date": "MAX"}
+
+
+def _is_additive(field: pa.Field) -> bool:
+    numeric = pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_decimal(field.type)
+    return numeric and not any(fnmatch.fnmatchcase(field.name, p) for p in DAILY_NON_ADDITIVE_COLUMNS)
+
+
+def _align(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    """Brings a batch of a file with fewer columns or other types to the schema of its segment."""
+    columns = [
+        batch.column(field.name).cast(field.type)
+        if field.name in batch.schema.names
+        else pa.nulls(batch.num_rows, field.type)
+        for field in schema
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def rollup_sql(schema: pa.Schema, table: str = "hourly") -> str:
+    """
+    Builds the DuckDB query that rolls up the hourly CUR rows of `table` to daily rows.
+
+    Args:
+        schema (pa.Schema): Columns of the hourly rows.
+        table (str): Table, view or registered Arrow object with the hourly rows.
+
+    Returns:
+        str: The SELECT statement, the columns are in the order of `schema`.
+    """
+    names = schema.names
+    keys = [name for name in DAILY_KEY_COLUMNS if name in names]
+    day = f"TRY_CAST(LEFT({TIME_INTERVAL_COLUMN}, 10) AS DATE)"
+    # rows without a parseable interval are kept at their own interval
+    interval = (
+        f"COALESCE(strftime({day}, '%Y-%m-%dT00:00:00Z/') || strftime({day} + INTERVAL 1 DAY, '%Y-%m-%dT00:00:00Z'),"
+        f" {TIME_INTERVAL_COLUMN})"
+    )
+    line_item_id = (
+        f"'{DAILY_LINE_ITEM_ID_PREFIX}' || md5(concat_ws('|', "
+        + ", ".join(f"COALESCE(CAST(\"{key}\" AS VARCHAR), '')" for key in keys)
+        + "))"
+        if keys
+        else f"'{DAILY_LINE_ITEM_ID_PREFIX}'"
+    )
+
+    select_list = []
+    for field in schema:
+        column = f'"{field.name}"'
+        if field.name == _LINE_ITEM_ID_COLUMN:
+            select_list.append(f"{line_item_id} AS {column}")
+        elif field.name == TIME_INTERVAL_COLUMN:
+            select_list.append(f"_interval AS {column}")
+        elif field.name in keys:
+            select_list.append(column)
+        elif field.name in _SPAN_AGGREGATES:
+            select_list.append(f"{_SPAN_AGGREGATES[field.name]}({column}) AS {column}")
+        elif _is_additive(field):
+            select_list.append(f"SUM({column}) AS {column}")
+        elif field.name in DAILY_ADDITIVE_BY_LINE_ITEM_TYPE and _LINE_ITEM_TYPE_COLUMN in keys:
+            # the line item type is a key, every group has one
+            types = ", ".join(f"'{t}'" for t in DAILY_ADDITIVE_BY_LINE_ITEM_TYPE[field.name])
+            select_list.append(
+                f'CASE WHEN "{_LINE_ITEM_TYPE_COLUMN}" IN ({types}) THEN SUM({column}) ELSE ANY_VALUE({column}) END'
+                f" AS {column}"
+            )
+        else:
+            select_list.append(f"ANY_VALUE({column}) AS {column}")
+
+    group_by = ", ".join(["_interval"] + [f'"{key}"' for key in keys])
+    return (
+        f"SELECT {', '.join(select_list)}\n"
+        f"FROM (SELECT *, {interval} AS _interval FROM {table})\n"
+        f"GROUP BY {group_by}"
+    )
+
+
+def rollup_daily(batches: Iterable[pa.RecordBatch], chunksize: int = READER_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+    """
+    Rolls up the hourly CUR rows of a page of files to one row per day and line item key.
+
+    The batches are streamed into a DuckDB aggregation, only the daily groups are held in memory
+    (DuckDB spills to disk above its memory limit). Batches with fewer columns or other types
+    are brought to the columns of their segment, a batch with new columns starts a new segment
+    (see the module docstring), so no column of a later file is lost.
+
+    Args:
+        batches (Iterable[pa.RecordBatch]): Hourly rows, without the typed time columns.
+        chunksize (int): Rows per yielded batch.
+
+    Returns:
+        Iterator[pa.RecordBatch]: Daily rows with the columns of all batches.
+    """
+    batches = iter(batches)
+    following: Optional[pa.RecordBatch] = next(batches, None)
+    if following is None:
+        return
+    rows_in = 0
+    rows_out = 0
+    # daily rows of the segments before a schema change
+    segments: List[pa.Table] = []
+
+    def segment(first: pa.RecordBatch) -> Iterator[pa.RecordBatch]:
+        """Batches up to the first one with a column that `first` does not have."""
+        nonlocal rows_in, following
+        following = None
+        names = set(first.schema.names)
+        for batch in itertools.chain([first], batches):
+            if not names.issuperset(batch.schema.names):
+                following = batch
+                return
+            rows_in += batch.num_rows
+            yield batch if batch.schema.equals(first.schema) else _align(batch, first.schema)
+
+    con = duckdb.connect(database=":memory:")
+    try:
+        while following is not None:
+            schema = following.schema
+            con.register("hourly", pa.RecordBatchReader.from_batches(schema, segment(following)))
+            # back to the input types, e.g. sums of integers come back as HUGEINT
+            result = (batch.cast(schema) for batch in con.execute(rollup_sql(schema)).fetch_record_batch(chunksize))
+            # the aggregation has read the whole segment once it returns its first rows
+            head = next(result, None)
+            if following is None and not segments:
+                for batch in itertools.chain([head] if head is not None else [], result):
+                    rows_out += batch.num_rows
+                    yield batch
+                break
+            segments.append(pa.Table.from_batches(itertools.chain([head] if head is not None else [], result), schema))
+            con.unregister("hourly")
+        if segments:
+            daily = pa.concat_tables(segments, promote_options="permissive")
+            print(f"  {len(segments)} column set(s) in the page, rolling up {daily.num_rows} daily row(s) again")
+            con.register("daily", daily)
+            for batch in con.execute(rollup_sql(daily.schema, "daily")).fetch_record_batch(chunksize):
+                rows_out += batch.num_rows
+                yield batch.cast(daily.schema)
+    finally:
+        con.close()
+    print(f"  rolled up {rows_in} hourly row(s) to {rows_out} daily row(s)")
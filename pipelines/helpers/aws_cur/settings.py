@@ -0,0 +1,126 @@
+"""AWS CUR source settings and constants"""
+
+# AWS CUR records are uniquely identified by line_item_id + time_interval
+PRIMARY_KEY = ("identity_line_item_id", "identity_time_interval")
+
+# Typed time columns derived from identity_time_interval ("<start>/<end>" in ISO 8601, UTC) at extract
+# time, so models filter on a date/timestamp column instead of parsing the interval string per query
+TIME_INTERVAL_COLUMN = "identity_time_interval"
+TIME_COLUMNS = ("usage_start", "usage_end", "date")
+
+# The same columns in DuckDB SQL, the local merge fills them in for rows loaded before they were added
+TIME_COLUMNS_SQL = {
+    "usage_start": "CAST(SPLIT_PART(identity_time_interval, '/', 1) AS TIMESTAMPTZ)",
+    "usage_end": "CAST(SPLIT_PART(identity_time_interval, '/', 2) AS TIMESTAMPTZ)",
+    "date": "CAST(LEFT(identity_time_interval, 10) AS DATE)",
+}
+
+# Compacted billing-period files written by the local merge, e.g. billing_period=2025-11.parquet
+# They live next to the files dlt writes so `<table>/*.parquet` globs keep working
+PARTITION_FILE_PREFIX = "billing_period="
+
+# Billing period (YYYY-MM) of a CUR row, derived from the interval start
+BILLING_PERIOD_SQL = "COALESCE(LEFT(identity_time_interval, 7), 'unknown')"
+
+# CUR 2.0 exports are laid out as <export_path>/{data,metadata}/BILLING_PERIOD=YYYY-MM/
+BILLING_PERIOD_DIR = "BILLING_PERIOD="
+MANIFEST_GLOB = "*Manifest.json"
+
+# Column that identifies the billing period of a row, used as merge key so a re-exported
+# period replaces exactly that period at the destination
+BILLING_PERIOD_KEY = "bill_billing_period_start_date"
+
+# Number of most recent billing periods that are still checked for re-exports,
+# AWS keeps updating the current month and finalizes the previous one early in the month
+OPEN_BILLING_PERIODS = 2
+
+# Columns that are always read, whatever the column allow/deny list says, merges depend on them
+REQUIRED_COLUMNS = PRIMARY_KEY + (BILLING_PERIOD_KEY,)
+
+# Optional daily rollup of hourly CUR line items (`daily_rollup`, see rollup.py). Rows are grouped by
+# day and the key columns below (those present), the line items of a group get a synthetic
+# identity_line_item_id derived from the key values and a one day identity_time_interval
+DAILY_KEY_COLUMNS = (
+    BILLING_PERIOD_KEY,
+    "bill_payer_account_id",
+    "line_item_usage_account_id",
+    "line_item_line_item_type",
+    "line_item_product_code",
+    "line_item_usage_type",
+    "line_item_operation",
+    "line_item_resource_id",
+    "line_item_availability_zone",
+    "line_item_line_item_description",
+    "pricing_term",
+    "product_region_code",
+    "reservation_reservation_a_r_n",
+    "savings_plan_savings_plan_a_r_n",
+)
+
+# Numeric columns that are not summed over the hours of a day (rates, factors, running totals),
+# they keep the value of one of the rows like all other non-key columns. Glob patterns
+DAILY_NON_ADDITIVE_COLUMNS = ("*_rate", "*_factor", "*_to_date", "*_per_reservation", "*_upfront_value")
+# Non-additive columns that are per hour on some line item types and summed on those: the hourly
+# SavingsPlanRecurringFee lines carry the commitment of their hour, the amortized cost subtracts
+# the summed used commitment from it
+DAILY_ADDITIVE_BY_LINE_ITEM_TYPE = {"savings_plan_total_commitment_to_date": ("SavingsPlanRecurringFee",)}
+
+# Prefix of the synthetic line item ids of rolled up rows
+DAILY_LINE_ITEM_ID_PREFIX = "daily-"
+
+# Number of rows per batch yielded by the CUR parquet reader
+READER_BATCH_SIZE = 10_000
+
+# Concurrent byte-range requests per page of CUR files and row groups fetched ahead of the consumer
+READER_MAX_WORKERS = 8
+READER_PREFETCH = 16
+
+# Size cap of the optional local CUR file cache
+CACHE_MAX_SIZE_GB = 20
+
+# Multi-account fan-out: CUR exports extracted at the same time, each export also uses READER_MAX_WORKERS
+ACCOUNT_WORKERS = 4
+
+# Column that tells the account of a row apart, added only when several accounts are configured
+ACCOUNT_COLUMN = "cur_account"
+
+# View over all account tables (SQL destinations)
+COMBINED_VIEW_NAME = "cur_all_accounts"
+
+# Repetitive string columns, LowCardinality(String) on ClickHouse (see helpers/column_encoding.py)
+LOW_CARDINALITY_COLUMNS = (
+    "bill_bill_type",
+    "bill_billing_entity",
+    "bill_invoicing_entity",
+    "bill_payer_account_id",
+    "bill_payer_account_name",
+    "line_item_availability_zone",
+    "line_item_currency_code",
+    "line_item_legal_entity",
+    "line_item_line_item_description",
+    "line_item_line_item_type",
+    "line_item_operation",
+    "line_item_product_code",
+    "line_item_tax_type",
+    "line_item_usage_account_id",
+    "line_item_usage_account_name",
+    "line_item_usage_type",
+    "pricing_currency",
+    "pricing_term",
+    "pricing_unit",
+    "product_from_location",
+    "product_from_region_code",
+    "product_instance_family",
+    "product_instance_type",
+    "product_location",
+    "product_location_type",
+    "product_operation",
+    "product_product_family",
+    "product_region_code",
+    "product_servicecode",
+    "product_sku",
+    "product_to_location",
+    "product_to_region_code",
+    "product_usagetype",
+    ACCOUNT_COLUMN,
+)
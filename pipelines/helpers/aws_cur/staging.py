@@ -0,0 +1,169 @@
+"""
+Work queue tasks that shard CUR processing across worker processes and hosts.
+
+`cur_files`: download one CUR file, apply the column projection and row filter and write
+the result as a parquet file to a (shared) staging directory. `cur_normalize`: explode the
+MAP columns of one loaded parquet file with the SQL built by `normalize.py`.
+
+Both handlers derive their output path from the task and skip work whose output exists,
+so a task processed twice, e.g. after a lease expired, does the work once.
+"""
+
+import hashlib
+import os
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dlt.common import pendulum
+from dlt.common.configuration import resolve_configuration
+from dlt.common.storages import FilesystemConfiguration, fsspec_from_config
+from dlt.sources.filesystem import FileItemDict
+
+from .helpers import prefetch_map
+from .settings import READER_MAX_WORKERS
+
+CUR_FILES_QUEUE = "cur_files"
+CUR_NORMALIZE_QUEUE = "cur_normalize"
+
+
+def _output_path(staging_dir: str, task_id: str) -> str:
+    key = hashlib.sha256(task_id.encode()).hexdigest()
+    return str(pathlib.Path(staging_dir).expanduser() / key[:2] / f"{key}.parquet")
+
+
+def _write_parquet_atomic(table: Any, output: str) -> None:
+    import pyarrow.parquet as pq
+
+    pathlib.Path(output).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, output)
+
+
+def cur_file_task(
+    file_obj: FileItemDict,
+    bucket_url: str,
+    staging_dir: str,
+    columns: Optional[Sequence[str]] = None,
+    exclude_columns: Optional[Sequence[str]] = None,
+    row_filter: Optional[List[Any]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Builds the `cur_files` task of a CUR file.
+
+    The task id contains the modification date and size, so a re-exported file is a new task.
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: Task id and payload.
+    """
+    file_item = {key: value for key, value in file_obj.items()}
+    file_item["modification_date"] = file_obj["modification_date"].isoformat()
+    task_id = f"{file_obj['file_url']}@{file_item['modification_date']}:{file_obj['size_in_bytes']}"
+    # the projection is part of the output, a changed projection must not reuse staged files
+    settings = repr((columns, exclude_columns, row_filter))
+    return task_id, dict(
+        bucket_url=bucket_url,
+        file_item=file_item,
+        columns=columns,
+        exclude_columns=exclude_columns,
+        row_filter=row_filter,
+        output=_output_path(staging_dir, f"{task_id}|{settings}"),
+    )
+
+
+def stage_cur_file(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    `cur_files` handler: reads the projected and filtered rows of one CUR file into the staging directory.
+
+    Credentials are resolved from `[sources.filesystem.credentials]` of the worker's own config.
+    """
+    from pyarrow import parquet as pq
+
+    from .readers import _read_row_group, _split_row_groups
+
+    output = payload["output"]
+    if os.path.exists(output):
+        return {"output": output, "rows": pq.ParquetFile(output).metadata.num_rows}
+
+    config = resolve_configuration(
+        FilesystemConfiguration(),
+        sections=("sources", "filesystem"),
+        explicit_value={"bucket_url": payload["bucket_url"]},
+    )
+    fs_client, _ = fsspec_from_config(config)
+    file_item = dict(payload["file_item"])
+    file_item["modification_date"] = pendulum.parse(file_item["modification_date"])
+    file_obj = FileItemDict(file_item, fs_client)
+
+    row_filter = payload["row_filter"]
+    filter_expression = pq.filters_to_expression(row_filter) if row_filter else None
+    _, schema, projection, row_groups = _split_row_groups(
+        file_obj, payload["columns"], payload["exclude_columns"], filter_expression
+    )
+    with ThreadPoolExecutor(max_workers=READER_MAX_WORKERS, thread_name_prefix="cur_stager") as executor:
+        tables = list(
+            prefetch_map(
+                executor,
+                _read_row_group,
+                ((fragment, schema, projection, filter_expression) for fragment in row_groups),
+                window=READER_MAX_WORKERS,
+            )
+        )
+    import pyarrow as pa
+
+    table = pa.concat_tables(tables) if tables else schema.empty_table().select(projection)
+    _write_parquet_atomic(table, output)
+    return {"output": output, "rows": table.num_rows}
+
+
+def normalize_cur_file(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    `cur_normalize` handler: runs the normalization SELECT of `normalize.py` on one loaded file.
+
+    The file is read together with an empty scan of all input files, so columns that only exist
+    in other files are present (as NULL) and the same SELECT works for every file.
+    """
+    import duckdb
+
+    output = payload["output"]
+    if os.path.exists(output):
+        return {"output": output}
+
+    pathlib.Path(output).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    con = duckdb.connect(database=":memory:")
+    con.execute(
+        f"""
+        CREATE VIEW raw AS
+          SELECT * FROM read_parquet('{payload["input"]}')
+          UNION ALL BY NAME
+          (SELECT * FROM read_parquet({payload["all_inputs"]}, UNION_BY_NAME => TRUE) LIMIT 0)
+        """
+    )
+    con.execute(f"COPY ({payload['select_sql']}) TO '{tmp}' (FORMAT PARQUET)")
+    con.close()
+    os.replace(tmp, output)
+    return {"output": output}
+
+
+def normalize_file_task(
+    input_path: pathlib.Path, all_inputs: str, select_sql: str, parts_dir: pathlib.Path
+) -> Tuple[str, Dict[str, Any]]:
+    """Builds the `cur_normalize` task of a loaded parquet file, keyed by file version and SQL."""
+    stat = input_path.stat()
+    task_id = f"{input_path}@{stat.st_mtime_ns}:{stat.st_size}"
+    sql_hash = hashlib.sha256(select_sql.encode()).hexdigest()[:16]
+    return task_id, dict(
+        input=str(input_path),
+        all_inputs=all_inputs,
+        select_sql=select_sql,
+        output=_output_path(str(parts_dir), f"{task_id}|{sql_hash}"),
+    )
+
+
+# handlers of the queues a `aws_pipeline.py --worker` process serves
+WORK_QUEUE_HANDLERS = {
+    CUR_FILES_QUEUE: stage_cur_file,
+    CUR_NORMALIZE_QUEUE: normalize_cur_file,
+}
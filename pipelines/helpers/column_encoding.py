@@ -0,0 +1,157 @@
+"""
+Low-cardinality encoding of the repetitive string columns of the billing tables.
+
+Service codes, regions, usage types, SKU descriptions or currencies repeat a few hundred values
+over millions of rows but are loaded as plain strings. On ClickHouse the columns listed per source
+(`LOW_CARDINALITY_COLUMNS` in the source settings) are converted to `LowCardinality(String)` after
+a load, once: a dictionary per part with integer keys, smaller on disk and faster to group by.
+
+Parquet files are dictionary encoded by both writers already (pyarrow for dlt, DuckDB for the local
+merges), but dlt writes a row group, and with it a dictionary, per 5000 buffered rows.
+`configure_parquet_row_groups` raises the buffer so a dictionary covers a larger row group.
+DuckDB and MotherDuck pick dictionary compression for such columns in their own storage, an ENUM
+type would reject the first new service code a load brings, so they get no hint.
+
+`parquet_encoding_report` and the ClickHouse conversion report the bytes saved per column.
+"""
+
+import io
+import pathlib
+from typing import Dict, Iterable, Sequence, Tuple
+
+import dlt
+import humanize
+
+# Rows per parquet row group written by dlt (dlt's `[data_writer] buffer_max_items`)
+PARQUET_ROW_GROUP_ROWS = 50_000
+
+# ClickHouse types that are converted, dlt creates text columns as one of them
+_CLICKHOUSE_STRING_TYPES = ("String", "Nullable(String)")
+
+# column -> (bytes without the encoding, bytes with it)
+TBytesReport = Dict[str, Tuple[int, int]]
+
+
+def configure_parquet_row_groups(pipeline: dlt.Pipeline, rows: int = PARQUET_ROW_GROUP_ROWS) -> None:
+    """
+    Writes the parquet row groups of a pipeline with `rows` rows, unless `[data_writer] buffer_max_items` is configured.
+
+    The value is set under the pipeline name (`<pipeline_name>.data_writer.buffer_max_items`), so
+    pipelines running on other threads of the process (see `daemon.py`) keep their own setting.
+    """
+    for key in (f"{pipeline.pipeline_name}.data_writer.buffer_max_items", "data_writer.buffer_max_items"):
+        try:
+            dlt.config[key]
+            return
+        except KeyError:
+            pass
+    dlt.config[f"{pipeline.pipeline_name}.data_writer.buffer_max_items"] = rows
+
+
+def low_cardinality_clickhouse(
+    pipeline: dlt.Pipeline, table_name: str, columns: Iterable[str]
+) -> TBytesReport:
+    """
+    Converts the string columns of a ClickHouse table to `LowCardinality`.
+
+    Columns that are converted already, not strings or not in the table are skipped, so this is a
+    no-op after the first run. The conversion is a mutation that rewrites the columns, it runs
+    synchronously so the compressed sizes after it can be reported.
+
+    Args:
+        pipeline (dlt.Pipeline): Pipeline that loaded the table to ClickHouse.
+        table_name (str): Table name in the dlt schema, e.g. "bigquery_billing_table".
+        columns (Iterable[str]): Columns to convert.
+
+    Returns:
+        TBytesReport: Compressed bytes of each converted column before and after.
+    """
+    columns = set(columns)
+    with pipeline.sql_client() as client:
+        database, table = client.make_qualified_table_name_path(table_name, quote=False)
+
+        def column_sizes() -> Dict[str, Tuple[str, int]]:
+            rows = client.execute_sql(
+                "SELECT name, type, data_compressed_bytes FROM system.columns WHERE database = %s AND table = %s",
+                database,
+                table,
+            )
+            return {name: (type_, size) for name, type_, size in rows if name in columns}
+
+        before = {
+            name: (type_, size)
+            for name, (type_, size) in column_sizes().items()
+            if type_ in _CLICKHOUSE_STRING_TYPES
+        }
+        if not before:
+            return {}
+        client.execute_sql("SET mutations_sync = 2")
+        client.execute_sql(
+            f"ALTER TABLE {client.make_qualified_table_name(table_name)} "
+            + ", ".join(
+                f"MODIFY COLUMN {client.escape_column_name(name)} LowCardinality({type_})"
+                for name, (type_, _size) in sorted(before.items())
+            )
+        )
+        after = column_sizes()
+    return {name: (size, after[name][1]) for name, (_type, size) in before.items()}
+
+
+def parquet_encoding_report(paths: Sequence[pathlib.Path], columns: Iterable[str]) -> TBytesReport:
+    """
+    Measures what dictionary encoding saves on the columns of parquet files.
+
+    The stored column chunks are compared with the same chunks written plain, in the row groups
+    and with the compression of the file.
+
+    Args:
+        paths (Sequence[pathlib.Path]): Parquet files of one table.
+        columns (Iterable[str]): Columns to measure, columns missing in a file are skipped.
+
+    Returns:
+        TBytesReport: Bytes of each column written plain and as stored.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    report: TBytesReport = {}
+    columns = list(columns)
+    for path in paths:
+        parquet_file = pq.ParquetFile(path)
+        metadata = parquet_file.metadata
+        names = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+        for name in columns:
+            if name not in names:
+                continue
+            index = names.index(name)
+            stored = sum(
+                metadata.row_group(rg).column(index).total_compressed_size for rg in range(metadata.num_row_groups)
+            )
+            compression = metadata.row_group(0).column(index).compression if metadata.num_row_groups else "NONE"
+            plain = io.BytesIO()
+            with pq.ParquetWriter(
+                plain,
+                pa.schema([parquet_file.schema_arrow.field(name)]),
+                use_dictionary=False,
+                compression="none" if compression in ("NONE", "UNCOMPRESSED") else compression.lower(),
+            ) as writer:
+                for rg in range(metadata.num_row_groups):
+                    writer.write_table(parquet_file.read_row_group(rg, columns=[name]))
+            plain_bytes, stored_bytes = report.get(name, (0, 0))
+            report[name] = (plain_bytes + plain.tell(), stored_bytes + stored)
+    return report
+
+
+def print_bytes_report(title: str, report: TBytesReport) -> None:
+    """Prints the bytes saved per column, largest saving first."""
+    if not report:
+        return
+    saved = {name: before - after for name, (before, after) in report.items()}
+    total_before = sum(before for before, _after in report.values())
+    print(f"📦 {title}: {humanize.naturalsize(sum(saved.values()))} saved of {humanize.naturalsize(total_before)}")
+    for name in sorted(saved, key=saved.get, reverse=True):
+        before, after = report[name]
+        ratio = f"{before / after:.1f}x" if after else "-"
+        print(
+            f"   {name:<40} {humanize.naturalsize(before):>10} → {humanize.naturalsize(after):>10}  ({ratio})"
+        )
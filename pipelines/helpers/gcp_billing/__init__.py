@@ -0,0 +1,21 @@
+"""GCP billing export helpers"""
+
+from .merge import (
+    EXPORT_TABLE_KEY,
+    MERGE_KEY,
+    USAGE_DATE_KEY,
+    LookbackDatasetError,
+    filesystem_rows_without_merge_key,
+    replace_filesystem_days,
+)
+from .settings import LOW_CARDINALITY_COLUMNS
+
+__all__ = [
+    "EXPORT_TABLE_KEY",
+    "LOW_CARDINALITY_COLUMNS",
+    "MERGE_KEY",
+    "USAGE_DATE_KEY",
+    "LookbackDatasetError",
+    "filesystem_rows_without_merge_key",
+    "replace_filesystem_days",
+]
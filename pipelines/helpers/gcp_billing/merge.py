@@ -0,0 +1,156 @@
+"""
+Local day replacement for the GCP billing table written by the dlt filesystem destination.
+
+In lookback mode the GCP resource re-extracts whole usage days and loads them with
+`write_disposition="merge"` and `merge_key=MERGE_KEY`, which destinations with merge support
+turn into a delete-insert of exactly those days of each export table (all export tables load
+into one table). The filesystem destination appends plain parquet instead, so
+`replace_filesystem_days` runs after each load: the rows of the re-extracted days replace the
+stored ones in one file per usage month, and the child tables (labels, credits, ...), all direct
+children of the billing rows, drop the rows of the replaced parents.
+
+Rows loaded without the merge key (append mode) are never replaced, so lookback mode is only
+started on a table without them, see `filesystem_rows_without_merge_key`.
+"""
+
+import os
+import pathlib
+from typing import List, Sequence, Tuple
+
+import duckdb
+
+# Column with the usage day of a row
+USAGE_DATE_KEY = "usage_date"
+# Column with the billing export table a row was extracted from
+EXPORT_TABLE_KEY = "export_table"
+# Merge key of the lookback mode, a table only replaces its own usage days
+MERGE_KEY = (EXPORT_TABLE_KEY, USAGE_DATE_KEY)
+PARTITION_FILE_PREFIX = "usage_month="
+# Child table rows are kept in one compacted file per child table
+COMPACTED_FILE = "compacted.parquet"
+
+
+def _sql_list(paths: Sequence[pathlib.Path]) -> str:
+    return "[" + ", ".join(f"'{p.as_posix()}'" for p in paths) + "]"
+
+
+def _write(con: duckdb.DuckDBPyConnection, select_sql: str, target: pathlib.Path) -> None:
+    """Writes rows deduplicated by `_dlt_id`, so a merge interrupted half way can simply run again."""
+    tmp = target.with_name(f"{target.name}.tmp")
+    con.execute(
+        f"""
+        COPY (
+          SELECT * FROM ({select_sql})
+          QUALIFY ROW_NUMBER() OVER (PARTITION BY _dlt_id) = 1
+        ) TO '{tmp.as_posix()}' (FORMAT PARQUET)
+        """
+    )
+    os.replace(tmp, target)
+
+
+class LookbackDatasetError(RuntimeError):
+    """The billing table holds rows without the merge key, lookback mode would load their days twice."""
+
+
+def filesystem_rows_without_merge_key(table_dir: pathlib.Path) -> int:
+    """
+    Counts the rows of the parquet files of a table that lack a value of the merge key.
+
+    Args:
+        table_dir (pathlib.Path): Directory of the root table, e.g. viz_rill/data/gcp_costs/bigquery_billing_table.
+
+    Returns:
+        int: Rows without export table or usage day, 0 for a new table.
+    """
+    files = sorted(pathlib.Path(table_dir).glob("*.parquet"))
+    if not files:
+        return 0
+    con = duckdb.connect(database=":memory:")
+    try:
+        con.execute(f"CREATE VIEW stored AS SELECT * FROM read_parquet({_sql_list(files)}, union_by_name = true)")
+        columns = {row[0] for row in con.execute("DESCRIBE stored").fetchall()}
+        where = (
+            " OR ".join(f"{key} IS NULL" for key in MERGE_KEY) if all(key in columns for key in MERGE_KEY) else "TRUE"
+        )
+        return con.execute(f"SELECT COUNT(*) FROM stored WHERE {where}").fetchone()[0]
+    finally:
+        con.close()
+
+
+def replace_filesystem_days(dataset_dir: pathlib.Path, table_name: str) -> List[Tuple[str, str]]:
+    """
+    Replaces the usage days of each export table of the freshly loaded parquet files of a table.
+
+    The fresh dlt files are deleted only after the months and child tables are written.
+
+    Args:
+        dataset_dir (pathlib.Path): Directory of the dataset, e.g. viz_rill/data/gcp_costs.
+        table_name (str): The root table, its child tables are `<table_name>__*`.
+
+    Returns:
+        List[Tuple[str, str]]: Export table and usage day (YYYY-MM-DD) pairs that were replaced.
+    """
+    table_dir = pathlib.Path(dataset_dir) / table_name
+    if not table_dir.exists():
+        return []
+    fresh_files = sorted(
+        p for p in table_dir.glob("*.parquet") if not p.name.startswith(PARTITION_FILE_PREFIX)
+    )
+    if not fresh_files:
+        return []
+
+    con = duckdb.connect(database=":memory:")
+    con.execute(
+        f"CREATE VIEW fresh AS SELECT * FROM read_parquet({_sql_list(fresh_files)}, union_by_name = true)"
+    )
+    merge_key = ", ".join(MERGE_KEY)
+    con.execute(f"CREATE TABLE days AS SELECT DISTINCT {merge_key} FROM fresh")
+    days = [(row[0], str(row[1])) for row in con.execute(f"SELECT {merge_key} FROM days ORDER BY 1, 2").fetchall()]
+    months = sorted({day[:7] for _table, day in days})
+
+    # parents stored for the replaced days, their child rows are replaced with them
+    stored = [
+        path
+        for path in (table_dir / f"{PARTITION_FILE_PREFIX}{month}.parquet" for month in months)
+        if path.exists()
+    ]
+    con.execute("CREATE TABLE replaced (_dlt_id VARCHAR)")
+    if stored:
+        con.execute(
+            f"""
+            INSERT INTO replaced
+              SELECT _dlt_id FROM read_parquet({_sql_list(stored)}, union_by_name = true)
+              SEMI JOIN days USING ({merge_key})
+            """
+        )
+
+    fresh_child_files = []
+    for child_dir in sorted(p for p in table_dir.parent.glob(f"{table_name}__*") if p.is_dir()):
+        target = child_dir / COMPACTED_FILE
+        child_files = sorted(p for p in child_dir.glob("*.parquet") if p.name != COMPACTED_FILE)
+        if not child_files:
+            continue
+        select_sql = f"SELECT * FROM read_parquet({_sql_list(child_files)}, union_by_name = true)"
+        if target.exists():
+            select_sql += (
+                f"\nUNION ALL BY NAME\nSELECT * FROM read_parquet('{target.as_posix()}')"
+                "\nWHERE _dlt_parent_id NOT IN (SELECT _dlt_id FROM replaced)"
+            )
+        _write(con, select_sql, target)
+        fresh_child_files += child_files
+
+    for month in months:
+        target = table_dir / f"{PARTITION_FILE_PREFIX}{month}.parquet"
+        select_sql = f"SELECT * FROM fresh WHERE strftime({USAGE_DATE_KEY}, '%Y-%m') = '{month}'"
+        if target.exists():
+            select_sql += (
+                f"\nUNION ALL BY NAME\nSELECT * FROM read_parquet('{target.as_posix()}')"
+                f"\nANTI JOIN days USING ({merge_key})"
+            )
+        _write(con, select_sql, target)
+        print(f"  ✓ replaced usage days of {month} → {target.name}")
+
+    con.close()
+    for path in fresh_files + fresh_child_files:
+        path.unlink()
+    return days
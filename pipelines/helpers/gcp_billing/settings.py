@@ -0,0 +1,29 @@
+"""GCP billing export settings and constants"""
+
+# Repetitive string columns of the billing table, LowCardinality(String) on ClickHouse
+# (see helpers/column_encoding.py)
+LOW_CARDINALITY_COLUMNS = (
+    "billing_account_id",
+    "consumption_model__description",
+    "consumption_model__id",
+    "cost_type",
+    "currency",
+    "invoice__month",
+    "invoice__publisher_type",
+    "location__country",
+    "location__location",
+    "location__region",
+    "location__zone",
+    "price__unit",
+    "project__id",
+    "project__name",
+    "project__number",
+    "seller_name",
+    "service__description",
+    "service__id",
+    "sku__description",
+    "sku__id",
+    "transaction_type",
+    "usage__pricing_unit",
+    "usage__unit",
+)
@@ -0,0 +1,276 @@
+"""
+Stage timings and throughput of the source pipelines.
+
+After every run the dlt trace of the pipeline is turned into one row per stage (extract,
+normalize, load and the whole run) with its duration, rows, files and bytes, the number of
+load packages and the peak RSS of the process. The rows are appended to the `_pipeline_metrics`
+table of the `pipeline_metrics` dataset in the same destination the source loads to (parquet
+files, DuckDB, ClickHouse or MotherDuck), and optionally to an OpenMetrics text file per source
+for the Prometheus node exporter textfile collector.
+"""
+
+import os
+import pathlib
+import resource
+import socket
+import sys
+from typing import Any, Dict, Iterable, List, Optional
+
+import dlt
+
+from helpers.tracing import record_span
+
+METRICS_TABLE = "_pipeline_metrics"
+DEFAULT_DATASET_NAME = "pipeline_metrics"
+OPENMETRICS_PREFIX = "cloud_cost_pipeline"
+
+# gauges written to the OpenMetrics file, one sample per stage
+_OPENMETRICS_GAUGES = {
+    "duration_seconds": "Duration of the pipeline stage",
+    "rows": "Rows processed by the pipeline stage, without dlt system tables",
+    "bytes": "Bytes of the files written by the pipeline stage",
+    "files": "Files written by the pipeline stage",
+    "packages": "Load packages processed by the pipeline stage",
+}
+
+# per-source pipelines that load the metrics, reused by a long running process
+_METRICS_PIPELINES: Dict[str, dlt.Pipeline] = {}
+
+
+def _config(key: str, default: Any) -> Any:
+    try:
+        return dlt.config[f"pipeline_metrics.{key}"]
+    except KeyError:
+        return default
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process (of its lifetime, also in the daemon)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _is_data_table(table_name: str) -> bool:
+    return not table_name.startswith("_dlt")
+
+
+def _writer_totals(step_info: Any) -> Dict[str, int]:
+    """Rows, bytes and files of the extract or normalize step from its writer metrics."""
+    rows = bytes_ = files = 0
+    for package_metrics in step_info.metrics.values():
+        for metrics in package_metrics:
+            for job in metrics["job_metrics"].values():
+                files += 1
+                bytes_ += job.file_size
+            rows += sum(
+                table.items_count
+                for name, table in metrics["table_metrics"].items()
+                if _is_data_table(name)
+            )
+    return dict(rows=rows, bytes=bytes_, files=files)
+
+
+def _load_totals(step_info: Any, normalize_rows: int) -> Dict[str, int]:
+    """Bytes and files of the completed load jobs, rows are the normalized rows of the loaded packages."""
+    bytes_ = files = 0
+    for package in step_info.load_packages:
+        for job in package.jobs.get("completed_jobs", []):
+            files += 1
+            bytes_ += job.file_size
+    return dict(rows=normalize_rows, bytes=bytes_, files=files)
+
+
+def collect_metrics(pipeline: dlt.Pipeline, source: str) -> List[Dict[str, Any]]:
+    """
+    Builds the metric rows of the last run of `pipeline` from its trace.
+
+    Args:
+        pipeline (dlt.Pipeline): Pipeline right after `run()`.
+        source (str): One of "aws", "gcp", "stripe".
+
+    Returns:
+        List[Dict[str, Any]]: One row per stage, empty if the pipeline has no trace.
+    """
+    trace = pipeline.last_trace
+    if trace is None:
+        return []
+
+    base = dict(
+        run_id=trace.transaction_id,
+        source=source,
+        pipeline_name=pipeline.pipeline_name,
+        destination=pipeline.destination.destination_name if pipeline.destination else None,
+        dataset_name=pipeline.dataset_name,
+        host=socket.gethostname(),
+        pid=os.getpid(),
+        peak_rss_bytes=peak_rss_bytes(),
+    )
+    rows: List[Dict[str, Any]] = []
+    totals: Dict[str, Dict[str, int]] = {}
+    for step in trace.steps:
+        if step.step not in ("extract", "normalize", "load") or step.step_info is None:
+            continue
+        if step.step == "load":
+            stage_totals = _load_totals(step.step_info, totals.get("normalize", {}).get("rows", 0))
+        else:
+            stage_totals = _writer_totals(step.step_info)
+        totals[step.step] = stage_totals
+        rows.append(
+            dict(
+                base,
+                stage=step.step,
+                started_at=step.started_at,
+                finished_at=step.finished_at,
+                duration_seconds=(step.finished_at - step.started_at).total_seconds(),
+                packages=len(step.step_info.loads_ids),
+                status="failed" if step.step_exception else "ok",
+                **stage_totals,
+            )
+        )
+    if rows:
+        rows.append(
+            dict(
+                base,
+                stage="run",
+                started_at=trace.started_at,
+                finished_at=trace.finished_at,
+                duration_seconds=(trace.finished_at - trace.started_at).total_seconds(),
+                packages=max(row["packages"] for row in rows),
+                status="failed" if any(row["status"] == "failed" for row in rows) else "ok",
+                rows=totals.get("load", totals.get("normalize", {})).get("rows", 0),
+                bytes=totals.get("load", {}).get("bytes", 0),
+                files=totals.get("load", {}).get("files", 0),
+            )
+        )
+    return rows
+
+
+def _metrics_pipeline(pipeline: dlt.Pipeline) -> dlt.Pipeline:
+    name = f"{pipeline.pipeline_name}_metrics"
+    if name in _METRICS_PIPELINES:
+        metrics_pipeline = _METRICS_PIPELINES[name]
+        metrics_pipeline.activate()
+        return metrics_pipeline
+    metrics_pipeline = dlt.pipeline(
+        pipeline_name=name,
+        # the destination instance, so a pinned local DuckDB file is shared with the source
+        destination=pipeline.destination,
+        dataset_name=_config("dataset_name", DEFAULT_DATASET_NAME),
+    )
+    _METRICS_PIPELINES[name] = metrics_pipeline
+    return metrics_pipeline
+
+
+def write_metrics_table(pipeline: dlt.Pipeline, rows: List[Dict[str, Any]]) -> None:
+    """Appends metric rows to the `_pipeline_metrics` table in the destination of `pipeline`."""
+    metrics_pipeline = _metrics_pipeline(pipeline)
+    kwargs = {}
+    if metrics_pipeline.destination.destination_name == "filesystem":
+        kwargs["loader_file_format"] = "parquet"
+    metrics_pipeline.run(rows, table_name=METRICS_TABLE, write_disposition="append", **kwargs)
+    # the source pipeline stays the active one for the rest of the run
+    pipeline.activate()
+
+
+def _label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_openmetrics(rows: Iterable[Dict[str, Any]]) -> str:
+    """Renders metric rows as OpenMetrics text, one gauge family per measure."""
+    rows = list(rows)
+    lines: List[str] = []
+    for measure, help_text in _OPENMETRICS_GAUGES.items():
+        family = f"{OPENMETRICS_PREFIX}_stage_{measure}"
+        lines.append(f"# TYPE {family} gauge")
+        lines.append(f"# HELP {family} {help_text}.")
+        for row in rows:
+            labels = ",".join(
+                f'{key}="{_label_value(row[key])}"' for key in ("source", "pipeline_name", "stage")
+            )
+            lines.append(f"{family}{{{labels}}} {row[measure]}")
+    if rows:
+        labels = f'source="{_label_value(rows[0]["source"])}",pipeline_name="{_label_value(rows[0]["pipeline_name"])}"'
+        for family, help_text, value in (
+            (f"{OPENMETRICS_PREFIX}_peak_rss_bytes", "Peak resident set size of the loading process", rows[0]["peak_rss_bytes"]),
+            (f"{OPENMETRICS_PREFIX}_last_run_timestamp_seconds", "Finish time of the last run", rows[-1]["finished_at"].timestamp()),
+        ):
+            lines += [f"# TYPE {family} gauge", f"# HELP {family} {help_text}.", f"{family}{{{labels}}} {value}"]
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_openmetrics(path: pathlib.Path, rows: List[Dict[str, Any]]) -> None:
+    """Replaces the OpenMetrics file of a source atomically, scrapers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(format_openmetrics(rows))
+    os.replace(tmp, path)
+
+
+def trace_stages(rows: List[Dict[str, Any]]) -> None:
+    """Records a span per stage with the times from the dlt trace, under the current span if any."""
+    for row in rows:
+        record_span(
+            f"dlt.{row['stage']}",
+            row["started_at"].timestamp(),
+            row["finished_at"].timestamp(),
+            **{
+                "source": row["source"],
+                "pipeline.name": row["pipeline_name"],
+                "pipeline.destination": row["destination"],
+                "pipeline.run_id": row["run_id"],
+                "pipeline.status": row["status"],
+                "rows": row["rows"],
+                "bytes": row["bytes"],
+                "files": row["files"],
+                "packages": row["packages"],
+            },
+        )
+
+
+def record_metrics(pipeline: dlt.Pipeline, source: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Records the stage metrics of the last run of a source pipeline and traces its stages.
+
+    Config (`[pipeline_metrics]` in .dlt/config.toml):
+        enabled: write the `_pipeline_metrics` table, defaults to true
+        dataset_name: dataset of the table, defaults to "pipeline_metrics"
+        openmetrics_dir: also write `<pipeline_name>.prom` files to this directory
+
+    A failure to write the metrics is printed and does not fail the load.
+
+    Args:
+        pipeline (dlt.Pipeline): Pipeline right after `run()`.
+        source (str): One of "aws", "gcp", "stripe".
+
+    Returns:
+        Optional[List[Dict[str, Any]]]: The recorded rows, None if metrics are disabled.
+    """
+    rows = collect_metrics(pipeline, source)
+    trace_stages(rows)
+    if not _config("enabled", True):
+        return None
+    if not rows:
+        return rows
+
+    for row in rows:
+        print(
+            f"📊 {row['stage']:<9} {row['duration_seconds']:>8.1f}s {row['rows']:>10} rows"
+            f" {row['bytes'] / 1024 / 1024:>9.1f} MiB {row['files']:>5} files"
+        )
+    print(f"📊 peak RSS {rows[0]['peak_rss_bytes'] / 1024 / 1024:.0f} MiB")
+
+    try:
+        write_metrics_table(pipeline, rows)
+    except Exception as e:
+        print(f"⚠️  Could not write {METRICS_TABLE}: {e}")
+
+    openmetrics_dir = _config("openmetrics_dir", None)
+    if openmetrics_dir:
+        try:
+            write_openmetrics(pathlib.Path(openmetrics_dir).expanduser() / f"{pipeline.pipeline_name}.prom", rows)
+        except OSError as e:
+            print(f"⚠️  Could not write OpenMetrics file: {e}")
+    return rows
@@ -0,0 +1,245 @@
+"""
+Per-source dlt pipelines: names, state migration and run locks.
+
+Every source (aws, gcp, stripe) loads with its own pipeline name and therefore its own
+working directory and state, so the sources can run concurrently and on different hosts.
+Incremental cursors of the former shared pipeline are copied over once, on the first run
+of a source pipeline. A file lock prevents two runs of the same source from overlapping.
+"""
+
+import contextlib
+import copy
+import fcntl
+import os
+import pathlib
+import socket
+import tempfile
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+import dlt
+from dlt.common.pipeline import get_dlt_pipelines_dir
+from dlt.common.schema.utils import normalize_schema_name
+
+DEFAULT_PIPELINE_NAME = "cloud_cost_analytics"
+
+# config section of each source, e.g. [sources.aws_cur] pipeline_name = "..."
+SOURCE_SECTIONS = {
+    "aws": "aws_cur",
+    "gcp": "gcp_billing",
+    "stripe": "stripe",
+}
+
+
+# pipelines created in this process, a long running process (the daemon) reuses them between runs
+_PIPELINES: Dict[Tuple[str, str, str], dlt.Pipeline] = {}
+
+
+class SourceLockedError(RuntimeError):
+    """Raised when another run of the same source holds its lock."""
+
+
+def get_shared_pipeline_name() -> str:
+    """Returns the base pipeline name from `[pipeline] pipeline_name`."""
+    try:
+        return dlt.config["pipeline.pipeline_name"]
+    except KeyError:
+        return DEFAULT_PIPELINE_NAME
+
+
+def get_source_pipeline_name(source: str) -> str:
+    """
+    Returns the pipeline name of a source.
+
+    Defaults to `<pipeline_name>_<source>`, e.g. `cloud_cost_analytics_aws`, and can be
+    overridden with `pipeline_name` in the source config section.
+    """
+    try:
+        return dlt.config[f"sources.{SOURCE_SECTIONS[source]}.pipeline_name"]
+    except KeyError:
+        return f"{get_shared_pipeline_name()}_{source}"
+
+
+def get_lock_dir() -> pathlib.Path:
+    """Directory of the run locks, `[pipeline] lock_dir` or `.locks` in the dlt pipelines dir."""
+    try:
+        lock_dir = dlt.config["pipeline.lock_dir"]
+    except KeyError:
+        lock_dir = os.path.join(get_dlt_pipelines_dir(), ".locks")
+    return pathlib.Path(lock_dir).expanduser()
+
+
+@contextlib.contextmanager
+def _pipeline_lock(pipeline_name: str, what: str, blocking: bool = False) -> Iterator[None]:
+    """Holds the `flock` on `<lock_dir>/<pipeline_name>.lock`, waits for it if `blocking`."""
+    lock_dir = get_lock_dir()
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    lock_path = lock_dir / f"{pipeline_name}.lock"
+
+    with open(lock_path, "a+") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.seek(0)
+            holder = lock_file.read().strip() or "unknown"
+            raise SourceLockedError(
+                f"{what} is already running ({holder}), lock file: {lock_path}"
+            ) from None
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"pid {os.getpid()} on {socket.gethostname()}")
+        lock_file.flush()
+        try:
+            yield
+        finally:
+            lock_file.truncate(0)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def source_lock(source: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock for the runs of a source, usable as context manager or decorator.
+
+    The lock is an advisory `flock` on `<lock_dir>/<pipeline_name>.lock`, it is released when
+    the process exits, also on a crash. Point `[pipeline] lock_dir` to a shared volume to
+    exclude overlapping runs across hosts.
+
+    Raises:
+        SourceLockedError: If the lock is held by another run.
+    """
+    with _pipeline_lock(get_source_pipeline_name(source), source):
+        yield
+
+
+def _has_config(key: str) -> bool:
+    try:
+        dlt.secrets[key]
+        return True
+    except KeyError:
+        return False
+
+
+def _shared_sources_state(
+    destination: Optional[str], dataset_name: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Reads the source state of the shared pipeline, locally or else from the destination.
+
+    Without a local working dir (e.g. CI) the state is restored from `dataset_name`, the dataset
+    of the migrating source, into a throwaway pipelines dir: a local shared working dir created
+    here would be attached by the other sources, which would then get the state of this source's
+    dataset instead of their own.
+    """
+    shared_name = get_shared_pipeline_name()
+    try:
+        shared = dlt.attach(pipeline_name=shared_name)
+        return copy.deepcopy(shared.state.get("sources"))
+    except Exception:
+        if not destination:
+            return None
+    with tempfile.TemporaryDirectory(prefix=f"{shared_name}_") as pipelines_dir:
+        try:
+            shared = dlt.pipeline(
+                pipeline_name=shared_name,
+                pipelines_dir=pipelines_dir,
+                destination=destination,
+                dataset_name=dataset_name,
+            )
+            shared.sync_destination()
+            return copy.deepcopy(shared.state.get("sources"))
+        except Exception as e:
+            print(f"⚠️  Could not restore state of pipeline '{shared_name}' from '{dataset_name}': {e}")
+            return None
+
+
+def migrate_shared_state(
+    pipeline: dlt.Pipeline,
+    resource_names: Sequence[str],
+    destination: Optional[str] = None,
+    dataset_name: Optional[str] = None,
+) -> int:
+    """
+    Copies the resource state (incremental cursors, loaded billing periods) of `resource_names`
+    from the shared pipeline into `pipeline`.
+
+    Standalone resources keep their state in a section named after the pipeline, that section is
+    renamed to the new pipeline name. Resources of a `@dlt.source` keep their source section.
+    Sources started in parallel migrate one after the other, under the lock of the shared pipeline.
+
+    Args:
+        pipeline (dlt.Pipeline): The per-source pipeline, before its first run.
+        resource_names (Sequence[str]): Resources that belong to the source.
+        destination (Optional[str]): Destination to restore the shared state from if there is no local one.
+        dataset_name (Optional[str]): Dataset of the source in the destination.
+
+    Returns:
+        int: Number of migrated resources.
+    """
+    shared_name = get_shared_pipeline_name()
+    if pipeline.pipeline_name == shared_name:
+        return 0
+    with _pipeline_lock(shared_name, f"state migration of '{shared_name}'", blocking=True):
+        shared_sources = _shared_sources_state(destination, dataset_name)
+    if not shared_sources:
+        return 0
+
+    shared_section = normalize_schema_name(shared_name)
+    migrated = 0
+    with pipeline.managed_state() as state:
+        sources = state.setdefault("sources", {})
+        for section, section_state in shared_sources.items():
+            target = normalize_schema_name(pipeline.pipeline_name) if section == shared_section else section
+            for name, resource_state in section_state.get("resources", {}).items():
+                if name not in resource_names:
+                    continue
+                resources = sources.setdefault(target, {}).setdefault("resources", {})
+                resources.setdefault(name, copy.deepcopy(resource_state))
+                migrated += 1
+    if migrated:
+        print(f"🔀 Migrated state of {migrated} resource(s) from '{shared_name}' to '{pipeline.pipeline_name}'")
+    return migrated
+
+
+def source_pipeline(
+    source: str,
+    destination: str,
+    dataset_name: str,
+    resource_names: Sequence[str],
+) -> dlt.Pipeline:
+    """
+    Creates the dlt pipeline of a source, migrating the shared state on its first run.
+
+    The pipeline is created once per process and reused by later runs in the same process.
+
+    Args:
+        source (str): One of "aws", "gcp", "stripe".
+        destination (str): dlt destination name.
+        dataset_name (str): Dataset the source loads into.
+        resource_names (Sequence[str]): Resources whose state is migrated from the shared pipeline.
+
+    Returns:
+        dlt.Pipeline: The pipeline with its own working directory and state.
+    """
+    key = (source, destination, dataset_name)
+    if key in _PIPELINES:
+        pipeline = _PIPELINES[key]
+        # runs of a long running process may happen on different threads
+        pipeline.activate()
+        return pipeline
+
+    destination_ref: Any = destination
+    if destination == "duckdb" and not _has_config("destination.duckdb.credentials"):
+        # the local DuckDB file is named after the pipeline by default, keep one file for all sources
+        destination_ref = dlt.destinations.duckdb(f"{get_shared_pipeline_name()}.duckdb")
+
+    pipeline = dlt.pipeline(
+        pipeline_name=get_source_pipeline_name(source),
+        destination=destination_ref,
+        dataset_name=dataset_name,
+    )
+    if pipeline.first_run and not pipeline.state.get("sources"):
+        migrate_shared_state(pipeline, resource_names, destination, dataset_name)
+        # attaching to the shared pipeline made it the active one
+        pipeline.activate()
+    _PIPELINES[key] = pipeline
+    return pipeline
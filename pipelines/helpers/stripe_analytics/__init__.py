@@ -1,14 +1,16 @@
 """ This source uses Stripe API and dlt to load data such as Customer, Subscription, Event etc. to the database and to calculate the MRR and churn rate. """
 
-from typing import Any, Dict, Generator, Iterable, Optional, Tuple
+from typing import Any, Dict, Generator, Iterable, Optional, Set, Tuple
 
 import dlt
 import stripe
+from dlt.common import pendulum
 from dlt.sources import DltResource
 from pendulum import DateTime
 
-from .helpers import pagination, transform_date
-from .settings import ENDPOINTS, INCREMENTAL_ENDPOINTS
+from .arrow import arrow_pages, has_arrow_schema, split_child_tables
+from .helpers import add_time_columns, changed_object_ids, pagination, retrieve_objects, transform_date
+from .settings import ENDPOINTS, EVENT_OBJECTS, EVENT_RETENTION_DAYS, INCREMENTAL_ENDPOINTS
 
 
 @dlt.source
@@ -17,6 +19,7 @@ def stripe_source(
     stripe_secret_key: str = dlt.secrets.value,
     start_date: Optional[DateTime] = None,
     end_date: Optional[DateTime] = None,
+    use_arrow: bool = True,
 ) -> Iterable[DltResource]:
     """
     Retrieves data from the Stripe API for the specified endpoints.
@@ -31,6 +34,8 @@ def stripe_source(
         stripe_secret_key (str): The API access token for authentication. Defaults to the value in the `dlt.secrets` object.
         start_date (Optional[DateTime]): An optional start date to limit the data retrieved. Format: datetime(YYYY, MM, DD). Defaults to None.
         end_date (Optional[DateTime]): An optional end date to limit the data retrieved. Format: datetime(YYYY, MM, DD). Defaults to None.
+        use_arrow (bool): Yield the pages of endpoints with a declared schema (see `arrow.ARROW_SCHEMAS`) as Arrow tables,
+                  their nested lists as sibling child tables. Other endpoints are yielded as dicts. Defaults to True.
 
     Returns:
         Iterable[DltResource]: Resources with data that was created during the period greater than or equal to 'start_date' and less than 'end_date'.
@@ -41,7 +46,12 @@ def stripe_source(
     def stripe_resource(
         endpoint: str,
     ) -> Generator[Dict[Any, Any], Any, None]:
-        yield from pagination(endpoint, start_date, end_date)
+        pages = pagination(endpoint, start_date, end_date)
+        if use_arrow and has_arrow_schema(endpoint):
+            for table in arrow_pages(endpoint, pages):
+                yield from split_child_tables(table, endpoint)
+        else:
+            yield from map(add_time_columns, pages)
 
     for endpoint in endpoints:
         yield dlt.resource(
@@ -57,6 +67,7 @@ def incremental_stripe_source(
     stripe_secret_key: str = dlt.secrets.value,
     initial_start_date: Optional[DateTime] = None,
     end_date: Optional[DateTime] = None,
+    use_arrow: bool = True,
 ) -> Iterable[DltResource]:
     """
     As Stripe API does not include the "updated" key in its responses,
@@ -72,6 +83,7 @@ def incremental_stripe_source(
                             Defaults to None. Format: datetime(YYYY, MM, DD).
         end_date (Optional[DateTime]): An optional end date to limit the data retrieved.
                   Defaults to None. Format: datetime(YYYY, MM, DD).
+        use_arrow (bool): Yield the pages of endpoints with a declared schema as Arrow tables, see `stripe_source`.
     Returns:
         Iterable[DltResource]: Resources with only that data has not yet been loaded.
     """
@@ -88,12 +100,100 @@ def incremental_stripe_source(
         ),
     ) -> Generator[Dict[Any, Any], Any, None]:
         start_value = created.last_value
-        yield from pagination(endpoint, start_date=start_value, end_date=end_date)
+        pages = pagination(endpoint, start_date=start_value, end_date=end_date)
+        if use_arrow and has_arrow_schema(endpoint):
+            yield from arrow_pages(endpoint, pages)
+        else:
+            yield from map(add_time_columns, pages)
 
     for endpoint in endpoints:
-        yield dlt.resource(
+        resource = dlt.resource(
             incremental_resource,
             name=endpoint,
             write_disposition="append",
             primary_key="id",
         )(endpoint)
+        if use_arrow and has_arrow_schema(endpoint):
+            # the incremental filter runs last in the pipe of the resource and needs `created` and `id`
+            # in every item, so the filtered pages are split into the endpoint and child tables by a
+            # transformer. The resource keeps its name and with it the incremental state of earlier loads.
+            resource.selected = False
+            yield resource
+            yield dlt.transformer(
+                split_child_tables,
+                name=f"{endpoint}_tables",
+                write_disposition="append",
+                data_from=resource,
+            )(endpoint, primary_key="id")
+        else:
+            yield resource
+
+
+@dlt.source
+def event_stripe_source(
+    endpoints: Tuple[str, ...] = ENDPOINTS,
+    stripe_secret_key: str = dlt.secrets.value,
+    start_date: Optional[DateTime] = None,
+) -> Iterable[DltResource]:
+    """
+    Loads mutable objects such as Product, Price or Customer incrementally from the Event stream.
+
+    The first run lists every endpoint like `stripe_source`. Later runs read the events created since
+    the previous run, collect the ids of the objects they refer to and retrieve only those objects
+    by id, so a run takes time proportional to the changes instead of the catalog size. Objects are
+    merged on "id"; deleted objects come with `deleted = true`, which deletes them on destinations
+    with merge support (see `merge.merge_filesystem_objects` for the filesystem).
+
+    The events cursor is shared by the endpoints. An endpoint that was not loaded before and a
+    cursor older than the events Stripe keeps (30 days) fall back to a full listing.
+
+    Args:
+        endpoints (Tuple[str, ...]): Endpoints with an entry in `EVENT_OBJECTS`. Defaults to the most popular Stripe API endpoints.
+        stripe_secret_key (str): The API access token for authentication. Needs read access to events. Defaults to the value in the `dlt.secrets` object.
+        start_date (Optional[DateTime]): An optional start date of the full listings. Format: datetime(YYYY, MM, DD). Defaults to None.
+
+    Returns:
+        Iterable[DltResource]: Resources with the objects that changed since the previous run.
+    """
+    stripe.api_key = stripe_secret_key
+    stripe.api_version = "2022-11-15"
+    run_started = int(pendulum.now().timestamp())
+    object_types = [EVENT_OBJECTS[endpoint] for endpoint in endpoints]
+    events: Dict[str, Any] = {}
+
+    def changed_ids(object_type: str) -> Optional[Set[str]]:
+        """Ids of the changed objects of a type, None if there is no valid cursor. Reads the events once per run."""
+        if not events:
+            state = dlt.current.source_state()
+            cursor = state.get("event_cursor")
+            changed, newest = None, None
+            if cursor is not None and cursor >= run_started - EVENT_RETENTION_DAYS * 24 * 3600:
+                changed, newest = changed_object_ids(object_types, cursor)
+            events["changed"] = changed
+            # the newest event read, or the start of this run when the endpoints were listed
+            # or nothing changed; events of the cursor second are read again next run
+            state["event_cursor"] = max(cursor or 0, newest or run_started)
+        if events["changed"] is None:
+            return None
+        return events["changed"][object_type]
+
+    def event_resource(
+        endpoint: str,
+    ) -> Generator[Dict[Any, Any], Any, None]:
+        resource_state = dlt.current.resource_state()
+        ids = changed_ids(EVENT_OBJECTS[endpoint])
+        if ids is None or not resource_state.get("listed"):
+            yield from map(add_time_columns, pagination(endpoint, start_date))
+            resource_state["listed"] = True
+        else:
+            print(f"🔍 {endpoint}: {len(ids)} changed object(s)")
+            yield from map(add_time_columns, retrieve_objects(endpoint, ids))
+
+    for endpoint in endpoints:
+        yield dlt.resource(
+            event_resource,
+            name=endpoint,
+            write_disposition="merge",
+            primary_key="id",
+            columns={"deleted": {"data_type": "bool", "hard_delete": True}},
+        )(endpoint)
@@ -0,0 +1,183 @@
+"""Arrow conversion of Stripe pages for the endpoints with a declared schema"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import dlt
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from dlt.common.typing import TDataItem
+
+# rows per yielded Arrow table, pages of 100 objects are concatenated so the per item cost of
+# the incremental filter and the extract writers is paid once per batch
+ARROW_BATCH_ROWS = 10_000
+
+FEE_DETAIL = pa.struct(
+    [
+        ("amount", pa.int64()),
+        ("application", pa.string()),
+        ("currency", pa.string()),
+        ("description", pa.string()),
+        ("type", pa.string()),
+    ]
+)
+
+# Columns kept per endpoint, all fields of the API objects as the dict extraction loads them.
+# Fields that are not declared are dropped (and reported) so the schema of a table does not
+# depend on the page. List of struct columns are loaded as sibling child tables `<endpoint>__<column>`.
+ARROW_SCHEMAS: Dict[str, pa.Schema] = {
+    "BalanceTransaction": pa.schema(
+        [
+            pa.field("id", pa.string(), nullable=False),
+            ("object", pa.string()),
+            ("amount", pa.int64()),
+            ("available_on", pa.int64()),
+            ("balance_type", pa.string()),
+            ("created", pa.int64()),
+            ("currency", pa.string()),
+            ("description", pa.string()),
+            ("exchange_rate", pa.float64()),
+            ("fee", pa.int64()),
+            ("fee_details", pa.list_(FEE_DETAIL)),
+            ("net", pa.int64()),
+            ("reporting_category", pa.string()),
+            ("source", pa.string()),
+            ("status", pa.string()),
+            ("type", pa.string()),
+        ]
+    ),
+}
+
+
+def has_arrow_schema(endpoint: str) -> bool:
+    return endpoint in ARROW_SCHEMAS
+
+
+def _value(value: Any) -> Any:
+    # expanded objects (e.g. the `source` of a balance transaction) are loaded as their id
+    if isinstance(value, dict) and "id" in value:
+        return value["id"]
+    return value
+
+
+def page_to_arrow(endpoint: str, page: List[Dict[str, Any]]) -> pa.Table:
+    """
+    Converts a page of Stripe objects to an Arrow table with the declared schema of the endpoint.
+
+    Args:
+        endpoint (str): Endpoint with an entry in `ARROW_SCHEMAS`.
+        page (List[Dict[str, Any]]): Objects of one list response.
+
+    Returns:
+        pa.Table: One row per object, list columns still nested.
+    """
+    schema = ARROW_SCHEMAS[endpoint]
+    try:
+        return pa.Table.from_pylist(page, schema=schema)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # an expanded object in a column declared as its id
+        pass
+    columns = []
+    for field in schema:
+        if pa.types.is_list(field.type):
+            keys = field.type.value_type.names
+            values = [
+                [{key: _value(item.get(key)) for key in keys} for item in row.get(field.name) or []]
+                for row in page
+            ]
+        else:
+            values = [_value(row.get(field.name)) for row in page]
+        columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def add_time_columns(table: pa.Table) -> pa.Table:
+    """Adds the typed `created_at` (UTC timestamp) and `date` columns derived from the unix `created`."""
+    if "created" not in table.schema.names:
+        return table
+    created_at = table["created"].cast(pa.timestamp("s", tz="UTC"))
+    return table.append_column("created_at", created_at).append_column("date", created_at.cast(pa.date32()))
+
+
+def arrow_pages(
+    endpoint: str, pages: Iterable[List[Dict[str, Any]]], batch_rows: int = ARROW_BATCH_ROWS
+) -> Iterator[pa.Table]:
+    """
+    Converts the pages of an endpoint to Arrow tables of about `batch_rows` rows.
+
+    Args:
+        endpoint (str): Endpoint with an entry in `ARROW_SCHEMAS`.
+        pages (Iterable[List[Dict[str, Any]]]): Pages as yielded by `pagination`.
+        batch_rows (int): Rows after which the converted pages are yielded as one table.
+
+    Returns:
+        Iterator[pa.Table]: Tables with the declared schema of the endpoint and the typed time columns.
+    """
+    batch: List[pa.Table] = []
+    rows = 0
+    declared = set(ARROW_SCHEMAS[endpoint].names)
+    dropped: Set[str] = set()
+    for page in pages:
+        if not page:
+            continue
+        undeclared = {key for row in page for key in row} - declared - dropped
+        if undeclared:
+            print(f"⚠️  {endpoint}: field(s) {sorted(undeclared)} not in ARROW_SCHEMAS, dropped from the Arrow tables")
+            dropped |= undeclared
+        batch.append(page_to_arrow(endpoint, page))
+        rows += len(page)
+        if rows >= batch_rows:
+            yield add_time_columns(pa.concat_tables(batch))
+            batch, rows = [], 0
+    if batch:
+        yield add_time_columns(pa.concat_tables(batch))
+
+
+def split_child_tables(
+    table: pa.Table, endpoint: str, primary_key: Optional[str] = None
+) -> Iterator[TDataItem]:
+    """
+    Splits the list columns of a page off into sibling child tables.
+
+    The parent table is yielded without the list columns and with `_dlt_id` set to the Stripe
+    id. Child rows reference it in `_dlt_parent_id` and keep their position in `_dlt_list_idx`,
+    so queries written against the child tables of the dict extraction join the same way.
+
+    Args:
+        table (pa.Table): Page converted by `page_to_arrow`, after the incremental filter.
+        endpoint (str): Endpoint name, also the resource and parent table name.
+        primary_key (Optional[str]): Primary key hint of the parent table, not passed on to the child tables.
+
+    Returns:
+        Iterator[TDataItem]: The parent table, then a child table per list column, marked with their table names.
+    """
+    list_columns = [field.name for field in table.schema if pa.types.is_list(field.type)]
+    parent = table.drop_columns(list_columns)
+    parent = parent.append_column("_dlt_id", parent["id"])
+    # marked as well, a transformer that splits the pages of a resource loads them into its table
+    if primary_key:
+        yield dlt.mark.with_hints(
+            parent,
+            dlt.mark.make_hints(table_name=endpoint, primary_key=primary_key),
+            create_table_variant=True,
+        )
+    else:
+        yield dlt.mark.with_table_name(parent, endpoint)
+
+    for column in list_columns:
+        lists = table[column].combine_chunks()
+        parent_index = pc.list_parent_indices(lists)
+        if len(parent_index) == 0:
+            continue
+        lengths = pc.fill_null(pc.list_value_length(lists), 0).to_numpy()
+        starts = np.cumsum(lengths) - lengths
+        items = pc.list_flatten(lists)
+        child = pa.Table.from_arrays(
+            [
+                pc.take(table["id"], parent_index),
+                pa.array(np.arange(len(parent_index)) - starts[parent_index.to_numpy()], pa.int64()),
+            ]
+            + items.flatten(),
+            names=["_dlt_parent_id", "_dlt_list_idx"] + [field.name for field in items.type],
+        )
+        yield dlt.mark.with_table_name(child, f"{endpoint}__{column}")
@@ -1,12 +1,18 @@
 """Stripe analytics source helpers"""
 
-from typing import Any, Dict, Iterable, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 import stripe
 from dlt.common import pendulum
 from dlt.common.typing import TDataItem
 from pendulum import DateTime
 
+from helpers.tracing import span
+
+from .settings import RETRIEVE_BATCH_SIZE, RETRIEVE_MAX_WORKERS
+
 
 def pagination(
     endpoint: str, start_date: Optional[Any] = None, end_date: Optional[Any] = None
@@ -39,6 +45,19 @@ def pagination(
             break
 
 
+def add_time_columns(page: List[TDataItem]) -> List[TDataItem]:
+    """
+    Adds the typed `created_at` (UTC timestamp) and `date` columns derived from the unix `created`
+    to the objects of a page, so models filter on a date column instead of converting `created`.
+    """
+    for obj in page:
+        if "created" in obj and obj["created"] is not None:
+            created_at = datetime.fromtimestamp(obj["created"], tz=timezone.utc)
+            obj["created_at"] = created_at
+            obj["date"] = created_at.date()
+    return page
+
+
 def transform_date(date: Union[str, DateTime, int]) -> int:
     if isinstance(date, str):
         date = pendulum.from_format(date, "%Y-%m-%dT%H:%M:%SZ")
@@ -62,7 +81,78 @@ def stripe_get_data(
     if resource == "Subscription":
         kwargs.update({"status": "all"})
 
-    resource_dict = getattr(stripe, resource).list(
-        created={"gte": start_date, "lt": end_date}, limit=100, **kwargs
-    )
+    with span(
+        "stripe.list",
+        **{"stripe.endpoint": resource, "stripe.starting_after": kwargs.get("starting_after")},
+    ) as page_span:
+        resource_dict = getattr(stripe, resource).list(
+            created={"gte": start_date, "lt": end_date}, limit=100, **kwargs
+        )
+        page_span.set_attributes(
+            {"rows": len(resource_dict["data"]), "stripe.has_more": resource_dict["has_more"]}
+        )
     return dict(resource_dict)
+
+
+def changed_object_ids(
+    object_types: Iterable[str], start_date: int
+) -> Tuple[Dict[str, Set[str]], Optional[int]]:
+    """
+    Collects the ids of the objects that changed since `start_date` from the Event stream.
+
+    Args:
+        object_types (Iterable[str]): Object types as in `data.object.object`, e.g. "product".
+        start_date (int): Unix time of the first event to read.
+
+    Returns:
+        Tuple[Dict[str, Set[str]], Optional[int]]: Changed ids per object type and the time of the
+            newest event, None if there was no event.
+    """
+    changed: Dict[str, Set[str]] = {object_type: set() for object_type in object_types}
+    newest = None
+    for page in pagination("Event", start_date=start_date):
+        for event in page:
+            newest = max(newest or event["created"], event["created"])
+            obj = event["data"]["object"]
+            if obj.get("object") in changed and obj.get("id"):
+                changed[obj["object"]].add(obj["id"])
+    return changed, newest
+
+
+def _retrieve(endpoint: str, object_id: str) -> Dict[Any, Any]:
+    try:
+        return dict(getattr(stripe, endpoint).retrieve(object_id))
+    except stripe.InvalidRequestError as e:
+        if e.http_status != 404:
+            raise
+        # deleted objects are gone from the API, customers are still returned with `deleted`
+        return {"id": object_id, "deleted": True}
+
+
+def retrieve_objects(
+    endpoint: str,
+    ids: Iterable[str],
+    batch_size: int = RETRIEVE_BATCH_SIZE,
+    max_workers: int = RETRIEVE_MAX_WORKERS,
+) -> Iterable[TDataItem]:
+    """
+    Retrieves objects of an endpoint by id, a page per batch of ids.
+
+    Deleted objects are yielded as `{"id": ..., "deleted": True}`.
+
+    Args:
+        endpoint (str): The endpoint, e.g. "Product".
+        ids (Iterable[str]): Ids of the objects.
+        batch_size (int): Ids per yielded page.
+        max_workers (int): Objects of a batch retrieved at the same time.
+
+    Returns:
+        Iterable[TDataItem]: Pages of objects.
+    """
+    ids = sorted(ids)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stripe_retrieve") as executor:
+        for offset in range(0, len(ids), batch_size):
+            batch: List[str] = ids[offset : offset + batch_size]
+            with span("stripe.retrieve", **{"stripe.endpoint": endpoint, "rows": len(batch)}):
+                page = list(executor.map(lambda object_id: _retrieve(endpoint, object_id), batch))
+            yield page
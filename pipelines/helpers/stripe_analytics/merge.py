@@ -0,0 +1,97 @@
+"""
+Local merge of the Stripe objects loaded from events by the dlt filesystem destination.
+
+`event_stripe_source` loads changed objects with `write_disposition="merge"` on "id", which
+destinations with merge support turn into an upsert, deleting objects that come with
+`deleted = true`. The filesystem destination appends plain parquet instead, so
+`merge_filesystem_objects` runs after each load: the latest row of every object is kept in one
+compacted file per table and the rows of the nested tables follow their parent rows.
+"""
+
+import os
+import pathlib
+from typing import List, Sequence
+
+import duckdb
+
+COMPACTED_FILE = "compacted.parquet"
+
+
+def _sql_list(paths: Sequence[pathlib.Path]) -> str:
+    return "[" + ", ".join(f"'{p.as_posix()}'" for p in paths) + "]"
+
+
+def _write(con: duckdb.DuckDBPyConnection, select_sql: str, target: pathlib.Path) -> None:
+    tmp = target.with_name(f"{target.name}.tmp")
+    con.execute(f"COPY ({select_sql}) TO '{tmp.as_posix()}' (FORMAT PARQUET)")
+    os.replace(tmp, target)
+
+
+def _table_sql(table_dir: pathlib.Path, files: List[pathlib.Path]) -> str:
+    sources = [f"SELECT * FROM read_parquet({_sql_list(files)}, union_by_name = true)"] if files else []
+    compacted = table_dir / COMPACTED_FILE
+    if compacted.exists():
+        sources.append(f"SELECT * FROM read_parquet('{compacted.as_posix()}')")
+    return "\nUNION ALL BY NAME\n".join(sources)
+
+
+def merge_filesystem_objects(dataset_dir: pathlib.Path, table_name: str) -> int:
+    """
+    Merges the freshly loaded parquet files of a table into its compacted file.
+
+    The fresh dlt files are deleted only after the table and its nested tables are written.
+
+    Args:
+        dataset_dir (pathlib.Path): Directory of the dataset, e.g. viz_rill/data/stripe_costs.
+        table_name (str): The root table, e.g. "product", its nested tables are `<table_name>__*`.
+
+    Returns:
+        int: Objects in the table after the merge, 0 if there was nothing to merge.
+    """
+    table_dir = pathlib.Path(dataset_dir) / table_name
+    fresh_files = sorted(
+        p for p in table_dir.glob("*.parquet") if p.name != COMPACTED_FILE
+    ) if table_dir.exists() else []
+    if not fresh_files:
+        return 0
+
+    con = duckdb.connect(database=":memory:")
+    con.execute(f"CREATE VIEW loaded AS {_table_sql(table_dir, fresh_files)}")
+    columns = {row[0] for row in con.execute("DESCRIBE SELECT * FROM loaded").fetchall()}
+    # the latest version of every object, deleted objects are dropped
+    con.execute(
+        f"""
+        CREATE TABLE merged AS
+          SELECT * FROM loaded
+          QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY _dlt_load_id DESC) = 1
+        """
+    )
+    if "deleted" in columns:
+        con.execute("DELETE FROM merged WHERE deleted")
+
+    # nested tables of the filesystem have no `_dlt_root_id`, parents are filtered before their children
+    kept = {table_name: "merged"}
+    fresh_nested_files = []
+    nested_dirs = [p for p in table_dir.parent.glob(f"{table_name}__*") if p.is_dir()]
+    for nested_dir in sorted(nested_dirs, key=lambda p: (p.name.count("__"), p.name)):
+        parent = kept.get(nested_dir.name.rsplit("__", 1)[0])
+        nested_files = sorted(p for p in nested_dir.glob("*.parquet") if p.name != COMPACTED_FILE)
+        if parent is None or (not nested_files and not (nested_dir / COMPACTED_FILE).exists()):
+            continue
+        kept[nested_dir.name] = f"kept_{len(kept)}"
+        con.execute(
+            f"""
+            CREATE TABLE {kept[nested_dir.name]} AS
+              SELECT * FROM ({_table_sql(nested_dir, nested_files)})
+              WHERE _dlt_parent_id IN (SELECT _dlt_id FROM {parent})
+            """
+        )
+        _write(con, f"SELECT * FROM {kept[nested_dir.name]}", nested_dir / COMPACTED_FILE)
+        fresh_nested_files += nested_files
+
+    _write(con, "SELECT * FROM merged", table_dir / COMPACTED_FILE)
+    objects = con.execute("SELECT COUNT(*) FROM merged").fetchone()[0]
+    con.close()
+    for path in fresh_files + fresh_nested_files:
+        path.unlink()
+    return objects
@@ -13,3 +13,24 @@ ENDPOINTS = (
 )
 # possible incremental endpoints
 INCREMENTAL_ENDPOINTS = ("Event", "BalanceTransaction")
+# object type in `data.object.object` of the events of the endpoints that can be loaded from events
+EVENT_OBJECTS = {
+    "Subscription": "subscription",
+    "Account": "account",
+    "Coupon": "coupon",
+    "Customer": "customer",
+    "Invoice": "invoice",
+    "Product": "product",
+    "Price": "price",
+}
+# Stripe lists the events of the last 30 days only, older cursors need a full listing
+EVENT_RETENTION_DAYS = 30
+# changed objects are retrieved by id in batches, the ids of a batch concurrently
+RETRIEVE_BATCH_SIZE = 100
+RETRIEVE_MAX_WORKERS = 8
+# typed time columns added to objects with a unix `created`, and the same columns in DuckDB SQL
+# for files loaded before they were added
+TIME_COLUMNS_SQL = {
+    "created_at": "to_timestamp(created)",
+    "date": "CAST(to_timestamp(created) AT TIME ZONE 'UTC' AS DATE)",
+}
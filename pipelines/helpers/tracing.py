@@ -0,0 +1,331 @@
+"""
+Tracing of pipeline stages and remote calls.
+
+Spans are exported with OpenTelemetry to an OTLP collector when `OTEL_EXPORTER_OTLP_ENDPOINT`
+is set and the `opentelemetry-sdk` and `opentelemetry-exporter-otlp` packages are installed.
+Without a collector, spans are appended as JSON lines to `.dlt/traces.jsonl` (or
+`[tracing] json_file`), with the same trace and span ids, so a slow run can still be taken
+apart locally. Tracing is off unless a collector endpoint is set or `[tracing] enabled = true`
+(`TRACING__ENABLED=true`); spans are then no-ops.
+
+Processes started by the orchestrator and the daemon continue the trace of their parent via
+the W3C `TRACEPARENT` environment variable.
+
+This module imports neither dlt nor any client library, the cur-wizard and ClickHouse scripts
+use it as well.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import pathlib
+import secrets
+import sys
+import threading
+import time
+import tomllib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+SERVICE_NAME = "cloud-cost-analyzer"
+PROJECT_DLT_DIR = pathlib.Path(__file__).resolve().parents[2] / ".dlt"
+CONFIG_FILE = PROJECT_DLT_DIR / "config.toml"
+DEFAULT_JSON_FILE = PROJECT_DLT_DIR / "traces.jsonl"
+# longest SQL statement kept as span attribute
+MAX_STATEMENT_LENGTH = 2000
+
+_lock = threading.Lock()
+_mode: Optional[str] = None
+_tracer: Any = None
+_json_file: Optional[pathlib.Path] = None
+# (trace_id, span_id) of the current span in JSON mode
+_current: contextvars.ContextVar = contextvars.ContextVar("cloud_cost_span", default=None)
+
+
+def _setting(key: str, default: Any) -> Any:
+    value = os.getenv(f"TRACING__{key.upper()}")
+    if value is not None:
+        return value
+    if "dlt" in sys.modules:
+        try:
+            return sys.modules["dlt"].config[f"tracing.{key}"]
+        except KeyError:
+            return default
+    # the dashboard generators do not import dlt, they read the project config file directly
+    try:
+        with open(CONFIG_FILE, "rb") as f:
+            return tomllib.load(f).get("tracing", {}).get(key, default)
+    except (OSError, tomllib.TOMLDecodeError):
+        return default
+
+
+def _is_true(value: Any) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _init_otlp() -> bool:
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        print("⚠️  OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk is not installed, tracing to JSON")
+        return False
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        try:
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            print("⚠️  opentelemetry-exporter-otlp is not installed, tracing to JSON")
+            return False
+
+    global _tracer
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", SERVICE_NAME)})
+    )
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    # flush the batch of short lived processes (normalizers, scripts) before they exit
+    atexit.register(provider.shutdown)
+    _tracer = provider.get_tracer(__name__)
+    return True
+
+
+def _get_mode() -> str:
+    """Picks the exporter on first use: "otlp", "json" or "off"."""
+    global _mode, _json_file
+    if _mode is not None:
+        return _mode
+    with _lock:
+        if _mode is not None:
+            return _mode
+        collector = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")
+        if collector and _init_otlp():
+            _mode = "otlp"
+        elif collector or _is_true(_setting("enabled", False)):
+            _json_file = pathlib.Path(_setting("json_file", DEFAULT_JSON_FILE)).expanduser()
+            # relative to the project, the cur-wizard scripts run in viz_rill
+            _json_file = (PROJECT_DLT_DIR.parent / _json_file).resolve()
+            _json_file.parent.mkdir(parents=True, exist_ok=True)
+            _mode = "json"
+        else:
+            _mode = "off"
+    return _mode
+
+
+def _clean_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    clean = {}
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if not isinstance(value, (str, bool, int, float)):
+            value = str(value)
+        if key == "db.statement":
+            value = " ".join(value.split())[:MAX_STATEMENT_LENGTH]
+        clean[key] = value
+    return clean
+
+
+def _parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    parts = (value or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None
+
+
+def _otel_parent_context() -> Any:
+    """Context of the parent process when this process has no active span yet."""
+    from opentelemetry import trace
+    from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+    if trace.get_current_span().get_span_context().is_valid or not os.getenv("TRACEPARENT"):
+        return None
+    return TraceContextTextMapPropagator().extract({"traceparent": os.environ["TRACEPARENT"]})
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+
+class _JsonSpan:
+    """A span written as one JSON line when it ends."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any], start: Optional[float] = None) -> None:
+        parent = _current.get() or _parse_traceparent(os.getenv("TRACEPARENT"))
+        self.name = name
+        self.trace_id = parent[0] if parent else secrets.token_hex(16)
+        self.parent_span_id = parent[1] if parent else None
+        self.span_id = secrets.token_hex(8)
+        self.attributes = _clean_attributes(attributes)
+        self.start = start if start is not None else time.time()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes.update(_clean_attributes({key: value}))
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(_clean_attributes(attributes))
+
+    def end(self, end: Optional[float] = None, error: Optional[BaseException] = None) -> None:
+        end = end if end is not None else time.time()
+        record = dict(
+            name=self.name,
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_span_id=self.parent_span_id,
+            start_time=datetime.fromtimestamp(self.start, timezone.utc).isoformat(),
+            end_time=datetime.fromtimestamp(end, timezone.utc).isoformat(),
+            duration_ms=round((end - self.start) * 1000, 3),
+            status="error" if error else "ok",
+            error=repr(error) if error else None,
+            attributes=self.attributes,
+            resource={"service.name": SERVICE_NAME, "process.pid": os.getpid()},
+        )
+        line = json.dumps(record, default=str) + "\n"
+        with _lock, open(_json_file, "a") as f:
+            f.write(line)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """
+    Traces the enclosed block, usable as context manager or decorator.
+
+    The yielded span takes more attributes with `set_attribute`, e.g. the rows of a query.
+    Exceptions are recorded on the span and re-raised.
+
+    Args:
+        name (str): Span name, e.g. "bigquery.query".
+        **attributes (Any): Span attributes, dotted keys are passed as `**{"db.system": ...}`.
+    """
+    mode = _get_mode()
+    if mode == "off":
+        yield _NoopSpan()
+    elif mode == "otlp":
+        with _tracer.start_as_current_span(
+            name, context=_otel_parent_context(), attributes=_clean_attributes(attributes)
+        ) as otel_span:
+            yield otel_span
+    else:
+        json_span = _JsonSpan(name, attributes)
+        token = _current.set((json_span.trace_id, json_span.span_id))
+        try:
+            yield json_span
+        except BaseException as e:
+            json_span.end(error=e)
+            raise
+        else:
+            json_span.end()
+        finally:
+            _current.reset(token)
+
+
+def record_span(name: str, start: float, end: float, **attributes: Any) -> None:
+    """Records a finished span with explicit start and end times (unix seconds), e.g. from the dlt trace."""
+    mode = _get_mode()
+    if mode == "otlp":
+        otel_span = _tracer.start_span(
+            name,
+            context=_otel_parent_context(),
+            start_time=int(start * 1e9),
+            attributes=_clean_attributes(attributes),
+        )
+        otel_span.end(end_time=int(end * 1e9))
+    elif mode == "json":
+        _JsonSpan(name, attributes, start=start).end(end)
+
+
+def traceparent() -> Optional[str]:
+    """W3C traceparent of the current span, passed to child processes in `TRACEPARENT`."""
+    mode = _get_mode()
+    if mode == "otlp":
+        from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+        carrier: Dict[str, str] = {}
+        TraceContextTextMapPropagator().inject(carrier)
+        return carrier.get("traceparent")
+    if mode == "json":
+        current = _current.get()
+        if current:
+            return f"00-{current[0]}-{current[1]}-01"
+    return os.getenv("TRACEPARENT")
+
+
+def child_env() -> Dict[str, str]:
+    """Environment for a subprocess that continues the current trace."""
+    env = dict(os.environ)
+    parent = traceparent()
+    if parent:
+        env["TRACEPARENT"] = parent
+    return env
+
+
+class _TracedDuckDB:
+    """DuckDB connection whose statements are traced, everything else is passed through."""
+
+    def __init__(self, con: Any, name: str) -> None:
+        self.wrapped = con
+        self.name = name
+
+    def execute(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        with span("duckdb.execute", **{"db.system": "duckdb", "db.name": self.name, "db.statement": query}):
+            return self.wrapped.execute(query, *args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.wrapped, name)
+
+
+def traced_duckdb(con: Any, name: str) -> Any:
+    """Traces the statements of a DuckDB connection, returns `con` itself when tracing is off."""
+    if _get_mode() == "off":
+        return con
+    return _TracedDuckDB(con, name)
+
+
+class _TracedClickHouse:
+    """clickhouse-connect client whose commands, queries and inserts are traced."""
+
+    def __init__(self, client: Any) -> None:
+        self.wrapped = client
+
+    def command(self, cmd: str, *args: Any, **kwargs: Any) -> Any:
+        with span("clickhouse.command", **{"db.system": "clickhouse", "db.statement": cmd}) as command_span:
+            result = self.wrapped.command(cmd, *args, **kwargs)
+            # DDL and mutations return a QuerySummary with the written rows and bytes
+            command_span.set_attributes(
+                {
+                    "rows": getattr(result, "written_rows", None),
+                    "bytes": getattr(result, "written_bytes", None),
+                }
+            )
+            return result
+
+    def query(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        with span("clickhouse.query", **{"db.system": "clickhouse", "db.statement": query}) as query_span:
+            result = self.wrapped.query(query, *args, **kwargs)
+            query_span.set_attribute("rows", getattr(result, "row_count", None))
+            return result
+
+    def insert(self, table: str, *args: Any, **kwargs: Any) -> Any:
+        with span("clickhouse.insert", **{"db.system": "clickhouse", "db.sql.table": table}) as insert_span:
+            result = self.wrapped.insert(table, *args, **kwargs)
+            insert_span.set_attributes(
+                {"rows": getattr(result, "written_rows", None), "bytes": getattr(result, "written_bytes", None)}
+            )
+            return result
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.wrapped, name)
+
+
+def traced_clickhouse(client: Any) -> Any:
+    """Traces the calls of a clickhouse-connect client, returns `client` itself when tracing is off."""
+    if _get_mode() == "off":
+        return client
+    return _TracedClickHouse(client)
@@ -0,0 +1,558 @@
+"""
+File-level work queue to shard CUR processing across worker processes and hosts.
+
+A coordinator enqueues one task per file under a deterministic task id, any number of workers
+lease tasks, keep their lease alive with heartbeats while they work and mark the task done with
+a small JSON result. A worker that crashes stops sending heartbeats, its lease expires and the
+task is leased again by someone else. Completion is idempotent: handlers write their output to a
+path derived from the task, so a task that is processed twice produces the same result.
+Enqueuing a task that failed MAX_ATTEMPTS times gives it new attempts, so the next run retries
+it, and the coordinator purges its tasks once it has their results.
+
+Backends:
+    sqlite:///path/to/queue.db   one SQLite file, for worker processes on one host (default)
+    file:///path/to/queue        a directory of JSON/lease/done files, put it on a shared volume
+                                 to distribute work across hosts
+"""
+
+import abc
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+# Seconds a lease is valid without a heartbeat, heartbeats are sent every third of it
+DEFAULT_LEASE_SECONDS = 300
+# Tasks that failed this many times are not leased again
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class Task:
+    """A leased task."""
+
+    queue: str
+    task_id: str
+    payload: Dict[str, Any]
+    attempts: int
+    worker_id: str
+
+
+def default_worker_id() -> str:
+    """Identifies this process across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue(abc.ABC):
+    """Lease based task queue, see the module docstring for the protocol."""
+
+    @abc.abstractmethod
+    def enqueue(self, queue: str, tasks: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Adds tasks by id, existing tasks are kept except failed ones, which are reset to pending
+        with new attempts. Returns the number of new and reset tasks.
+        """
+
+    @abc.abstractmethod
+    def lease(
+        self, queue: str, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> Optional[Task]:
+        """Leases a pending task or one whose lease expired, None if there is none."""
+
+    @abc.abstractmethod
+    def heartbeat(self, task: Task, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extends the lease of a task, False if the lease was lost to another worker."""
+
+    @abc.abstractmethod
+    def complete(self, task: Task, result: Optional[Dict[str, Any]] = None) -> None:
+        """Marks a task done with its result, also if the lease was lost meanwhile."""
+
+    @abc.abstractmethod
+    def release(self, task: Task, error: str) -> None:
+        """Gives a failed task back to the queue."""
+
+    @abc.abstractmethod
+    def states(self, queue: str, task_ids: Iterable[str]) -> Dict[str, str]:
+        """Returns "pending", "leased", "done" or "failed" for each of the given tasks."""
+
+    @abc.abstractmethod
+    def results(self, queue: str, task_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Returns the results of the given tasks that are done."""
+
+    @abc.abstractmethod
+    def purge(self, queue: str, task_ids: Iterable[str]) -> int:
+        """Removes the given tasks that are done, returns the number of removed tasks."""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue in a SQLite file, safe for concurrent processes on one host."""
+
+    def __init__(self, path: str) -> None:
+        self.path = pathlib.Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as con:
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    queue TEXT NOT NULL,
+                    task_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    PRIMARY KEY (queue, task_id)
+                )
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # autocommit mode, BEGIN IMMEDIATE serializes the lease updates between processes
+        con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            yield con
+        finally:
+            con.close()
+
+    def enqueue(self, queue: str, tasks: Dict[str, Dict[str, Any]]) -> int:
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            before = con.total_changes
+            con.executemany(
+                "INSERT OR IGNORE INTO tasks (queue, task_id, payload) VALUES (?, ?, ?)",
+                [(queue, task_id, json.dumps(payload)) for task_id, payload in tasks.items()],
+            )
+            con.executemany(
+                """
+                UPDATE tasks SET state = 'pending', payload = ?, attempts = 0, worker_id = NULL,
+                    lease_expires = NULL, error = NULL
+                WHERE queue = ? AND task_id = ? AND state = 'failed'
+                """,
+                [(json.dumps(payload), queue, task_id) for task_id, payload in tasks.items()],
+            )
+            added = con.total_changes - before
+            con.execute("COMMIT")
+        return added
+
+    def lease(
+        self, queue: str, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> Optional[Task]:
+        now = time.time()
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            # a worker crashed on the last attempt
+            con.execute(
+                """
+                UPDATE tasks SET state = 'failed', error = 'lease expired'
+                WHERE queue = ? AND state = 'leased' AND lease_expires < ? AND attempts >= ?
+                """,
+                (queue, now, MAX_ATTEMPTS),
+            )
+            row = con.execute(
+                """
+                SELECT task_id, payload, attempts FROM tasks
+                WHERE queue = ? AND attempts < ?
+                  AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?))
+                ORDER BY task_id LIMIT 1
+                """,
+                (queue, MAX_ATTEMPTS, now),
+            ).fetchone()
+            if row is None:
+                con.execute("COMMIT")
+                return None
+            task_id, payload, attempts = row
+            con.execute(
+                """
+                UPDATE tasks SET state = 'leased', worker_id = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE queue = ? AND task_id = ?
+                """,
+                (worker_id, now + lease_seconds, queue, task_id),
+            )
+            con.execute("COMMIT")
+        return Task(queue, task_id, json.loads(payload), attempts + 1, worker_id)
+
+    def heartbeat(self, task: Task, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        with self._connect() as con:
+            updated = con.execute(
+                """
+                UPDATE tasks SET lease_expires = ?
+                WHERE queue = ? AND task_id = ? AND state = 'leased' AND worker_id = ?
+                """,
+                (time.time() + lease_seconds, task.queue, task.task_id, task.worker_id),
+            ).rowcount
+        return updated == 1
+
+    def complete(self, task: Task, result: Optional[Dict[str, Any]] = None) -> None:
+        with self._connect() as con:
+            con.execute(
+                """
+                UPDATE tasks SET state = 'done', worker_id = ?, lease_expires = NULL, result = ?
+                WHERE queue = ? AND task_id = ? AND state != 'done'
+                """,
+                (task.worker_id, json.dumps(result or {}), task.queue, task.task_id),
+            )
+
+    def release(self, task: Task, error: str) -> None:
+        with self._connect() as con:
+            con.execute(
+                """
+                UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    worker_id = NULL, lease_expires = NULL, error = ?
+                WHERE queue = ? AND task_id = ? AND state = 'leased' AND worker_id = ?
+                """,
+                (MAX_ATTEMPTS, error, task.queue, task.task_id, task.worker_id),
+            )
+
+    def states(self, queue: str, task_ids: Iterable[str]) -> Dict[str, str]:
+        task_ids = list(task_ids)
+        with self._connect() as con:
+            rows = con.execute(
+                f"SELECT task_id, state FROM tasks WHERE queue = ? AND task_id IN ({','.join('?' * len(task_ids))})",
+                (queue, *task_ids),
+            ).fetchall()
+        return dict(rows)
+
+    def results(self, queue: str, task_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        task_ids = list(task_ids)
+        with self._connect() as con:
+            rows = con.execute(
+                f"""
+                SELECT task_id, result FROM tasks
+                WHERE queue = ? AND state = 'done' AND task_id IN ({','.join('?' * len(task_ids))})
+                """,
+                (queue, *task_ids),
+            ).fetchall()
+        return {task_id: json.loads(result) for task_id, result in rows}
+
+    def purge(self, queue: str, task_ids: Iterable[str]) -> int:
+        task_ids = list(task_ids)
+        with self._connect() as con:
+            return con.execute(
+                f"DELETE FROM tasks WHERE queue = ? AND state = 'done' AND task_id IN ({','.join('?' * len(task_ids))})",
+                (queue, *task_ids),
+            ).rowcount
+
+
+class DirectoryWorkQueue(WorkQueue):
+    """
+    Work queue as files in a directory, usable from several hosts through a shared volume.
+
+    Per task there is `<id>.task` with the payload, `<id>.lease` with owner, expiry and a token
+    while it is leased, `<id>.done` with the result once completed and `<id>.failed` after
+    MAX_ATTEMPTS. New leases are created with O_EXCL. An expired lease is taken over by the
+    worker that creates `<id>.<token>.claim` for its token with O_EXCL, so exactly one worker
+    wins a takeover.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = pathlib.Path(path).expanduser()
+
+    def _dir(self, queue: str) -> pathlib.Path:
+        queue_dir = self.path / queue
+        queue_dir.mkdir(parents=True, exist_ok=True)
+        return queue_dir
+
+    @staticmethod
+    def _file_name(task_id: str) -> str:
+        # task ids are urls, keep the file names short and portable
+        return hashlib.sha256(task_id.encode()).hexdigest()[:32]
+
+    @staticmethod
+    def _write(path: pathlib.Path, content: Dict[str, Any]) -> None:
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(content))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read(path: pathlib.Path) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    @staticmethod
+    def _remove_lease(task_path: pathlib.Path) -> None:
+        task_path.with_suffix(".lease").unlink(missing_ok=True)
+        for claim in task_path.parent.glob(f"{task_path.stem}.*.claim"):
+            claim.unlink(missing_ok=True)
+
+    def enqueue(self, queue: str, tasks: Dict[str, Dict[str, Any]]) -> int:
+        queue_dir = self._dir(queue)
+        added = 0
+        for task_id, payload in tasks.items():
+            path = queue_dir / f"{self._file_name(task_id)}.task"
+            failed_path = path.with_suffix(".failed")
+            if failed_path.exists():
+                # the lease goes first, the attempts start over once the task is no longer failed
+                self._remove_lease(path)
+                self._write(path, {"task_id": task_id, "payload": payload})
+                failed_path.unlink(missing_ok=True)
+                added += 1
+            elif not path.exists():
+                self._write(path, {"task_id": task_id, "payload": payload})
+                added += 1
+        return added
+
+    def _try_lease(self, task_path: pathlib.Path, worker_id: str, lease_seconds: float) -> Optional[int]:
+        """Returns the attempt number if the task could be leased."""
+        lease_path = task_path.with_suffix(".lease")
+
+        def new_lease(attempts: int) -> Dict[str, Any]:
+            return {
+                "worker_id": worker_id,
+                "expires": time.time() + lease_seconds,
+                "attempts": attempts,
+                "token": uuid.uuid4().hex,
+            }
+
+        if not lease_path.exists():
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return None
+            with os.fdopen(fd, "w") as f:
+                json.dump(new_lease(1), f)
+            return 1
+        # read after the existence check: a lease created in between is fresh, one that is still
+        # being written reads as None, neither is taken over
+        previous = self._read(lease_path)
+        if not previous or not previous.get("token") or previous.get("expires", 0) >= time.time():
+            return None
+        if previous.get("attempts", 0) >= MAX_ATTEMPTS:
+            self._write(task_path.with_suffix(".failed"), {"error": previous.get("error", "lease expired")})
+            return None
+        # take over an expired or released lease: only one worker can claim its token, workers that
+        # read the lease before the takeover fail to claim the same token again
+        claim_path = task_path.with_name(f"{task_path.stem}.{previous['token']}.claim")
+        try:
+            os.close(os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return None
+        attempts = previous.get("attempts", 0) + 1
+        self._write(lease_path, new_lease(attempts))
+        return attempts
+
+    def lease(
+        self, queue: str, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> Optional[Task]:
+        for task_path in sorted(self._dir(queue).glob("*.task")):
+            if task_path.with_suffix(".done").exists() or task_path.with_suffix(".failed").exists():
+                continue
+            attempts = self._try_lease(task_path, worker_id, lease_seconds)
+            if attempts is None:
+                continue
+            # completed or failed since the check above: its lease was removed after the done file
+            # was written, so a lease won here sees it
+            if task_path.with_suffix(".done").exists() or task_path.with_suffix(".failed").exists():
+                self._remove_lease(task_path)
+                continue
+            content = self._read(task_path)
+            return Task(queue, content["task_id"], content["payload"], attempts, worker_id)
+        return None
+
+    def _paths(self, task: Task) -> pathlib.Path:
+        return self._dir(task.queue) / f"{self._file_name(task.task_id)}.task"
+
+    def heartbeat(self, task: Task, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        lease_path = self._paths(task).with_suffix(".lease")
+        lease = self._read(lease_path)
+        if not lease or lease.get("worker_id") != task.worker_id:
+            return False
+        lease["expires"] = time.time() + lease_seconds
+        self._write(lease_path, lease)
+        return True
+
+    def complete(self, task: Task, result: Optional[Dict[str, Any]] = None) -> None:
+        done_path = self._paths(task).with_suffix(".done")
+        if not done_path.exists():
+            self._write(done_path, {"worker_id": task.worker_id, "result": result or {}})
+        self._remove_lease(self._paths(task))
+
+    def release(self, task: Task, error: str) -> None:
+        task_path = self._paths(task)
+        lease_path = task_path.with_suffix(".lease")
+        lease = self._read(lease_path)
+        if not lease or lease.get("worker_id") != task.worker_id:
+            return
+        if task.attempts >= MAX_ATTEMPTS:
+            self._write(task_path.with_suffix(".failed"), {"worker_id": task.worker_id, "error": error})
+        # an expired lease can be taken over right away, the attempt count is kept
+        self._write(lease_path, dict(lease, worker_id=None, expires=0, error=error, token=uuid.uuid4().hex))
+
+    def states(self, queue: str, task_ids: Iterable[str]) -> Dict[str, str]:
+        queue_dir = self._dir(queue)
+        states = {}
+        for task_id in task_ids:
+            task_path = queue_dir / f"{self._file_name(task_id)}.task"
+            if task_path.with_suffix(".done").exists():
+                states[task_id] = "done"
+            elif task_path.with_suffix(".failed").exists():
+                states[task_id] = "failed"
+            elif (self._read(task_path.with_suffix(".lease")) or {}).get("expires", 0) >= time.time():
+                states[task_id] = "leased"
+            elif task_path.exists():
+                states[task_id] = "pending"
+        return states
+
+    def results(self, queue: str, task_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        queue_dir = self._dir(queue)
+        results = {}
+        for task_id in task_ids:
+            done = self._read(queue_dir / f"{self._file_name(task_id)}.done")
+            if done is not None:
+                results[task_id] = done["result"]
+        return results
+
+    def purge(self, queue: str, task_ids: Iterable[str]) -> int:
+        queue_dir = self._dir(queue)
+        purged = 0
+        for task_id in task_ids:
+            task_path = queue_dir / f"{self._file_name(task_id)}.task"
+            if not task_path.with_suffix(".done").exists():
+                continue
+            # the done file goes last, a task is never seen without it while it still exists
+            task_path.unlink(missing_ok=True)
+            self._remove_lease(task_path)
+            task_path.with_suffix(".done").unlink(missing_ok=True)
+            purged += 1
+        return purged
+
+
+def open_work_queue(url: str) -> WorkQueue:
+    """Opens a work queue from `sqlite:///path/queue.db` or `file:///path/queue_dir`."""
+    if url.startswith("sqlite://"):
+        return SQLiteWorkQueue(url.removeprefix("sqlite://"))
+    if url.startswith("file://"):
+        return DirectoryWorkQueue(url.removeprefix("file://"))
+    raise ValueError(f"Unsupported work queue url {url}, use sqlite:///<file> or file:///<dir>")
+
+
+def process_task(
+    work_queue: WorkQueue,
+    task: Task,
+    handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+) -> bool:
+    """
+    Runs the handler of a leased task while a background thread keeps the lease alive.
+
+    Returns:
+        bool: True if the task completed, False if the handler failed and the task was released.
+    """
+    stop = threading.Event()
+
+    def keep_alive() -> None:
+        while not stop.wait(lease_seconds / 3):
+            if not work_queue.heartbeat(task, lease_seconds):
+                print(f"  ⚠ lost lease of {task.task_id}, another worker took it over")
+                return
+
+    heartbeat = threading.Thread(target=keep_alive, daemon=True, name="work_queue_heartbeat")
+    heartbeat.start()
+    try:
+        result = handler(task.payload)
+    except Exception as e:
+        print(f"  ❌ {task.task_id} failed (attempt {task.attempts}): {e}")
+        work_queue.release(task, repr(e))
+        return False
+    finally:
+        stop.set()
+        heartbeat.join()
+    work_queue.complete(task, result)
+    return True
+
+
+def run_worker(
+    work_queue: WorkQueue,
+    queues: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]],
+    worker_id: Optional[str] = None,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    idle_timeout: float = 60,
+    poll_interval: float = 2,
+) -> int:
+    """
+    Processes tasks of the given queues until none was available for `idle_timeout` seconds.
+
+    Args:
+        work_queue (WorkQueue): The queue backend.
+        queues (Dict[str, Callable]): Handler per queue name.
+        worker_id (Optional[str]): Defaults to hostname and pid.
+        lease_seconds (float): Lease duration, heartbeats are sent every third of it.
+        idle_timeout (float): Seconds without work after which the worker stops. 0 stops on the first empty poll.
+        poll_interval (float): Seconds between polls of an empty queue.
+
+    Returns:
+        int: Number of completed tasks.
+    """
+    worker_id = worker_id or default_worker_id()
+    completed = 0
+    idle_since = time.monotonic()
+    while True:
+        leased = False
+        for queue, handler in queues.items():
+            task = work_queue.lease(queue, worker_id, lease_seconds)
+            if task is None:
+                continue
+            leased = True
+            completed += process_task(work_queue, task, handler, lease_seconds)
+        if leased:
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since >= idle_timeout:
+            return completed
+        else:
+            time.sleep(poll_interval)
+
+
+def run_until_done(
+    work_queue: WorkQueue,
+    queue: str,
+    tasks: Dict[str, Dict[str, Any]],
+    handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    poll_interval: float = 2,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Enqueues `tasks` and works on the queue until all of them are done, then returns their results.
+
+    The caller works along with any other workers, so the tasks also finish without them. The
+    tasks are purged from the queue once their results are read; tasks that failed before are
+    retried.
+
+    Raises:
+        RuntimeError: If a task failed MAX_ATTEMPTS times in this run.
+    """
+    work_queue.enqueue(queue, tasks)
+    worker_id = default_worker_id()
+    while True:
+        states = work_queue.states(queue, tasks)
+        failed = [task_id for task_id, state in states.items() if state == "failed"]
+        if failed:
+            raise RuntimeError(f"{len(failed)} task(s) of {queue} failed {MAX_ATTEMPTS} times: {failed[:3]}")
+        if all(states.get(task_id) == "done" for task_id in tasks):
+            results = work_queue.results(queue, tasks)
+            if len(results) == len(tasks):
+                work_queue.purge(queue, tasks)
+                return results
+            states = work_queue.states(queue, tasks)
+        missing = {task_id: payload for task_id, payload in tasks.items() if task_id not in states}
+        if missing:
+            # purged by another coordinator of the same tasks before this one read the results
+            work_queue.enqueue(queue, missing)
+        task = work_queue.lease(queue, worker_id, lease_seconds)
+        if task is not None:
+            process_task(work_queue, task, handler, lease_seconds)
+        else:
+            # the remaining tasks are leased by other workers
+            time.sleep(poll_interval)
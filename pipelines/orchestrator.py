@@ -0,0 +1,226 @@
+"""
+Concurrent ETL orchestrator for the AWS, GCP and Stripe pipelines.
+
+Replaces the serial `make run-etl` chain: every source runs in its own worker process,
+the normalization of a source starts as soon as its load finished, every stage has a
+timeout and a timing table is printed at the end. Load and normalize workers are forked
+from this interpreter, so dlt and the pipeline modules are imported once instead of once
+per source and stage (with the spawn start method each worker imports them again).
+
+Every source loads with its own dlt pipeline (see `helpers.pipeline_state`), so the sources
+run concurrently. Sources configured to share a pipeline name, or a local DuckDB file that
+allows a single writer only, are run one after another in the same lane.
+
+Usage:
+    python main.py etl
+    python main.py etl --sources aws stripe --timeout 1800
+"""
+
+import importlib
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import dlt
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.pipeline_state import get_shared_pipeline_name, get_source_pipeline_name  # noqa: E402
+from helpers.tracing import span, traceparent  # noqa: E402
+VIZ_RILL_DIR = PIPELINES_DIR.parent / "viz_rill"
+
+# module and function that load each source, and whether its normalizer (`viz.normalize`) runs after the load
+SOURCES: Dict[str, Dict[str, Any]] = {
+    "aws": {
+        "module": "aws_pipeline",
+        "function": "load_aws_costs",
+        "normalize": True,
+    },
+    "gcp": {
+        "module": "google_bq_incremental_pipeline",
+        "function": "load_standalone_table_resource",
+        "normalize": True,
+    },
+    "stripe": {
+        "module": "stripe_pipeline",
+        "function": "load_incremental_endpoints",
+        "normalize": False,
+    },
+}
+
+DEFAULT_TIMEOUT_SECONDS = 3600
+POLL_INTERVAL_SECONDS = 0.2
+
+
+def _run_source(name: str, parent_trace: Optional[str] = None) -> None:
+    """Worker process entry point: import the pipeline module of a source and run its load."""
+    if parent_trace:
+        # spawned workers do not inherit the span of the orchestrator
+        os.environ["TRACEPARENT"] = parent_trace
+    spec = SOURCES[name]
+    with span(f"{name}.load", source=name):
+        module = importlib.import_module(spec["module"])
+        getattr(module, spec["function"])()
+
+
+def _run_normalize(name: str, parent_trace: Optional[str] = None) -> None:
+    """Worker process entry point: run the normalizer of a source (it changes into viz_rill)."""
+    if parent_trace:
+        os.environ["TRACEPARENT"] = parent_trace
+    from viz import normalize
+
+    normalize(name)
+
+
+def get_lane_key(source: str) -> str:
+    """Returns what a source must not share with a concurrently running one."""
+    if os.getenv("DLT_DESTINATION", "filesystem") == "duckdb":
+        # all pipelines write to the same local DuckDB file, which allows a single writer
+        return f"{get_shared_pipeline_name()}.duckdb"
+    return get_source_pipeline_name(source)
+
+
+def get_timeout(source: str, default: Optional[float] = None) -> float:
+    """Per-source timeout from `[orchestrator.timeouts]`, falling back to `[orchestrator] timeout_seconds`."""
+    try:
+        return float(dlt.config[f"orchestrator.timeouts.{source}"])
+    except KeyError:
+        pass
+    if default is not None:
+        return default
+    try:
+        return float(dlt.config["orchestrator.timeout_seconds"])
+    except KeyError:
+        return DEFAULT_TIMEOUT_SECONDS
+
+
+def plan_lanes(sources: Sequence[str]) -> List[List[str]]:
+    """Groups sources by pipeline name, each group runs sequentially, groups run concurrently."""
+    lanes: Dict[str, List[str]] = {}
+    for source in sources:
+        lanes.setdefault(get_lane_key(source), []).append(source)
+    for lane_key, lane in lanes.items():
+        if len(lane) > 1:
+            print(f"ℹ️  {', '.join(lane)} share '{lane_key}', running them one after another")
+    return list(lanes.values())
+
+
+class _Stage:
+    """A running load or normalize process with its deadline."""
+
+    def __init__(
+        self, source: str, stage: str, handle: Any, timeout: float, lane: Optional[List[str]] = None
+    ) -> None:
+        self.source = source
+        self.stage = stage
+        self.handle = handle
+        self.lane = lane or []
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+
+    def exitcode(self) -> Optional[int]:
+        return self.handle.exitcode
+
+    def terminate(self) -> None:
+        self.handle.terminate()
+        self.handle.join()
+
+
+def _mp_context() -> Any:
+    # fork shares the already imported modules with the workers, spawn is the portable fallback
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+@span("etl")
+def run_etl(
+    sources: Sequence[str] = tuple(SOURCES),
+    normalize: Optional[bool] = None,
+    timeout: Optional[float] = None,
+) -> bool:
+    """
+    Runs the given sources concurrently and normalizes each one right after its load.
+
+    Args:
+        sources (Sequence[str]): Sources to run, any of "aws", "gcp", "stripe".
+        normalize (Optional[bool]): Run the normalizers after the loads. Defaults to None which
+            normalizes only for the local filesystem destination.
+        timeout (Optional[float]): Timeout in seconds for every stage, overrides the config.
+
+    Returns:
+        bool: True if all stages succeeded.
+    """
+    if normalize is None:
+        normalize = os.getenv("DLT_DESTINATION", "filesystem") == "filesystem"
+
+    ctx = _mp_context()
+    lanes = plan_lanes(sources)
+    running: List[_Stage] = []
+    results: List[Dict[str, Any]] = []
+    started = time.monotonic()
+
+    def start_load(lane: List[str]) -> None:
+        source = lane.pop(0)
+        process = ctx.Process(target=_run_source, args=(source, traceparent()), name=f"etl-{source}")
+        process.start()
+        running.append(_Stage(source, "load", process, get_timeout(source, timeout), lane))
+
+    def start_normalize(source: str) -> None:
+        if not normalize or not SOURCES[source]["normalize"]:
+            return
+        process = ctx.Process(target=_run_normalize, args=(source, traceparent()), name=f"normalize-{source}")
+        process.start()
+        running.append(_Stage(source, "normalize", process, get_timeout(source, timeout)))
+
+    for lane in lanes:
+        start_load(lane)
+
+    while running:
+        time.sleep(POLL_INTERVAL_SECONDS)
+        for stage in list(running):
+            exitcode = stage.exitcode()
+            timed_out = exitcode is None and time.monotonic() > stage.deadline
+            if exitcode is None and not timed_out:
+                continue
+
+            if timed_out:
+                stage.terminate()
+                status = "timeout"
+            else:
+                status = "ok" if exitcode == 0 else f"failed ({exitcode})"
+            running.remove(stage)
+            results.append(
+                dict(
+                    source=stage.source,
+                    stage=stage.stage,
+                    status=status,
+                    seconds=time.monotonic() - stage.started,
+                )
+            )
+
+            if stage.stage == "load":
+                if status == "ok":
+                    start_normalize(stage.source)
+                if stage.lane:
+                    start_load(stage.lane)
+
+    print_timings(results, time.monotonic() - started)
+    return all(r["status"] == "ok" for r in results)
+
+
+def print_timings(results: List[Dict[str, Any]], wall_seconds: float) -> None:
+    """Prints the per-stage timing table."""
+    print("\n" + "=" * 60)
+    print(f"{'source':<10} {'stage':<12} {'status':<14} {'seconds':>10}")
+    print("-" * 60)
+    for r in sorted(results, key=lambda r: (r["source"], r["stage"] != "load")):
+        print(f"{r['source']:<10} {r['stage']:<12} {r['status']:<14} {r['seconds']:>10.1f}")
+    print("-" * 60)
+    print(f"{'total wall time':<38} {wall_seconds:>10.1f}")
+    print("=" * 60)
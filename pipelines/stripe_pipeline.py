@@ -1,30 +1,48 @@
 from typing import Optional, Tuple
 import os
+import pathlib
 
 import dlt
 from pendulum import DateTime
+from helpers.pipeline_metrics import record_metrics
+from helpers.pipeline_state import source_lock, source_pipeline
 from helpers.stripe_analytics import (
+    event_stripe_source,
     incremental_stripe_source,
     stripe_source,
 )
+from helpers.stripe_analytics.merge import merge_filesystem_objects
 from helpers.stripe_analytics.settings import (
     ENDPOINTS,
     INCREMENTAL_ENDPOINTS,
 )
 
 
+def use_arrow() -> bool:
+    """Arrow extraction of the endpoints with a declared schema, `[sources.stripe] arrow` (default true)."""
+    try:
+        return bool(dlt.config["sources.stripe.arrow"])
+    except KeyError:
+        return True
+
+
+@source_lock("stripe")
 def load_data(
     endpoints: Tuple[str, ...] = ("Product", "Price"), #use `ENDPOINTS + INCREMENTAL_ENDPOINTS,` for all data
     start_date: Optional[DateTime] = None,
     end_date: Optional[DateTime] = None,
 ) -> None:
     """
-    Load Stripe reference data (non-incremental, replace mode).
+    Load Stripe reference data (replace mode, or merged from events).
 
     IMPORTANT: Only loads Product and Price to avoid PII. These endpoints contain:
     - Product catalog information (names, descriptions, features)
     - Pricing information (amounts, currencies, billing intervals)
 
+    With `[sources.stripe] event_updates = true` only the objects changed since the previous run
+    are retrieved, found in the Event stream, and merged on their id (see `event_stripe_source`).
+    `end_date` does not apply then.
+
     Args:
         endpoints: A tuple of endpoint names to retrieve data from.
                    Defaults to Product and Price (no PII).
@@ -35,35 +53,44 @@ def load_data(
     destination = os.getenv("DLT_DESTINATION", "filesystem")
 
     # Load configuration from config.toml
-    try:
-        pipeline_name = dlt.config["pipeline.pipeline_name"]
-    except KeyError:
-        pipeline_name = "cloud_cost_analytics"
-
     try:
         dataset_name = dlt.config["sources.stripe.dataset_name"]
     except KeyError:
         dataset_name = "stripe_costs"
 
-    # Create pipeline with environment-driven destination
-    pipeline = dlt.pipeline(
-        pipeline_name=pipeline_name,
-        destination=destination,
-        dataset_name=dataset_name,
-        # export_schema_path="exported_schema/stripe_cost_schema.json",
-    )
-    source = stripe_source(
-        endpoints=endpoints, start_date=start_date, end_date=end_date
-    )
+    # Create pipeline with environment-driven destination and its own state
+    pipeline = source_pipeline("stripe", destination, dataset_name, resource_names=endpoints)
+    try:
+        event_updates = dlt.config["sources.stripe.event_updates"]
+    except KeyError:
+        event_updates = False
+    if event_updates:
+        source = event_stripe_source(endpoints=endpoints, start_date=start_date)
+    else:
+        source = stripe_source(
+            endpoints=endpoints, start_date=start_date, end_date=end_date, use_arrow=use_arrow()
+        )
     # Use loader_file_format="parquet" in run() to generate parquet files
     load_info = pipeline.run(source, loader_file_format="parquet")
 
+    if event_updates and destination == "filesystem":
+        # The filesystem destination appends plain parquet instead of merging,
+        # so merge the changed objects ourselves
+        output_dir = dlt.config["destination.filesystem.bucket_url"].removeprefix("file://")
+        for endpoint in endpoints:
+            table_name = pipeline.default_schema.naming.normalize_table_identifier(endpoint)
+            objects = merge_filesystem_objects(pathlib.Path(output_dir) / dataset_name, table_name)
+            if objects:
+                print(f"Merged {table_name}: {objects} objects")
+    record_metrics(pipeline, "stripe")
+
     # Print concise summary
     print(f"\nPipeline {pipeline.pipeline_name} completed successfully")
     print(f"Loaded to: {pipeline.destination}")
     print(f"Dataset: {pipeline.dataset_name}")
 
 
+@source_lock("stripe")
 def load_incremental_endpoints(
     endpoints: Tuple[str, ...] = ("BalanceTransaction",), # use `INCREMENTAL_ENDPOINTS,` to load all data
 
@@ -95,11 +122,6 @@ def load_incremental_endpoints(
     from pendulum import datetime
 
     # Load configuration from config.toml
-    try:
-        pipeline_name = dlt.config["pipeline.pipeline_name"]
-    except KeyError:
-        pipeline_name = "cloud_cost_analytics"
-
     try:
         dataset_name = dlt.config["sources.stripe.dataset_name"]
     except KeyError:
@@ -118,21 +140,18 @@ def load_incremental_endpoints(
         except KeyError:
             pass  # Keep as None if not in config
 
-    # Create pipeline with environment-driven destination
-    pipeline = dlt.pipeline(
-        pipeline_name=pipeline_name,
-        destination=destination,
-        dataset_name=dataset_name,
-        # export_schema_path="exported_schema/stripe_cost_schema.json",
-    )
+    # Create pipeline with environment-driven destination and its own state
+    pipeline = source_pipeline("stripe", destination, dataset_name, resource_names=endpoints)
     # load all data on the first run that created before end_date
     source = incremental_stripe_source(
         endpoints=endpoints,
         initial_start_date=initial_start_date,
         end_date=end_date,
+        use_arrow=use_arrow(),
     )
     # Use loader_file_format="parquet" in run() to generate parquet files
     load_info = pipeline.run(source, loader_file_format="parquet")
+    record_metrics(pipeline, "stripe")
 
     # Print concise summary
     print(f"\nPipeline {pipeline.pipeline_name} completed successfully")
@@ -0,0 +1,371 @@
+"""
+Stripe webhook receiver with micro-batched loads.
+
+Polling `BalanceTransaction.list` every hour keeps the revenue dashboards an hour behind. The
+receiver takes the events Stripe pushes, verifies their signature and appends them to a local
+append-only log before answering, so an accepted event survives a crash. A flusher thread loads
+the logged events into the `webhook_event` table of the Stripe dataset every `flush_seconds` or
+as soon as `flush_events` are pending, and records the flushed log offset afterwards; on restart
+the events after the offset are loaded again. When more than `max_pending_events` are waiting,
+for example while the destination is down, new deliveries are refused with 503 and Stripe
+retries them later.
+
+Events that move money (charges, refunds, payouts, ...) also start the incremental
+BalanceTransaction load after the flush, so `balance_transaction` follows within seconds.
+
+Usage:
+    python main.py webhook
+    python main.py webhook --port 8787
+    stripe listen --forward-to localhost:8787/stripe/webhook
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import pathlib
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import dlt
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.pipeline_state import SourceLockedError, get_source_pipeline_name  # noqa: E402
+from helpers.tracing import span  # noqa: E402
+
+WEBHOOK_TABLE = "webhook_event"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8787
+DEFAULT_PATH = "/stripe/webhook"
+DEFAULT_LOG_FILE = ".dlt/stripe_webhook_events.jsonl"
+DEFAULT_FLUSH_SECONDS = 10
+DEFAULT_FLUSH_EVENTS = 500
+DEFAULT_MAX_PENDING_EVENTS = 10_000
+# maximum age of a signed delivery, as in the Stripe libraries
+SIGNATURE_TOLERANCE_SECONDS = 300
+# ids of the last loaded events, redeliveries of them are dropped
+RECENT_EVENT_IDS = 10_000
+# event types after which the BalanceTransaction load is started
+BALANCE_EVENT_PREFIXES = ("balance.", "charge.", "payout.", "refund.", "transfer.", "application_fee.", "topup.")
+
+
+def _config(key: str, default: Any) -> Any:
+    try:
+        return dlt.config[f"stripe_webhook.{key}"]
+    except KeyError:
+        return default
+
+
+def get_signing_secret() -> str:
+    """Endpoint secret (`whsec_...`) from `[stripe_webhook] signing_secret` in secrets.toml or `STRIPE_WEBHOOK_SECRET`."""
+    try:
+        return dlt.secrets["stripe_webhook.signing_secret"]
+    except KeyError:
+        secret = os.getenv("STRIPE_WEBHOOK_SECRET")
+        if not secret:
+            raise RuntimeError(
+                "Stripe webhook signing secret not configured, add [stripe_webhook] signing_secret"
+                " to .dlt/secrets.toml or set STRIPE_WEBHOOK_SECRET"
+            ) from None
+        return secret
+
+
+def sign_payload(payload: bytes, secret: str, timestamp: Optional[int] = None) -> str:
+    """Builds the `Stripe-Signature` header of a payload, used to post signed test events."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def verify_signature(
+    payload: bytes, header: str, secret: str, tolerance: int = SIGNATURE_TOLERANCE_SECONDS
+) -> bool:
+    """Checks the `Stripe-Signature` header (any of its v1 signatures) and the age of the delivery."""
+    timestamp = None
+    signatures = []
+    for item in (header or "").split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t" and value.isdigit():
+            timestamp = int(value)
+        elif key == "v1":
+            signatures.append(value)
+    if timestamp is None or not signatures or abs(time.time() - timestamp) > tolerance:
+        return False
+    expected = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return any(hmac.compare_digest(expected, signature) for signature in signatures)
+
+
+class EventLog:
+    """
+    Append-only JSON lines log of the accepted events and the offset up to which they are loaded.
+
+    The log is truncated once every logged event is loaded. Appends, commits and truncation are
+    serialized by a lock, the loads run without it.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.offset_path = path.with_name(f"{path.name}.offset")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        path.touch()
+        self.offset = int(self.offset_path.read_text()) if self.offset_path.exists() else 0
+        size = path.stat().st_size
+        if self.offset > size:
+            # a crash between emptying the log and recording offset 0
+            self.offset = 0
+        lines, end = self._read_lines(self.offset)
+        if end < size:
+            # a line cut off by a crash during `append` was never acknowledged, the next event
+            # would be appended to it
+            print(f"⚠️  {path}: dropping {size - end} byte(s) of an incomplete last event")
+            os.truncate(path, end)
+        self.file = open(path, "ab")
+        self.pending = len(lines)
+
+    def _read_lines(self, offset: int) -> Tuple[List[bytes], int]:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # a line cut off by a crash is ignored, it was never acknowledged (and is truncated on open)
+        end = data.rfind(b"\n") + 1
+        return [line for line in data[:end].splitlines() if line.strip()], offset + end
+
+    def append(self, payload: bytes) -> int:
+        """Appends and syncs one event, returns the number of pending events."""
+        with self.lock:
+            self.file.write(payload.replace(b"\n", b" ") + b"\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending += 1
+            return self.pending
+
+    def read_pending(self) -> Tuple[List[bytes], int]:
+        """Events after the committed offset and the log offset after them."""
+        with self.lock:
+            return self._read_lines(self.offset)
+
+    def commit(self, end: int, count: int) -> None:
+        """Marks the events up to `end` as loaded, the log is emptied when nothing is pending."""
+        with self.lock:
+            self.pending -= count
+            if end >= self.path.stat().st_size:
+                self.file.truncate(0)
+                end = 0
+            tmp = self.offset_path.with_name(f"{self.offset_path.name}.tmp")
+            tmp.write_text(str(end))
+            os.replace(tmp, self.offset_path)
+            self.offset = end
+
+
+def event_row(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Row of the `webhook_event` table, the event object is kept as JSON so event types do not widen the table."""
+    obj = event.get("data", {}).get("object", {})
+    return dict(
+        id=event["id"],
+        type=event.get("type"),
+        created=event.get("created"),
+        livemode=event.get("livemode"),
+        api_version=event.get("api_version"),
+        account=event.get("account"),
+        object_id=obj.get("id"),
+        object_type=obj.get("object"),
+        data=event.get("data"),
+        received_at=int(time.time()),
+    )
+
+
+class WebhookFlusher:
+    """Loads the logged events in micro-batches and starts the BalanceTransaction load after money events."""
+
+    def __init__(self, log: EventLog, flush_seconds: float, flush_events: int) -> None:
+        self.log = log
+        self.flush_seconds = flush_seconds
+        self.flush_events = flush_events
+        self.wakeup = threading.Event()
+        self.recent_ids: Dict[str, None] = {}
+        self.trigger_balance_load = _config("trigger_balance_load", True)
+        self.destination = os.getenv("DLT_DESTINATION", "filesystem")
+        try:
+            dataset_name = dlt.config["sources.stripe.dataset_name"]
+        except KeyError:
+            dataset_name = "stripe_costs"
+        # its own pipeline and state, the flushes do not wait for the lock of the Stripe loads
+        self.pipeline = dlt.pipeline(
+            pipeline_name=f"{get_source_pipeline_name('stripe')}_webhook",
+            destination=self.destination,
+            dataset_name=dataset_name,
+        )
+
+    def notify(self, pending: int) -> None:
+        if pending >= self.flush_events:
+            self.wakeup.set()
+
+    def flush(self) -> int:
+        """Loads the pending events, returns how many were logged."""
+        lines, end = self.log.read_pending()
+        if not lines:
+            return 0
+        rows = []
+        batch_ids: Set[str] = set()
+        for line in lines:
+            try:
+                event = json.loads(line)
+                event_id = event["id"]
+            except (ValueError, TypeError, KeyError):
+                # committed with the batch, one bad line must not block the log
+                print(f"⚠️  skipped a logged line that is not a Stripe event: {line[:200]!r}")
+                continue
+            if event_id in self.recent_ids or event_id in batch_ids:
+                continue
+            batch_ids.add(event_id)
+            rows.append(event_row(event))
+
+        with span("stripe_webhook.flush", events=len(lines), rows=len(rows)):
+            if rows:
+                kwargs = {"loader_file_format": "parquet"} if self.destination == "filesystem" else {}
+                self.pipeline.run(
+                    rows,
+                    table_name=WEBHOOK_TABLE,
+                    write_disposition="append",
+                    primary_key="id",
+                    columns={"data": {"data_type": "json"}, "account": {"data_type": "text"}},
+                    **kwargs,
+                )
+        self.log.commit(end, len(lines))
+        for event_id in batch_ids:
+            self.recent_ids[event_id] = None
+        for event_id in list(self.recent_ids)[: max(0, len(self.recent_ids) - RECENT_EVENT_IDS)]:
+            del self.recent_ids[event_id]
+        print(f"📥 flushed {len(rows)} event(s) to {WEBHOOK_TABLE}" + (f", {len(lines) - len(rows)} redelivered" if len(rows) < len(lines) else ""))
+
+        if self.trigger_balance_load and any(row["type"] and row["type"].startswith(BALANCE_EVENT_PREFIXES) for row in rows):
+            self.load_balance_transactions()
+        return len(lines)
+
+    def load_balance_transactions(self) -> None:
+        from stripe_pipeline import load_incremental_endpoints
+
+        try:
+            load_incremental_endpoints()
+        except SourceLockedError as e:
+            # the daemon or another process is loading Stripe right now
+            print(f"⚠️  BalanceTransaction load skipped: {e}")
+
+    def run(self, stop: threading.Event) -> None:
+        """Flushes until `stop` is set, a failed flush keeps the events and is retried after `flush_seconds`."""
+        while True:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ webhook flush failed, {self.log.pending} event(s) kept for the next flush: {e}")
+            if stop.is_set():
+                return
+
+
+def make_handler(
+    log: EventLog, flusher: WebhookFlusher, secret: str, path: str, max_pending: int
+) -> type:
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+            body = json.dumps({"message": message}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:
+            if self.path.split("?")[0] != path:
+                self._reply(404, "not found")
+                return
+            payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not verify_signature(payload, self.headers.get("Stripe-Signature", ""), secret):
+                self._reply(400, "invalid signature")
+                return
+            try:
+                event = json.loads(payload)
+                event["id"]
+            except (ValueError, KeyError, TypeError):
+                self._reply(400, "not an event")
+                return
+            if log.pending >= max_pending:
+                # backpressure, Stripe redelivers with backoff
+                self._reply(503, "too many pending events", {"Retry-After": str(int(flusher.flush_seconds))})
+                return
+            flusher.notify(log.append(payload))
+            self._reply(200, "ok")
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return WebhookHandler
+
+
+def run_webhook(host: Optional[str] = None, port: Optional[int] = None) -> None:
+    """
+    Receives Stripe webhooks until SIGINT or SIGTERM, then flushes the pending events.
+
+    Config (`[stripe_webhook]` in .dlt/config.toml, the signing secret in .dlt/secrets.toml):
+        host, port, path: where to listen, defaults to 127.0.0.1:8787 /stripe/webhook
+        log_file: append-only log of the accepted events, defaults to .dlt/stripe_webhook_events.jsonl
+        flush_seconds, flush_events: load the pending events every 10 seconds or after 500 events
+        max_pending_events: refuse deliveries with 503 above this many pending events, defaults to 10000
+        trigger_balance_load: run the BalanceTransaction load after money events, defaults to true
+
+    Args:
+        host (Optional[str]): Interface to listen on, overrides the config.
+        port (Optional[int]): Port to listen on, overrides the config.
+    """
+    secret = get_signing_secret()
+    host = host or _config("host", DEFAULT_HOST)
+    port = port or int(_config("port", DEFAULT_PORT))
+    path = _config("path", DEFAULT_PATH)
+    log = EventLog(pathlib.Path(_config("log_file", DEFAULT_LOG_FILE)))
+    flusher = WebhookFlusher(
+        log,
+        flush_seconds=float(_config("flush_seconds", DEFAULT_FLUSH_SECONDS)),
+        flush_events=int(_config("flush_events", DEFAULT_FLUSH_EVENTS)),
+    )
+    if log.pending:
+        print(f"🔁 replaying {log.pending} event(s) logged before the last stop")
+
+    server = ThreadingHTTPServer(
+        (host, port),
+        make_handler(log, flusher, secret, path, int(_config("max_pending_events", DEFAULT_MAX_PENDING_EVENTS))),
+    )
+    stop = threading.Event()
+
+    def request_stop(signum: int, _frame: Any) -> None:
+        print(f"\nReceived signal {signum}, flushing pending events...")
+        stop.set()
+        flusher.wakeup.set()
+        # shutdown() waits for serve_forever(), which runs in the main thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    flusher_thread = threading.Thread(target=flusher.run, args=(stop,), name="webhook_flusher")
+    flusher_thread.start()
+    flusher.wakeup.set()
+    print(f"👂 listening for Stripe webhooks on http://{host}:{port}{path}")
+    server.serve_forever()
+    server.server_close()
+    flusher_thread.join()
+    print("Webhook receiver stopped")
+
+
+if __name__ == "__main__":
+    run_webhook()
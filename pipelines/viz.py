@@ -0,0 +1,157 @@
+"""
+Normalization and Rill dashboard generation, callable in-process.
+
+The normalizers and dashboard generators live in `viz_rill/cur-wizard/scripts` and read
+their paths relative to `viz_rill` (see `viz_rill/.env`), so both run with `viz_rill` as
+working directory. dlt reads its config from the `.dlt` of the working directory of its
+first lookup, so the normalizer settings of the project config are read here, before
+changing into `viz_rill`, and passed in. The scripts are imported on first use only, duckdb
+and jinja2 are not loaded by commands that do not need them.
+
+Usage:
+    python main.py normalize aws gcp
+    python main.py generate-dashboards aws
+"""
+
+import importlib
+import os
+import pathlib
+import sys
+from typing import Any, Dict, Optional
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+# the same module instance as the cur-wizard scripts, their spans nest under the ones below
+from helpers.tracing import span  # noqa: E402
+
+PROJECT_DIR = PIPELINES_DIR.parent
+VIZ_RILL_DIR = PROJECT_DIR / "viz_rill"
+CUR_WIZARD_SCRIPTS_DIR = VIZ_RILL_DIR / "cur-wizard" / "scripts"
+
+# module and function of the normalizer of each source
+NORMALIZERS = {
+    "aws": ("normalize", "normalize_aws"),
+    "gcp": ("normalize_gcp", "normalize_gcp"),
+}
+
+# normalizer argument → project config key, unset keys fall back to the environment of viz_rill
+NORMALIZER_CONFIG = {
+    "aws": {
+        "normalized_data_dir": "sources.aws_cur.normalized_data_dir",
+        "input_data_dir": "sources.aws_cur.input_data_dir",
+        "accounts": "sources.aws_cur.accounts",
+        "work_queue": "sources.aws_cur.work_queue",
+        "max_tag_columns": "sources.aws_cur.max_tag_columns",
+        "tag_allowlist": "sources.aws_cur.tag_allowlist",
+    },
+    "gcp": {
+        "normalized_data_dir": "sources.gcp_billing.normalized_data_dir",
+        "input_data_dir": "sources.gcp_billing.input_data_dir",
+    },
+}
+# arguments that are paths relative to the project root
+PATH_ARGUMENTS = ("normalized_data_dir", "input_data_dir")
+
+# generator module, function and arguments of the dashboards of each source (paths relative to viz_rill)
+DASHBOARDS: Dict[str, Dict[str, Any]] = {
+    "aws": {
+        "module": "rill_project_generator",
+        "function": "generate_rill_project",
+        "parquet": "data/normalized_aws.parquet",
+        "cost_col": "line_item_unblended_cost",
+        "dim_prefixes": ["product_", "line_item_"],
+        "timeseries_col": "date",
+    },
+    "gcp": {
+        "module": "rill_project_generator_gcp",
+        "function": "generate_gcp_rill_project",
+        "parquet": "data/normalized_gcp.parquet",
+        "cost_col": "cost",
+        "dim_prefixes": ["labels_", "service__", "project__"],
+        "timeseries_col": "date",
+    },
+}
+
+
+def _enter_viz_rill() -> None:
+    os.chdir(VIZ_RILL_DIR)
+    if str(CUR_WIZARD_SCRIPTS_DIR) not in sys.path:
+        sys.path.insert(0, str(CUR_WIZARD_SCRIPTS_DIR))
+
+
+def normalizer_settings(source: str) -> Dict[str, Any]:
+    """
+    Reads the normalizer settings of a source from the project config.
+
+    Relative paths, also the path of a `work_queue` url, are made absolute against the project
+    root, where the pipelines resolve them.
+
+    Args:
+        source (str): "aws" or "gcp".
+
+    Returns:
+        Dict[str, Any]: Keyword arguments of the normalizer, without the unset settings.
+    """
+    import dlt
+
+    settings: Dict[str, Any] = {}
+    for argument, key in NORMALIZER_CONFIG[source].items():
+        try:
+            value = dlt.config[key]
+        except KeyError:
+            continue
+        if argument in PATH_ARGUMENTS:
+            value = str(PROJECT_DIR / value)
+        elif argument == "work_queue":
+            scheme, path = value.split("://", 1)
+            value = f"{scheme}://{PROJECT_DIR / path}"
+        settings[argument] = value
+    return settings
+
+
+def normalize(source: str, profile_dir: Optional[str] = None) -> Optional[pathlib.Path]:
+    """
+    Runs the normalizer of a source in this process, with the settings of the project config.
+
+    Args:
+        source (str): "aws" or "gcp".
+        profile_dir (Optional[str]): Profile the DuckDB statements and write a ranked report to this directory.
+
+    Returns:
+        Optional[pathlib.Path]: The normalized parquet file, None if there was no loaded data.
+    """
+    settings = normalizer_settings(source)
+    _enter_viz_rill()
+    module_name, function = NORMALIZERS[source]
+    module = importlib.import_module(module_name)
+    with span(f"{source}.normalize", source=source) as normalize_span:
+        output_path = getattr(module, function)(profile_dir=profile_dir, **settings)
+        normalize_span.set_attribute("bytes", output_path.stat().st_size if output_path else 0)
+    return output_path
+
+
+def generate_dashboards(source: str, profile_dir: Optional[str] = None) -> None:
+    """
+    Generates the Rill dashboards of a source from its normalized parquet file.
+
+    Args:
+        source (str): "aws" or "gcp".
+        profile_dir (Optional[str]): Profile the DuckDB statements and write a ranked report to this directory.
+    """
+    _enter_viz_rill()
+    spec = DASHBOARDS[source]
+    parquet = VIZ_RILL_DIR / spec["parquet"]
+    if not parquet.exists():
+        sys.exit(f"❌ Parquet not found: {parquet}, run `python main.py normalize {source}` first")
+    module = importlib.import_module(spec["module"])
+    with span(f"{source}.generate_dashboards", source=source, bytes=parquet.stat().st_size):
+        getattr(module, spec["function"])(
+            parquet_path=parquet,
+            out_dir=VIZ_RILL_DIR,
+            cost_col=spec["cost_col"],
+            dim_prefixes=spec["dim_prefixes"],
+            timeseries_col=spec["timeseries_col"],
+            profile_dir=profile_dir,
+        )
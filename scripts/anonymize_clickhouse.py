@@ -10,10 +10,17 @@ Much simpler than anonymizing during ingestion!
 """
 
 import os
+import pathlib
 import sys
 import clickhouse_connect
 import dlt
 
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.tracing import span, traced_clickhouse  # noqa: E402
+
 def get_clickhouse_client():
 
 
@@ -34,7 +41,7 @@ def get_clickhouse_client():
             interface='https' 
         )
 
-        return client
+        return traced_clickhouse(client)
 
     except Exception as e:
         print(f"Error connecting to ClickHouse: {e}")
@@ -199,6 +206,7 @@ def spread_to_recent_dates(client, table, days_to_spread=30):
         print(f"  ⚠ Error updating dates: {e}")
 
 
+@span("anonymize_clickhouse")
 def main():
     """Run anonymization on ClickHouse data."""
     print("=" * 80)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Add the typed time columns to parquet files loaded before the pipelines extracted them.
+
+The AWS pipeline adds `usage_start`, `usage_end` and `date` parsed from `identity_time_interval`,
+the Stripe pipeline adds `created_at` and `date` derived from `created`. The Rill models filter on
+these columns, so files written by older runs are rewritten once with the same values computed
+in DuckDB. Files that already have the columns are left alone.
+
+Usage:
+    python scripts/backfill_time_columns.py                        # viz_rill/data
+    python scripts/backfill_time_columns.py viz_rill/data_demo     # bundled demo data
+    python scripts/backfill_time_columns.py --dry-run
+"""
+import argparse
+import os
+import pathlib
+import sys
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.aws_cur.settings import TIME_COLUMNS_SQL as AWS_TIME_COLUMNS_SQL  # noqa: E402
+from helpers.stripe_analytics.settings import TIME_COLUMNS_SQL as STRIPE_TIME_COLUMNS_SQL  # noqa: E402
+
+# source column of a table -> the time columns derived from it
+TIME_COLUMNS = {
+    "identity_time_interval": AWS_TIME_COLUMNS_SQL,
+    "created": STRIPE_TIME_COLUMNS_SQL,
+}
+
+
+def backfill_file(con: duckdb.DuckDBPyConnection, path: pathlib.Path, dry_run: bool = False) -> bool:
+    """Rewrites a parquet file with its missing time columns, returns True if it was (or would be) rewritten."""
+    columns = pq.read_schema(path).names
+    derived = next((sql for source, sql in TIME_COLUMNS.items() if source in columns), None)
+    if derived is None:
+        return False
+    missing = {name: sql for name, sql in derived.items() if name not in columns}
+    if not missing:
+        return False
+    if not dry_run:
+        # only the new columns come from DuckDB, the existing ones keep their Arrow types (timezones,
+        # units, null columns) as a round trip through DuckDB would change them
+        table = pq.read_table(path)
+        con.register("file", table)
+        select_sql = ", ".join(f'{sql} AS "{name}"' for name, sql in missing.items())
+        derived_columns = con.execute(f"SELECT {select_sql} FROM file").fetch_arrow_table()
+        con.unregister("file")
+        for name in missing:
+            column = derived_columns.column(name)
+            if pa.types.is_timestamp(column.type):
+                # the timezone the pipelines write, DuckDB returns its session timezone name
+                column = column.cast(pa.timestamp(column.type.unit, tz="UTC"))
+            table = table.append_column(name, column)
+        tmp = path.with_name(f"{path.name}.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir", nargs="?", type=pathlib.Path, default=pathlib.Path("viz_rill/data"))
+    parser.add_argument("--dry-run", action="store_true", help="List the files without rewriting them")
+    args = parser.parse_args(argv)
+
+    con = duckdb.connect(database=":memory:")
+    rewritten = 0
+    # root tables only, nested tables (`<table>__<column>`) have no time source column
+    for table_dir in sorted(p for p in args.data_dir.glob("*/*") if p.is_dir() and "__" not in p.name):
+        for path in sorted(table_dir.glob("*.parquet")):
+            if backfill_file(con, path, dry_run=args.dry_run):
+                rewritten += 1
+                print(f"  {'would rewrite' if args.dry_run else '✓ rewrote'} {path}")
+    con.close()
+    print(f"✅ {rewritten} file(s) {'to backfill' if args.dry_run else 'backfilled'} under {args.data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Check the daily rollup of hourly CUR rows on a page with a malformed interval.
+
+`rollup_daily` (`pipelines/helpers/aws_cur/rollup.py`) groups the rows by the day of their
+`identity_time_interval`. A row whose interval does not start with a date is kept at its own
+interval instead of failing the rollup of the whole page. The check rolls up a few hourly rows
+of one day together with rows with an empty and a malformed interval and fails if the rollup
+raises or the rows are not kept.
+
+Usage:
+    python scripts/check_daily_rollup.py
+"""
+import pathlib
+import sys
+
+import pyarrow as pa
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.aws_cur.rollup import rollup_daily  # noqa: E402
+
+HOURLY = pa.table(
+    {
+        "identity_line_item_id": ["a", "b", "c", "d", "e"],
+        "identity_time_interval": [
+            "2025-11-03T00:00:00Z/2025-11-03T01:00:00Z",
+            "2025-11-03T01:00:00Z/2025-11-03T02:00:00Z",
+            "2025-11-03T02:00:00Z/2025-11-03T03:00:00Z",
+            "",
+            "not-a-date/2025-11-03T04:00:00Z",
+        ],
+        "line_item_line_item_type": ["Usage"] * 5,
+        "line_item_unblended_cost": [1.0, 2.0, 3.0, 4.0, 5.0],
+    }
+)
+
+
+def check_daily_rollup() -> None:
+    """Rolls up the hourly rows and checks the cost per interval."""
+    try:
+        daily = pa.Table.from_batches(list(rollup_daily(HOURLY.to_batches())))
+    except Exception as e:
+        sys.exit(f"❌ Rollup failed on a malformed interval: {e}")
+    cost = dict(zip(daily["identity_time_interval"].to_pylist(), daily["line_item_unblended_cost"].to_pylist()))
+    expected = {
+        "2025-11-03T00:00:00Z/2025-11-04T00:00:00Z": 6.0,
+        "": 4.0,
+        "not-a-date/2025-11-03T04:00:00Z": 5.0,
+    }
+    if cost != expected:
+        sys.exit(f"❌ Unexpected daily rows: {cost}, expected {expected}")
+    print("✅ Rows with a malformed interval are kept at their own interval")
+
+
+if __name__ == "__main__":
+    check_daily_rollup()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Check that the normalizer gets the `[sources.aws_cur]` settings of the project config.
+
+The normalizers run with `viz_rill` as working directory, where dlt finds no `.dlt` of its own.
+The check writes a small CUR table and a `.dlt/config.toml` with hybrid tags enabled into a
+temporary project directory, starts from there like `main.py normalize aws` starts from the
+project root, and verifies that the output of the normalizer, run from `viz_rill`, holds the
+exploded columns and the residual MAP the settings ask for. Settings that get lost on the way
+into `viz_rill` fail the check.
+
+Usage:
+    python scripts/check_normalize_config.py
+"""
+import os
+import pathlib
+import sys
+import tempfile
+
+import duckdb
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from viz import VIZ_RILL_DIR, normalize  # noqa: E402
+
+# spend per tag key: "owner" is kept by the allowlist, "team" has the most spend, "env" stays in the MAP
+CONFIG_TOML = """
+[sources.aws_cur]
+input_data_dir = "{input_dir}"
+normalized_data_dir = "{normalized_dir}"
+max_tag_columns = 1
+tag_allowlist = ["owner"]
+"""
+
+CUR_SQL = """
+SELECT * FROM (VALUES
+  ('2025-11-03T00:00:00Z/2025-11-03T01:00:00Z', 10.0, MAP {'team': 'core'}),
+  ('2025-11-03T01:00:00Z/2025-11-03T02:00:00Z', 1.0, MAP {'owner': 'ana', 'env': 'dev'})
+) AS t(identity_time_interval, line_item_unblended_cost, resource_tags)
+"""
+
+
+def check_normalize_config() -> None:
+    """Runs the AWS normalizer from a project with hybrid tags and checks its output."""
+    with tempfile.TemporaryDirectory(prefix="check_normalize_") as project:
+        project_dir = pathlib.Path(project)
+        input_dir = project_dir / "aws_costs" / "cur"
+        normalized_dir = project_dir / "normalized"
+        input_dir.mkdir(parents=True)
+        (project_dir / ".dlt").mkdir()
+        (project_dir / ".dlt" / "config.toml").write_text(
+            CONFIG_TOML.format(input_dir=input_dir.as_posix(), normalized_dir=normalized_dir.as_posix())
+        )
+        duckdb.sql(f"COPY ({CUR_SQL}) TO '{(input_dir / 'part.parquet').as_posix()}' (FORMAT PARQUET)")
+
+        # settings given in the environment would reach viz_rill anyway and hide a lost config
+        for key in [k for k in os.environ if k.startswith("SOURCES__AWS_CUR__") or k == "DLT_PROJECT_DIR"]:
+            del os.environ[key]
+        os.chdir(project_dir)
+        output = normalize("aws").as_posix()
+        assert pathlib.Path.cwd() == VIZ_RILL_DIR, "the normalizer did not run from viz_rill"
+
+        columns = {row[0] for row in duckdb.sql(f"DESCRIBE SELECT * FROM read_parquet('{output}')").fetchall()}
+        tag_columns = sorted(c for c in columns if c.startswith("resource_tags_"))
+        residual = duckdb.sql(
+            f"SELECT list_sort(flatten(list(map_keys(resource_tags)))) FROM read_parquet('{output}')"
+        ).fetchone()[0]
+
+    if tag_columns != ["resource_tags_owner", "resource_tags_team"] or residual != ["env"]:
+        sys.exit(
+            f"❌ Normalizer ignored the project config: tag columns {tag_columns}, residual MAP keys {residual}"
+        )
+    print("✅ Normalizer used max_tag_columns and tag_allowlist of the project config")
+
+
+if __name__ == "__main__":
+    check_normalize_config()
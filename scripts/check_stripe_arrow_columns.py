@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Check that the Arrow extraction of Stripe loads the same columns as the dict extraction.
+
+`ARROW_SCHEMAS` declares the columns of the endpoints extracted as Arrow tables, a field the
+API returns but the schema leaves out would be loaded by the dict extraction and dropped by the
+Arrow one. The check loads the same recorded list response both ways into DuckDB, in a
+temporary directory and without calling the API, and fails if a table or column of one load is
+missing from the other.
+
+Usage:
+    python scripts/check_stripe_arrow_columns.py
+"""
+import pathlib
+import sys
+import tempfile
+from typing import Dict, Set
+
+import dlt
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.stripe_analytics import add_time_columns  # noqa: E402
+from helpers.stripe_analytics.arrow import arrow_pages, split_child_tables  # noqa: E402
+
+# `data` of a BalanceTransaction list response (API version 2022-11-15)
+BALANCE_TRANSACTIONS = [
+    {
+        "id": "txn_1QfJ0aAbCdEfGhIj0001",
+        "object": "balance_transaction",
+        "amount": 4999,
+        "available_on": 1736985600,
+        "balance_type": "payments",
+        "created": 1736380800,
+        "currency": "usd",
+        "description": "Subscription update",
+        "exchange_rate": None,
+        "fee": 175,
+        # a field that is null in every object is not loaded by the dict extraction, the second
+        # object has an `application`
+        "fee_details": [
+            {"amount": 175, "application": None, "currency": "usd", "description": "Stripe processing fees", "type": "stripe_fee"}
+        ],
+        "net": 4824,
+        "reporting_category": "charge",
+        "source": "ch_3QfJ0aAbCdEfGhIj0001",
+        "status": "available",
+        "type": "charge",
+    },
+    {
+        "id": "txn_1QfJ0aAbCdEfGhIj0002",
+        "object": "balance_transaction",
+        "amount": -1000,
+        "available_on": 1736467200,
+        "balance_type": "payments",
+        "created": 1736467200,
+        "currency": "eur",
+        "description": "REFUND FOR CHARGE",
+        "exchange_rate": 1.0312,
+        "fee": 30,
+        "fee_details": [
+            {"amount": 30, "application": "ca_QfJ0aAbCdEfGhIj", "currency": "eur", "description": "Application fee", "type": "application_fee"}
+        ],
+        "net": -1030,
+        "reporting_category": "refund",
+        "source": "re_3QfJ0aAbCdEfGhIj0002",
+        "status": "pending",
+        "type": "refund",
+    },
+]
+
+
+def loaded_columns(pipelines_dir: str, use_arrow: bool) -> Dict[str, Set[str]]:
+    """Loads the fixture like `stripe_source` does and returns the columns of every data table."""
+    endpoint = "BalanceTransaction"
+
+    def balance_transactions():
+        pages = [BALANCE_TRANSACTIONS]
+        if use_arrow:
+            for table in arrow_pages(endpoint, pages):
+                yield from split_child_tables(table, endpoint)
+        else:
+            yield from map(add_time_columns, pages)
+
+    pipeline = dlt.pipeline(
+        pipeline_name=f"check_stripe_{'arrow' if use_arrow else 'dict'}",
+        pipelines_dir=pipelines_dir,
+        destination=dlt.destinations.duckdb(str(pathlib.Path(pipelines_dir) / f"{use_arrow}.duckdb")),
+        dataset_name="stripe",
+    )
+    pipeline.run(dlt.resource(balance_transactions, name=endpoint, write_disposition="replace"))
+    return {
+        table["name"]: {column for column in table["columns"] if not column.startswith("_dlt_")}
+        for table in pipeline.default_schema.data_tables()
+    }
+
+
+def check_stripe_arrow_columns() -> None:
+    """Compares the tables and columns of the Arrow and dict loads of the same response."""
+    with tempfile.TemporaryDirectory(prefix="check_stripe_arrow_") as pipelines_dir:
+        arrow = loaded_columns(pipelines_dir, use_arrow=True)
+        dicts = loaded_columns(pipelines_dir, use_arrow=False)
+
+    differences = [
+        f"{table}: dict only {sorted(dicts.get(table, set()) - arrow.get(table, set()))}, "
+        f"arrow only {sorted(arrow.get(table, set()) - dicts.get(table, set()))}"
+        for table in sorted(set(arrow) | set(dicts))
+        if arrow.get(table) != dicts.get(table)
+    ]
+    if differences:
+        sys.exit("❌ Arrow and dict extraction load different columns:\n  " + "\n  ".join(differences))
+    print(f"✅ Arrow and dict extraction load the same columns for {sorted(arrow)}")
+
+
+if __name__ == "__main__":
+    check_stripe_arrow_columns()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Check that the Stripe webhook receiver recovers from a crash in the middle of an append.
+
+A crash while an event is written leaves a cut-off last line in the event log. The check writes
+a log with a logged event and such a line, opens it again like a restarted receiver, appends a
+new event and flushes into a DuckDB database in a temporary directory. It fails if the flush
+raises, does not load both events or does not empty the log.
+
+Usage:
+    python scripts/check_webhook_log.py
+"""
+import json
+import os
+import pathlib
+import sys
+import tempfile
+
+import duckdb
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+
+def event(event_id: str) -> bytes:
+    return json.dumps(
+        {
+            "id": event_id,
+            "object": "event",
+            "type": "customer.created",
+            "created": 1736380800,
+            "data": {"object": {"id": f"cus_{event_id}", "object": "customer"}},
+        }
+    ).encode()
+
+
+def check_webhook_log() -> None:
+    """Reopens a log with a cut-off last line, appends an event and flushes."""
+    with tempfile.TemporaryDirectory(prefix="check_webhook_log_") as work_dir:
+        os.chdir(work_dir)
+        os.environ.update(
+            DLT_DATA_DIR=work_dir, DLT_DESTINATION="duckdb", STRIPE_WEBHOOK__TRIGGER_BALANCE_LOAD="false"
+        )
+        from stripe_webhook import WEBHOOK_TABLE, EventLog, WebhookFlusher
+
+        log_path = pathlib.Path(work_dir) / "events.jsonl"
+        log_path.write_bytes(event("evt_logged") + b"\n" + event("evt_cut_off")[:40])
+
+        log = EventLog(log_path)
+        log.append(event("evt_after_restart"))
+        flusher = WebhookFlusher(log, flush_seconds=1, flush_events=1)
+        try:
+            flushed = flusher.flush()
+        except Exception as e:
+            sys.exit(f"❌ Flush failed after a cut-off event: {e!r}")
+
+        con = duckdb.connect(f"{flusher.pipeline.pipeline_name}.duckdb")
+        loaded = sorted(
+            row[0] for row in con.execute(f"SELECT id FROM {flusher.pipeline.dataset_name}.{WEBHOOK_TABLE}").fetchall()
+        )
+        con.close()
+        log_size = log_path.stat().st_size
+        log.file.close()
+
+    if flushed != 2 or loaded != ["evt_after_restart", "evt_logged"] or log_size != 0:
+        sys.exit(f"❌ Unexpected flush: {flushed} event(s) flushed, loaded {loaded}, {log_size} byte(s) left in the log")
+    print("✅ A cut-off event is dropped on restart and the events around it are loaded")
+
+
+if __name__ == "__main__":
+    check_webhook_log()
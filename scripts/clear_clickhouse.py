@@ -18,10 +18,17 @@ Rill model tables (materialized views):
 This is safe to run - only drops tables created by our ETL pipelines and Rill.
 """
 
+import pathlib
 import sys
 import clickhouse_connect
 import dlt
 
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.tracing import span, traced_clickhouse  # noqa: E402
+
 def get_clickhouse_client():
     """Get ClickHouse client from dlt credentials."""
     try:
@@ -39,7 +46,7 @@ def get_clickhouse_client():
             # force the client to use the HTTP API (used on GitHub actions)
             interface='https'
         )
-        return client
+        return traced_clickhouse(client)
     except Exception as e:
         print(f"❌ Error connecting to ClickHouse: {e}")
         print("Make sure .dlt/secrets.toml has ClickHouse credentials")
@@ -106,14 +113,15 @@ def drop_tables(client, tables, dry_run=False):
         print(f"⚠️  {errors} errors occurred")
 
 
-def main():
-    """Main function."""
+@span("clear_clickhouse")
+def main(argv=None):
+    """Main function, `argv` defaults to the command line arguments."""
     import argparse
 
     parser = argparse.ArgumentParser(description='Clear ClickHouse tables')
     parser.add_argument('--dry-run', action='store_true',
                        help='Show what would be deleted without actually deleting')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     print("=" * 80)
     print("ClickHouse Table Cleanup")
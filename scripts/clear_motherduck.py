@@ -82,8 +82,8 @@ def drop_schemas(conn, schemas, dry_run=False):
         print(f"{errors} errors occurred")
 
 
-def main():
-    """Main function."""
+def main(argv=None):
+    """Main function, `argv` defaults to the command line arguments."""
     import argparse
 
     parser = argparse.ArgumentParser(description="Clear MotherDuck schemas")
@@ -92,7 +92,7 @@ def main():
         action="store_true",
         help="Show what would be deleted without actually deleting",
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     print("=" * 80)
     print("MotherDuck Schema Cleanup")
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Report the bytes dictionary encoding saves on the repetitive string columns of the billing tables.
+
+Reads the parquet files of the AWS CUR and GCP billing tables and compares every column listed in
+`LOW_CARDINALITY_COLUMNS` of the source settings, as stored, with the same column written plain.
+On ClickHouse the pipelines print the same report when they convert the columns to LowCardinality.
+
+Usage:
+    python scripts/column_encoding_report.py                      # viz_rill/data
+    python scripts/column_encoding_report.py viz_rill/data_demo   # bundled demo data
+"""
+import argparse
+import pathlib
+import sys
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.aws_cur.settings import LOW_CARDINALITY_COLUMNS as AWS_COLUMNS  # noqa: E402
+from helpers.column_encoding import parquet_encoding_report, print_bytes_report  # noqa: E402
+from helpers.gcp_billing.settings import LOW_CARDINALITY_COLUMNS as GCP_COLUMNS  # noqa: E402
+
+# dataset -> columns of its root tables
+DATASETS = {
+    "aws_costs": AWS_COLUMNS,
+    "gcp_costs": GCP_COLUMNS,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir", nargs="?", type=pathlib.Path, default=pathlib.Path("viz_rill/data"))
+    args = parser.parse_args(argv)
+
+    for dataset, columns in DATASETS.items():
+        # root tables only, nested tables (`<table>__<column>`) hold none of the columns
+        for table_dir in sorted(p for p in (args.data_dir / dataset).glob("*") if p.is_dir() and "__" not in p.name):
+            files = sorted(table_dir.glob("*.parquet"))
+            print_bytes_report(f"{dataset}.{table_dir.name} dictionary encoded", parquet_encoding_report(files, columns))
+
+
+if __name__ == "__main__":
+    main()
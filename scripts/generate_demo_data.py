@@ -6,7 +6,7 @@ Creates additional parquet files with realistic costs and revenue for demo purpo
 
 import duckdb
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import random
 
 # Configuration
@@ -77,6 +77,9 @@ def generate_aws_demo_data():
 
                 # Modify key fields
                 template['identity_time_interval'] = time_interval
+                template['usage_start'] = month_start.replace(tzinfo=timezone.utc)
+                template['usage_end'] = next_month.replace(tzinfo=timezone.utc)
+                template['date'] = month_start.date()
                 template['identity_line_item_id'] = f"demo_{month_start.strftime('%Y%m')}{service}_{i}_{random.randint(1000,9999)}"
                 template['line_item_product_code'] = service
                 template['line_item_unblended_cost'] = service_cost / num_items
@@ -254,6 +257,8 @@ def generate_stripe_demo_data():
                         )).timestamp())
 
                         template['created'] = timestamp
+                        template['created_at'] = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+                        template['date'] = template['created_at'].date()
                         template['amount'] = amount
                         template['net'] = net
                         template['fee'] = fee
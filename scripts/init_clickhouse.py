@@ -8,10 +8,18 @@ for dlt to work with ClickHouse Cloud.
 Run once before first pipeline execution:
     python scripts/init_clickhouse.py
 """
+import pathlib
 import sys
 import dlt
 import clickhouse_connect
 
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from helpers.tracing import span, traced_clickhouse  # noqa: E402
+
+@span("init_clickhouse")
 def init_clickhouse():
     """Initialize ClickHouse database with required permissions."""
 
@@ -41,6 +49,7 @@ def init_clickhouse():
             password=password,
             secure=bool(secure)
         )
+        client = traced_clickhouse(client)
 
         print("✅ Connected successfully")
 
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Post signed Stripe events to the local webhook receiver.
+
+A stand-in for Stripe when testing `python main.py webhook`: every JSON file is posted as one
+event, signed with the configured signing secret. Without files, sample `charge.succeeded`
+events are posted.
+
+Usage:
+    python scripts/post_stripe_webhook.py                      # one sample event
+    python scripts/post_stripe_webhook.py --count 1000         # 1000 sample events
+    python scripts/post_stripe_webhook.py fixtures/*.json      # recorded events
+    python scripts/post_stripe_webhook.py --bad-signature      # must be refused with 400
+"""
+import argparse
+import json
+import pathlib
+import secrets
+import sys
+import time
+import urllib.error
+import urllib.request
+
+PIPELINES_DIR = pathlib.Path(__file__).resolve().parent.parent / "pipelines"
+if str(PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINES_DIR))
+
+from stripe_webhook import (  # noqa: E402
+    DEFAULT_HOST,
+    DEFAULT_PATH,
+    DEFAULT_PORT,
+    get_signing_secret,
+    sign_payload,
+)
+
+
+def sample_event() -> dict:
+    now = int(time.time())
+    return {
+        "id": f"evt_{secrets.token_hex(12)}",
+        "object": "event",
+        "api_version": "2022-11-15",
+        "created": now,
+        "livemode": False,
+        "type": "charge.succeeded",
+        "data": {
+            "object": {
+                "id": f"ch_{secrets.token_hex(12)}",
+                "object": "charge",
+                "amount": 4999,
+                "currency": "usd",
+                "balance_transaction": f"txn_{secrets.token_hex(12)}",
+                "created": now,
+            }
+        },
+    }
+
+
+def post(url: str, payload: bytes, signature: str) -> int:
+    request = urllib.request.Request(
+        url, data=payload, headers={"Content-Type": "application/json", "Stripe-Signature": signature}
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", type=pathlib.Path, help="Event JSON files to post")
+    parser.add_argument("--count", type=int, default=1, help="Sample events to post without files (default: 1)")
+    parser.add_argument("--url", default=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}{DEFAULT_PATH}")
+    parser.add_argument("--bad-signature", action="store_true", help="Sign with a wrong secret")
+    args = parser.parse_args(argv)
+
+    secret = "whsec_wrong" if args.bad_signature else get_signing_secret()
+    payloads = [path.read_bytes() for path in args.files] or [
+        json.dumps(sample_event()).encode() for _ in range(args.count)
+    ]
+    statuses = {}
+    for payload in payloads:
+        status = post(args.url, payload, sign_payload(payload, secret))
+        statuses[status] = statuses.get(status, 0) + 1
+    print(", ".join(f"{count} × HTTP {status}" for status, count in sorted(statuses.items())))
+    sys.exit(0 if set(statuses) == {200} else 1)
+
+
+if __name__ == "__main__":
+    main()
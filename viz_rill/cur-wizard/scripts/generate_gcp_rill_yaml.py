@@ -51,6 +51,13 @@ parser.add_argument(
     default="date",
     help="Timestamp column (default: date)",
 )
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    const="profiles",
+    metavar="DIR",
+    help="Profile every DuckDB statement and write a ranked report to DIR (default: profiles)",
+)
 
 args = parser.parse_args()
 
@@ -75,4 +82,5 @@ generate_gcp_rill_project(
     cost_col=args.cost_col,
     dim_prefixes=prefixes,
     timeseries_col=args.timeseries_col,
+    profile_dir=args.profile,
 )
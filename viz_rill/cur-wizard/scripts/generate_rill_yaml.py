@@ -69,6 +69,13 @@ parser.add_argument(
     "Useful to discover the exact column names you may want to feed "
     "into --cost-col.",
 )
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    const="profiles",
+    metavar="DIR",
+    help="Profile every DuckDB statement and write a ranked report to DIR (default: profiles)",
+)
 args = parser.parse_args()
 
 if args.parquet is None:
@@ -92,4 +99,5 @@ generate_rill_project(
     dim_prefixes=prefixes,
     timeseries_col=args.timeseries_col,
     list_cost_columns=args.list_cost_columns,
+    profile_dir=args.profile,
 )
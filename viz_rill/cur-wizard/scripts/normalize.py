@@ -1,101 +1,317 @@
 #!/usr/bin/env python
+"""
+AWS CUR Normalization Script
+
+Explodes the MAP columns of the loaded CUR tables (resource tags, cost categories, product)
+into flat columns and adds the amortized cost, writing normalized_aws.parquet for the dashboards.
+"""
+import argparse
 import os
 import pathlib
+import re
 import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import dlt
 import duckdb
 from dotenv import load_dotenv
 
-load_dotenv()
-
-# Read configuration from dlt config
-try:
-    normalized_data_dir_str = dlt.config["sources.aws_cur.normalized_data_dir"]
-except KeyError:
-    # Fall back to environment variables if not in config
-    normalized_data_dir_str = os.getenv("NORMALIZED_DATA_DIR")
-
-try:
-    input_data_dir_str = dlt.config["sources.aws_cur.input_data_dir"]
-except KeyError:
-    # Fall back to environment variables if not in config
-    input_data_dir_str = os.getenv("INPUT_DATA_DIR")
-
-if not normalized_data_dir_str:
-    sys.exit("ERROR: normalized_data_dir not configured. Add to .dlt/config.toml under [sources.aws_cur]")
-if not input_data_dir_str:
-    sys.exit("ERROR: input_data_dir not configured. Add to .dlt/config.toml under [sources.aws_cur]")
-
-NORMALIZED_DATA_DIR = pathlib.Path(normalized_data_dir_str).resolve()
-INPUT_DATA_DIR = pathlib.Path(input_data_dir_str).resolve()
-
-# Create directories if they don't exist
-NORMALIZED_DATA_DIR.mkdir(parents=True, exist_ok=True)
-INPUT_DATA_DIR.mkdir(parents=True, exist_ok=True)
-
-output_path = NORMALIZED_DATA_DIR / "normalized_aws.parquet"
-full_input_path = f"{INPUT_DATA_DIR}/*.parquet"
-
-# Check if any parquet files exist
-parquet_files = list(INPUT_DATA_DIR.glob("*.parquet"))
-if not parquet_files:
-    print(f"ℹ️  No parquet files found in {INPUT_DATA_DIR}")
-    print(f"   This is normal for incremental loading when no new data is available.")
-    print(f"   Skipping AWS normalization.")
-    sys.exit(0)
-
-con = duckdb.connect(database=":memory:")
-
-con.execute(
-    f"""
-    CREATE VIEW raw AS
-      SELECT *
-      FROM read_parquet('{full_input_path}', UNION_BY_NAME => TRUE)
+from utils.amortization import amortized_cost_clauses
+from utils.duckdb_profiler import profiled_connection, write_profile_report
+from utils.tracing import traced_duckdb
+
+# Tag keys are ranked by the spend on the rows that carry them
+TAG_RANK_COST_COL = "line_item_unblended_cost"
+# MAP columns of user defined keys that hybrid tags split, other MAP columns (product, discount)
+# have a fixed set of AWS keys and are always exploded
+TAG_MAP_COLUMNS = ("resource_tags", "cost_category")
+
+
+def map_keys_by_spend(con: duckdb.DuckDBPyConnection, col: str, cost_col: Optional[str]) -> List[Tuple[str, float]]:
+    """Distinct keys of a MAP column of `raw` with the spend of their rows, the most spend first."""
+    spend = f'SUM("{cost_col}")' if cost_col else "0"
+    cost = f', "{cost_col}"' if cost_col else ""
+    return con.execute(
+        f"""
+        SELECT key, COALESCE({spend}, 0) AS spend
+        FROM (
+          SELECT UNNEST([e.key FOR e IN map_entries({col}) IF e.value IS NOT NULL]) AS key{cost}
+          FROM raw
+          WHERE {col} IS NOT NULL
+        ) t
+        GROUP BY key
+        ORDER BY spend DESC, COUNT(*) DESC, key
+        """
+    ).fetchall()
+
+
+def select_tag_keys(
+    keys: Sequence[str], max_tag_columns: Optional[int], tag_allowlist: Sequence[str]
+) -> Tuple[List[str], List[str]]:
     """
-)
-
-schema_rows = con.execute("DESCRIBE SELECT * FROM raw").fetchall()
-all_columns = {row[0] for row in schema_rows}
-map_cols = [row[0] for row in schema_rows if row[1].startswith("MAP")]
-print("MAP columns found:", map_cols)
-
-
-select_clauses = ["*"]
-
-for col in map_cols:
-    keys = [
-        k[0]
-        for k in con.execute(
-            f"""
-            SELECT DISTINCT
-              key.unnest AS key_str
-            FROM (
-              SELECT map_keys({col}) AS k
-              FROM raw
-              WHERE {col} IS NOT NULL
-            ) t
-            CROSS JOIN UNNEST(k) AS key
-            """
-        ).fetchall()
-    ]
-
-    for key_str in keys:
-        exploded = f"{col} ->> '{key_str}'"
-        flat = f"{col}_{key_str}"
-        if flat in all_columns:
-            clause = f"COALESCE({flat}, {exploded}) AS {flat}"
+    Splits the ranked keys of a MAP column into keys exploded into columns and residual keys.
+
+    Without `max_tag_columns` and `tag_allowlist` every key is exploded. Otherwise the allowlisted
+    keys and the `max_tag_columns` keys with the most spend are exploded, the rest stay in the MAP.
+
+    Args:
+        keys (Sequence[str]): Keys, the most spend first.
+        max_tag_columns (Optional[int]): Keys exploded besides the allowlist, None for none.
+        tag_allowlist (Sequence[str]): Keys that are always exploded.
+
+    Returns:
+        Tuple[List[str], List[str]]: Exploded keys and residual keys, both in rank order.
+    """
+    if max_tag_columns is None and not tag_allowlist:
+        return list(keys), []
+    allowed = set(tag_allowlist)
+    top = [k for k in keys if k not in allowed][: max_tag_columns or 0]
+    exploded = allowed.union(top)
+    return [k for k in keys if k in exploded], [k for k in keys if k not in exploded]
+
+
+def _sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _sql_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def normalize_aws(
+    profile_dir: Optional[str] = None,
+    normalized_data_dir: Optional[str] = None,
+    input_data_dir: Optional[str] = None,
+    accounts: Optional[List[Dict[str, Any]]] = None,
+    work_queue: Optional[str] = None,
+    max_tag_columns: Optional[int] = None,
+    tag_allowlist: Optional[Sequence[str]] = None,
+) -> Optional[pathlib.Path]:
+    """
+    Explodes the MAP columns of the loaded CUR tables into flat columns.
+
+    Reads `input_data_dir` (or the tables of all `accounts`) and writes
+    `normalized_aws.parquet` to `normalized_data_dir`. Settings that are not passed are read
+    from `[sources.aws_cur]` of the dlt config of the working directory, the data directories
+    then fall back to the environment (`viz_rill/.env`).
+
+    Args:
+        profile_dir (Optional[str]): Profile the DuckDB statements and write the report to this directory.
+        normalized_data_dir (Optional[str]): Directory of the output file.
+        input_data_dir (Optional[str]): Directory of the loaded CUR table.
+        accounts (Optional[List[Dict[str, Any]]]): CUR exports of a multi-account setup.
+        work_queue (Optional[str]): Work queue url that shards the normalization per file.
+        max_tag_columns (Optional[int]): Tag keys exploded by spend, the rest stays in the MAP.
+        tag_allowlist (Optional[Sequence[str]]): Tag keys that are always exploded.
+
+    Returns:
+        Optional[pathlib.Path]: The written file, None if there was nothing to normalize.
+    """
+    load_dotenv()
+
+    # Read configuration from dlt config
+    normalized_data_dir_str = normalized_data_dir
+    if normalized_data_dir_str is None:
+        try:
+            normalized_data_dir_str = dlt.config["sources.aws_cur.normalized_data_dir"]
+        except KeyError:
+            # Fall back to environment variables if not in config
+            normalized_data_dir_str = os.getenv("NORMALIZED_DATA_DIR")
+
+    input_data_dir_str = input_data_dir
+    if input_data_dir_str is None:
+        try:
+            input_data_dir_str = dlt.config["sources.aws_cur.input_data_dir"]
+        except KeyError:
+            # Fall back to environment variables if not in config
+            input_data_dir_str = os.getenv("INPUT_DATA_DIR")
+
+    if not normalized_data_dir_str:
+        sys.exit("ERROR: normalized_data_dir not configured. Add to .dlt/config.toml under [sources.aws_cur]")
+    if not input_data_dir_str:
+        sys.exit("ERROR: input_data_dir not configured. Add to .dlt/config.toml under [sources.aws_cur]")
+
+    NORMALIZED_DATA_DIR = pathlib.Path(normalized_data_dir_str).resolve()
+    INPUT_DATA_DIR = pathlib.Path(input_data_dir_str).resolve()
+
+    # Create directories if they don't exist
+    NORMALIZED_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    INPUT_DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+    output_path = NORMALIZED_DATA_DIR / "normalized_aws.parquet"
+
+    # Multi-account setups load every CUR export into its own table next to input_data_dir,
+    # normalize all of them together (rows carry their account in the cur_account column)
+    if accounts is None:
+        try:
+            accounts = dlt.config["sources.aws_cur.accounts"]
+        except KeyError:
+            accounts = []
+
+    input_dirs = [INPUT_DATA_DIR]
+    if accounts:
+        input_dirs = [
+            INPUT_DATA_DIR.parent
+            / account.get("table_name", "cur_" + re.sub(r"[^0-9a-z]+", "_", account["name"].lower()).strip("_"))
+            for account in accounts
+        ]
+    input_globs = [f"{input_dir}/*.parquet" for input_dir in input_dirs if list(input_dir.glob("*.parquet"))]
+    full_input_path = "[" + ", ".join(f"'{g}'" for g in input_globs) + "]"
+
+    # Check if any parquet files exist
+    if not input_globs:
+        print(f"ℹ️  No parquet files found in {', '.join(str(d) for d in input_dirs)}")
+        print(f"   This is normal for incremental loading when no new data is available.")
+        print(f"   Skipping AWS normalization.")
+        return None
+
+    # Hybrid tags: explode only the top max_tag_columns keys by spend (and the tag_allowlist) of
+    # the TAG_MAP_COLUMNS, the other keys stay in the MAP column itself. Default: explode every key
+    if max_tag_columns is None:
+        try:
+            max_tag_columns = dlt.config["sources.aws_cur.max_tag_columns"]
+        except KeyError:
+            max_tag_columns = None
+
+    if tag_allowlist is None:
+        try:
+            tag_allowlist = dlt.config["sources.aws_cur.tag_allowlist"]
+        except KeyError:
+            tag_allowlist = []
+
+    con = traced_duckdb(
+        profiled_connection(duckdb.connect(database=":memory:"), "normalize_aws", profile_dir), "normalize_aws"
+    )
+
+    con.execute(
+        f"""
+        CREATE VIEW raw AS
+          SELECT *
+          FROM read_parquet({full_input_path}, UNION_BY_NAME => TRUE)
+        """
+    )
+
+    schema_rows = con.execute("DESCRIBE SELECT * FROM raw").fetchall()
+    all_columns = {row[0] for row in schema_rows}
+    map_cols = [row[0] for row in schema_rows if row[1].startswith("MAP")]
+    print("MAP columns found:", map_cols)
+
+
+    select_clauses = []
+    residual_clauses = []
+    cost_col = TAG_RANK_COST_COL if TAG_RANK_COST_COL in all_columns else None
+
+    hybrid = max_tag_columns is not None or bool(tag_allowlist)
+    for col in map_cols:
+        tag_map = hybrid and col in TAG_MAP_COLUMNS
+        if tag_map:
+            ranked = map_keys_by_spend(con, col, cost_col)
+            keys, residual = select_tag_keys([k for k, _spend in ranked], max_tag_columns, tag_allowlist)
         else:
-            clause = f"{exploded} AS {flat}"
-        select_clauses.append(clause)
+            # every key is exploded, in the order DuckDB finds them
+            keys = [
+                k[0]
+                for k in con.execute(
+                    f"""
+                    SELECT DISTINCT
+                      key.unnest AS key_str
+                    FROM (
+                      SELECT map_keys({col}) AS k
+                      FROM raw
+                      WHERE {col} IS NOT NULL
+                    ) t
+                    CROSS JOIN UNNEST(k) AS key
+                    """
+                ).fetchall()
+            ]
+
+        for key_str in keys:
+            exploded = f"{col} ->> {_sql_string(key_str)}"
+            flat = f"{col}_{key_str}"
+            if flat in all_columns:
+                clause = f"COALESCE({_sql_identifier(flat)}, {exploded}) AS {_sql_identifier(flat)}"
+            else:
+                clause = f"{exploded} AS {_sql_identifier(flat)}"
+            select_clauses.append(clause)
+
+        if tag_map:
+            # the MAP keeps only the keys that were not exploded, NULL when nothing is left
+            exploded_list = "[" + ", ".join(_sql_string(k) for k in keys) + "]"
+            residual_clauses.append(
+                f"map_from_entries(NULLIF(list_filter(map_entries({col}), e -> NOT list_contains({exploded_list}, e.key)), []))"
+                f" AS {col}"
+            )
+            total_spend = sum(spend for _k, spend in ranked) or 1
+            residual_keys = set(residual)
+            residual_spend = sum(spend for k, spend in ranked if k in residual_keys)
+            print(
+                f"{col}: {len(keys)} of {len(ranked)} keys exploded, {len(residual)} kept in the residual MAP"
+                f" ({100 * residual_spend / total_spend:.1f}% of the tagged spend)"
+            )
+
+    select_clauses.insert(0, f"* REPLACE ({', '.join(residual_clauses)})" if residual_clauses else "*")
+
+    if len(select_clauses) > 1 or residual_clauses:
+        print("Generated SELECT clauses:\n", "\n".join(select_clauses))
+    else:
+        print("No MAP columns found. No normalization needed.")
+
+    # RI / Savings Plan amortization, in the same pass
+    amortization = amortized_cost_clauses(all_columns)
+    if amortization:
+        select_clauses += amortization
+        print("💰 Adding amortized_cost and net_amortized_cost")
+
+    select_sql = "SELECT " + ",\n       ".join(select_clauses) + "\n  FROM raw"
+
+    # With a work queue, every loaded file is normalized as its own task by this process and any
+    # `aws_pipeline.py --worker` processes, then the parts are combined into the output file
+    if work_queue is None:
+        try:
+            work_queue = dlt.config["sources.aws_cur.work_queue"]
+        except KeyError:
+            work_queue = None
+
+    if work_queue:
+        sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[3] / "pipelines"))
+        from helpers.aws_cur.staging import CUR_NORMALIZE_QUEUE, normalize_cur_file, normalize_file_task
+        from helpers.work_queue import open_work_queue, run_until_done
 
-if len(select_clauses) > 1:
-    print("Generated SELECT clauses:\n", "\n".join(select_clauses))
-else:
-    print("No MAP columns found. No normalization needed.")
+        parts_dir = NORMALIZED_DATA_DIR / "normalized_aws_parts"
+        tasks = dict(
+            normalize_file_task(input_path, full_input_path, select_sql, parts_dir)
+            for input_dir in input_dirs
+            for input_path in sorted(input_dir.glob("*.parquet"))
+        )
+        print(f"Sharding normalization of {len(tasks)} file(s) over work queue {work_queue}")
+        results = run_until_done(open_work_queue(work_queue), CUR_NORMALIZE_QUEUE, tasks, normalize_cur_file)
+        parts = [results[task_id]["output"] for task_id in tasks]
+        for task_id, payload in tasks.items():
+            if not os.path.exists(results[task_id]["output"]):
+                normalize_cur_file(payload)
+        parts_sql = "[" + ", ".join(f"'{part}'" for part in parts) + "]"
+        con.execute(
+            f"COPY (SELECT * FROM read_parquet({parts_sql}, UNION_BY_NAME => TRUE)) TO '{output_path}' (FORMAT PARQUET);"
+        )
+        # parts of files that were merged away or of an older SQL are not needed anymore
+        for part in parts_dir.glob("*/*.parquet"):
+            if str(part) not in parts:
+                part.unlink()
+    else:
+        copy_sql = "COPY (\n" + select_sql + f"\n) TO '{output_path}' (FORMAT PARQUET);"
+        con.execute(copy_sql)
+    print(f"✅ Normalized parquet written to {output_path}")
+    write_profile_report(con)
+    return output_path
 
-select_sql = "SELECT " + ",\n       ".join(select_clauses) + "\n  FROM raw"
 
-copy_sql = "COPY (\n" + select_sql + f"\n) TO '{output_path}' (FORMAT PARQUET);"
-con.execute(copy_sql)
-print(f"✅ Normalized parquet written to {output_path}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profiles",
+        metavar="DIR",
+        help="Profile every DuckDB statement and write a ranked report to DIR (default: profiles)",
+    )
+    normalize_aws(profile_dir=parser.parse_args().profile)
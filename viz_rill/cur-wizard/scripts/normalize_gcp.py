@@ -5,146 +5,183 @@ GCP Billing Data Normalization Script
 Flattens GCP billing labels into columns (similar to AWS resource_tags).
 This enables dynamic dashboard generation based on discovered labels.
 """
+import argparse
 import os
 import pathlib
 import sys
+from typing import Optional
 
 import dlt
 import duckdb
 from dotenv import load_dotenv
 
-load_dotenv()
-
-# Read configuration from dlt config
-try:
-    normalized_data_dir_str = dlt.config["sources.gcp_billing.normalized_data_dir"]
-except KeyError:
-    # Fall back to environment variables if not in config
-    normalized_data_dir_str = os.getenv("NORMALIZED_DATA_DIR")
-
-try:
-    input_data_dir_str = dlt.config["sources.gcp_billing.input_data_dir"]
-except KeyError:
-    # Fall back to environment variables if not in config
-    input_data_dir_str = os.getenv("INPUT_DATA_DIR_GCP") or "data/gcp_costs"
-
-if not normalized_data_dir_str:
-    sys.exit("ERROR: normalized_data_dir not configured. Add to .dlt/config.toml under [sources.gcp_billing]")
-if not input_data_dir_str:
-    sys.exit("ERROR: input_data_dir not configured. Add to .dlt/config.toml under [sources.gcp_billing]")
-
-NORMALIZED_DATA_DIR = pathlib.Path(normalized_data_dir_str).resolve()
-INPUT_DATA_DIR_GCP = pathlib.Path(input_data_dir_str).resolve()
-
-# Create directories if they don't exist
-NORMALIZED_DATA_DIR.mkdir(parents=True, exist_ok=True)
-INPUT_DATA_DIR_GCP.mkdir(parents=True, exist_ok=True)
-
-output_path = NORMALIZED_DATA_DIR / "normalized_gcp.parquet"
-
-billing_path = f"{INPUT_DATA_DIR_GCP}/bigquery_billing_table/*.parquet"
-labels_path = f"{INPUT_DATA_DIR_GCP}/bigquery_billing_table__labels/*.parquet"
-
-# Check if any billing parquet files exist
-billing_dir = INPUT_DATA_DIR_GCP / "bigquery_billing_table"
-if not billing_dir.exists() or not list(billing_dir.glob("*.parquet")):
-    print(f"ℹ️  No GCP billing parquet files found in {billing_dir}")
-    print(f"   This is normal for incremental loading when no new data is available.")
-    print(f"   Skipping GCP normalization.")
-    sys.exit(0)
-
-con = duckdb.connect(database=":memory:")
-
-# Create billing view
-con.execute(f"CREATE VIEW billing AS SELECT * FROM read_parquet('{billing_path}')")
-
-# Check if labels exist
-labels_exist = (INPUT_DATA_DIR_GCP / "bigquery_billing_table__labels").exists()
-
-if labels_exist:
-    con.execute(f"CREATE VIEW labels AS SELECT * FROM read_parquet('{labels_path}')")
-
-    # Get all unique label keys
-    label_keys = [
-        row[0] for row in con.execute(
-            "SELECT DISTINCT key FROM labels WHERE key IS NOT NULL ORDER BY key"
-        ).fetchall()
-    ]
-    print(f"Found {len(label_keys)} unique labels:", label_keys)
-
-    # Build pivot columns for labels
-    label_columns = []
-    for key in label_keys:
-        # Sanitize key for column name
-        safe_key = key.replace("-", "_").replace(":", "_").replace("/", "_").replace(".", "_")
-        label_columns.append(
-            f"MAX(CASE WHEN l.key = '{key}' THEN l.value END) AS labels_{safe_key}"
-        )
+from utils.duckdb_profiler import profiled_connection, write_profile_report
+from utils.tracing import traced_duckdb
+
+# Columns kept from the billing table, in output order
+BILLING_COLUMNS = [
+    "billing_account_id",
+    "service__id",
+    "service__description",
+    "sku__id",
+    "sku__description",
+    "project__id",
+    "project__number",
+    "project__name",
+    "location__location",
+    "location__country",
+    "resource__name",
+    "resource__global_name",
+    "cost",
+    "currency",
+    "cost_type",
+    "usage__amount",
+    "usage__unit",
+    "price__effective_price",
+    "transaction_type",
+    "credits_amount",
+    "line_items",
+    "_dlt_id",
+]
+
+
+def normalize_gcp(
+    profile_dir: Optional[str] = None,
+    normalized_data_dir: Optional[str] = None,
+    input_data_dir: Optional[str] = None,
+) -> Optional[pathlib.Path]:
+    """
+    Pivots the labels of the loaded billing table into `labels_<key>` columns.
 
-    label_select = ",\n       ".join(label_columns)
+    Directories that are not passed are read from `[sources.gcp_billing]` of the dlt config of
+    the working directory, else from the environment (`viz_rill/.env`).
 
-    # Join and flatten
-    normalize_sql = f"""
-    WITH labels_pivot AS (
-      SELECT
-        _dlt_parent_id,
-        {label_select}
-      FROM labels l
-      GROUP BY _dlt_parent_id
-    )
-    SELECT
-      CAST(b.usage_start_time AS DATE) AS date,
-      b.billing_account_id,
-      b.service__id,
-      b.service__description,
-      b.sku__id,
-      b.sku__description,
-      b.project__id,
-      b.project__number,
-      b.project__name,
-      b.location__location,
-      b.location__country,
-      b.resource__name,
-      b.resource__global_name,
-      b.cost,
-      b.currency,
-      b.cost_type,
-      b.usage__amount,
-      b.usage__unit,
-      b.price__effective_price,
-      b.transaction_type,
-      b._dlt_id,
-      lp.*
-    FROM billing b
-    LEFT JOIN labels_pivot lp ON b._dlt_id = lp._dlt_parent_id
-    """
-else:
-    print("No labels found, proceeding without labels...")
-    normalize_sql = """
-    SELECT
-      CAST(usage_start_time AS DATE) AS date,
-      billing_account_id,
-      service__id,
-      service__description,
-      sku__id,
-      sku__description,
-      project__id,
-      project__number,
-      project__name,
-      location__location,
-      location__country,
-      resource__name,
-      resource__global_name,
-      cost,
-      currency,
-      cost_type,
-      usage__amount,
-      usage__unit,
-      price__effective_price,
-      transaction_type,
-      _dlt_id
-    FROM billing
+    Args:
+        profile_dir (Optional[str]): Profile the DuckDB statements and write the report to this directory.
+        normalized_data_dir (Optional[str]): Directory of the output file.
+        input_data_dir (Optional[str]): Dataset directory of the loaded billing tables.
+
+    Returns:
+        Optional[pathlib.Path]: The written `normalized_gcp.parquet`, None if there was nothing to normalize.
     """
+    load_dotenv()
+
+    # Read configuration from dlt config
+    normalized_data_dir_str = normalized_data_dir
+    if normalized_data_dir_str is None:
+        try:
+            normalized_data_dir_str = dlt.config["sources.gcp_billing.normalized_data_dir"]
+        except KeyError:
+            # Fall back to environment variables if not in config
+            normalized_data_dir_str = os.getenv("NORMALIZED_DATA_DIR")
+
+    input_data_dir_str = input_data_dir
+    if input_data_dir_str is None:
+        try:
+            input_data_dir_str = dlt.config["sources.gcp_billing.input_data_dir"]
+        except KeyError:
+            # Fall back to environment variables if not in config
+            input_data_dir_str = os.getenv("INPUT_DATA_DIR_GCP") or "data/gcp_costs"
+
+    if not normalized_data_dir_str:
+        sys.exit("ERROR: normalized_data_dir not configured. Add to .dlt/config.toml under [sources.gcp_billing]")
+    if not input_data_dir_str:
+        sys.exit("ERROR: input_data_dir not configured. Add to .dlt/config.toml under [sources.gcp_billing]")
+
+    NORMALIZED_DATA_DIR = pathlib.Path(normalized_data_dir_str).resolve()
+    INPUT_DATA_DIR_GCP = pathlib.Path(input_data_dir_str).resolve()
+
+    # Create directories if they don't exist
+    NORMALIZED_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    INPUT_DATA_DIR_GCP.mkdir(parents=True, exist_ok=True)
+
+    output_path = NORMALIZED_DATA_DIR / "normalized_gcp.parquet"
+
+    billing_path = f"{INPUT_DATA_DIR_GCP}/bigquery_billing_table/*.parquet"
+    labels_path = f"{INPUT_DATA_DIR_GCP}/bigquery_billing_table__labels/*.parquet"
+
+    # Check if any billing parquet files exist
+    billing_dir = INPUT_DATA_DIR_GCP / "bigquery_billing_table"
+    if not billing_dir.exists() or not list(billing_dir.glob("*.parquet")):
+        print(f"ℹ️  No GCP billing parquet files found in {billing_dir}")
+        print(f"   This is normal for incremental loading when no new data is available.")
+        print(f"   Skipping GCP normalization.")
+        return None
+
+    con = traced_duckdb(
+        profiled_connection(duckdb.connect(database=":memory:"), "normalize_gcp", profile_dir), "normalize_gcp"
+    )
 
-con.execute(f"COPY ({normalize_sql}) TO '{output_path}' (FORMAT PARQUET);")
-print(f"✅ Normalized GCP parquet written to {output_path}")
+    # Create billing view
+    con.execute(f"CREATE VIEW billing AS SELECT * FROM read_parquet('{billing_path}')")
+
+    # The daily granularity of the pipeline has no resource and price columns but line and credit totals
+    billing_columns = {row[0] for row in con.execute("DESCRIBE SELECT * FROM billing").fetchall()}
+    columns = [column for column in BILLING_COLUMNS if column in billing_columns]
+
+    # Check if labels exist
+    labels_exist = (INPUT_DATA_DIR_GCP / "bigquery_billing_table__labels").exists()
+
+    if labels_exist:
+        con.execute(f"CREATE VIEW labels AS SELECT * FROM read_parquet('{labels_path}')")
+
+        # Get all unique label keys
+        label_keys = [
+            row[0] for row in con.execute(
+                "SELECT DISTINCT key FROM labels WHERE key IS NOT NULL ORDER BY key"
+            ).fetchall()
+        ]
+        print(f"Found {len(label_keys)} unique labels:", label_keys)
+
+        # Build pivot columns for labels
+        label_columns = []
+        for key in label_keys:
+            # Sanitize key for column name
+            safe_key = key.replace("-", "_").replace(":", "_").replace("/", "_").replace(".", "_")
+            label_columns.append(
+                f"MAX(CASE WHEN l.key = '{key}' THEN l.value END) AS labels_{safe_key}"
+            )
+
+        label_select = ",\n       ".join(label_columns)
+
+        # Join and flatten
+        normalize_sql = f"""
+        WITH labels_pivot AS (
+          SELECT
+            _dlt_parent_id,
+            {label_select}
+          FROM labels l
+          GROUP BY _dlt_parent_id
+        )
+        SELECT
+          CAST(b.usage_start_time AS DATE) AS date,
+          {", ".join(f"b.{column}" for column in columns)},
+          lp.*
+        FROM billing b
+        LEFT JOIN labels_pivot lp ON b._dlt_id = lp._dlt_parent_id
+        """
+    else:
+        print("No labels found, proceeding without labels...")
+        normalize_sql = f"""
+        SELECT
+          CAST(usage_start_time AS DATE) AS date,
+          {", ".join(columns)}
+        FROM billing
+        """
+
+    con.execute(f"COPY ({normalize_sql}) TO '{output_path}' (FORMAT PARQUET);")
+    print(f"✅ Normalized GCP parquet written to {output_path}")
+    write_profile_report(con)
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profiles",
+        metavar="DIR",
+        help="Profile every DuckDB statement and write a ranked report to DIR (default: profiles)",
+    )
+    normalize_gcp(profile_dir=parser.parse_args().profile)
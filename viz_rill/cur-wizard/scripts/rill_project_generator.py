@@ -23,6 +23,8 @@ import duckdb
 from jinja2 import Environment, FileSystemLoader
 
 from utils.dimension_chart_selector import select_dimension_charts
+from utils.duckdb_profiler import profiled_connection, write_profile_report
+from utils.tracing import traced_duckdb
 
 
 _TEMPLATE_DIR = pathlib.Path(__file__).parent.parent / "templates"
@@ -47,6 +49,8 @@ def create_measures_list(all_cols: list[str], cost_col: str) -> list[str]:
         "line_item_unblended_cost",
         "line_item_blended_cost",
         "line_item_net_unblended_cost",
+        "amortized_cost",
+        "net_amortized_cost",
         "savings_plan_effective_cost",
         "reservation_effective_cost",
     ]
@@ -64,6 +68,7 @@ def generate_rill_project(
     list_cost_columns: bool = False,
     conn: duckdb.DuckDBPyConnection | None = None,
     extra_context: Mapping[str, Any] | None = None,
+    profile_dir: str | None = None,
 ) -> None:
     """
     Build a full Rill project (sources/metrics/explores/canvases).
@@ -88,6 +93,9 @@ def generate_rill_project(
         a transient in-memory DB is created.
     extra_context : dict, optional
         Extra key/values injected into Jinja templates (advanced).
+    profile_dir : str, optional
+        Profile every DuckDB statement of the transient connection and
+        write a ranked report to this directory.
 
     Ideas for future knobs:
     • dominant_threshold : float
@@ -103,7 +111,10 @@ def generate_rill_project(
 
     script_owns_conn = conn is None
     if conn is None:
-        conn = duckdb.connect(database=":memory:")
+        conn = traced_duckdb(
+            profiled_connection(duckdb.connect(database=":memory:"), "generate_rill_project", profile_dir),
+            "generate_rill_project",
+        )
 
     conn.execute(f"CREATE VIEW _tmp AS SELECT * FROM read_parquet('{parquet_path}') LIMIT 0")
     all_cols = [r[0] for r in conn.execute("DESCRIBE SELECT * FROM _tmp").fetchall()]
@@ -196,6 +207,7 @@ def generate_rill_project(
         print(f"✓ canvas written → canvases/{fname}")
 
     if script_owns_conn:
+        write_profile_report(conn)
         conn.close()
 
     print("✅  Rill project ready at", out_dir)
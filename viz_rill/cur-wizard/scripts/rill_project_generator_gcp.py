@@ -12,6 +12,8 @@ import duckdb
 from jinja2 import Environment, FileSystemLoader
 
 from utils.dimension_chart_selector import select_dimension_charts
+from utils.duckdb_profiler import profiled_connection, write_profile_report
+from utils.tracing import traced_duckdb
 
 _TEMPLATE_DIR = pathlib.Path(__file__).parent.parent / "templates"
 
@@ -31,6 +33,8 @@ def create_gcp_measures_list(all_cols: list[str]) -> list[str]:
         "cost_at_list",
         "usage__amount",
         "price__effective_price",
+        "credits_amount",
+        "line_items",
     ]
     return [c for c in COMMON if c in all_cols]
 
@@ -43,6 +47,7 @@ def generate_gcp_rill_project(
     dim_prefixes: Sequence[str] = ("labels_",),
     timeseries_col: str = "date",
     conn: duckdb.DuckDBPyConnection | None = None,
+    profile_dir: str | None = None,
 ) -> None:
     """
     Generate Rill metrics/sources/explores/canvases for GCP billing.
@@ -61,6 +66,8 @@ def generate_gcp_rill_project(
         Timestamp column (default: 'date')
     conn : DuckDB connection, optional
         Existing connection to reuse
+    profile_dir : str, optional
+        Profile the DuckDB statements and write a ranked report to this directory
     """
     out_dir.mkdir(parents=True, exist_ok=True)
     for sub in ("metrics", "sources", "explores", "dashboards"):
@@ -68,7 +75,10 @@ def generate_gcp_rill_project(
 
     script_owns_conn = conn is None
     if conn is None:
-        conn = duckdb.connect(database=":memory:")
+        conn = traced_duckdb(
+            profiled_connection(duckdb.connect(database=":memory:"), "generate_gcp_rill_project", profile_dir),
+            "generate_gcp_rill_project",
+        )
 
     conn.execute(f"CREATE VIEW _tmp AS SELECT * FROM read_parquet('{parquet_path}') LIMIT 0")
     all_cols = [r[0] for r in conn.execute("DESCRIBE SELECT * FROM _tmp").fetchall()]
@@ -154,6 +164,7 @@ def generate_gcp_rill_project(
         print(f"✓ canvas written → dashboards/{fname}")
 
     if script_owns_conn:
+        write_profile_report(conn)
         conn.close()
 
     print("✅ GCP Rill project ready at", out_dir)
@@ -0,0 +1,90 @@
+"""
+Amortized cost of Reserved Instances and Savings Plans, derived per CUR line item.
+
+``line_item_unblended_cost`` books upfront fees on the day they are paid and the commitment fees
+as monthly lines, while the usage they cover shows no cost. The amortized cost spreads them over
+the covered usage instead, following the AWS CUR definitions per ``line_item_line_item_type``:
+
+    ``SavingsPlanCoveredUsage``  → ``savings_plan_savings_plan_effective_cost``
+    ``SavingsPlanRecurringFee``  → unused commitment (``total_commitment_to_date - used_commitment``)
+    ``SavingsPlanNegation``,
+    ``SavingsPlanUpfrontFee``    → 0 (already in the effective cost)
+    ``DiscountedUsage``          → ``reservation_effective_cost``
+    ``RIFee``                    → unused upfront fee + unused recurring fee
+    ``Fee`` of a reservation     → 0 (the upfront payment, already in the effective cost)
+    anything else                → ``line_item_unblended_cost``
+
+``net_amortized_cost`` uses the ``*_net_*`` columns AWS adds with discounts (EDP, private
+pricing) and falls back to the gross column where there is none.
+
+The daily rollup of the AWS pipeline sums ``savings_plan_total_commitment_to_date`` of the
+``SavingsPlanRecurringFee`` lines like the used commitment, so their unused commitment is the same
+on hourly and daily rows.
+
+``amortized_cost_clauses`` returns plain column expressions, ``normalize.py`` adds them to its
+single normalization pass, so the amortized columns cost no extra scan.
+"""
+
+from __future__ import annotations
+
+from typing import Collection, List, Optional
+
+AMORTIZED_COST_COLUMNS = ("amortized_cost", "net_amortized_cost")
+
+# gross column → its net counterpart
+_NET_COLUMNS = {
+    "line_item_unblended_cost": "line_item_net_unblended_cost",
+    "savings_plan_savings_plan_effective_cost": "savings_plan_net_savings_plan_effective_cost",
+    "reservation_effective_cost": "reservation_net_effective_cost",
+    "reservation_unused_amortized_upfront_fee_for_billing_period": (
+        "reservation_net_unused_amortized_upfront_fee_for_billing_period"
+    ),
+    "reservation_unused_recurring_fee": "reservation_net_unused_recurring_fee",
+}
+
+
+def _amortized_cost_sql(columns: Collection[str], net: bool) -> str:
+    def col(name: str) -> str:
+        if name not in columns:
+            return "0"
+        net_name = _NET_COLUMNS.get(name)
+        if net and net_name in columns:
+            return f'COALESCE("{net_name}", "{name}", 0)'
+        return f'COALESCE("{name}", 0)'
+
+    ri_upfront_fee = (
+        """WHEN 'Fee' THEN CASE WHEN COALESCE("reservation_reservation_a_r_n", '') <> '' THEN 0 """
+        f"""ELSE {col("line_item_unblended_cost")} END"""
+        if "reservation_reservation_a_r_n" in columns
+        else ""
+    )
+    return f"""CASE "line_item_line_item_type"
+      WHEN 'SavingsPlanCoveredUsage' THEN {col("savings_plan_savings_plan_effective_cost")}
+      WHEN 'SavingsPlanRecurringFee' THEN {col("savings_plan_total_commitment_to_date")} - {col("savings_plan_used_commitment")}
+      WHEN 'SavingsPlanNegation' THEN 0
+      WHEN 'SavingsPlanUpfrontFee' THEN 0
+      WHEN 'DiscountedUsage' THEN {col("reservation_effective_cost")}
+      WHEN 'RIFee' THEN {col("reservation_unused_amortized_upfront_fee_for_billing_period")} + {col("reservation_unused_recurring_fee")}
+      {ri_upfront_fee}
+      ELSE {col("line_item_unblended_cost")}
+    END"""
+
+
+def amortized_cost_clauses(columns: Collection[str]) -> Optional[List[str]]:
+    """
+    SELECT clauses for ``amortized_cost`` and ``net_amortized_cost`` over a CUR relation.
+
+    Reservation and Savings Plan columns missing from the export count as 0.
+
+    Args:
+        columns: Column names of the CUR relation.
+
+    Returns:
+        The two clauses, or None without the line item type or unblended cost columns.
+    """
+    if "line_item_line_item_type" not in columns or "line_item_unblended_cost" not in columns:
+        return None
+    return [
+        f"{_amortized_cost_sql(columns, net)} AS {name}"
+        for name, net in zip(AMORTIZED_COST_COLUMNS, (False, True))
+    ]
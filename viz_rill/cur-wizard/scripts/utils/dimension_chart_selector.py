@@ -7,6 +7,11 @@ Algorithm overview
 ------------------
 1. **Candidate discovery** – any column whose name starts with one of the
    user-supplied *prefixes* (e.g. ``resource_tags_``, ``product_``).
+   With hybrid tags (``max_tag_columns`` / ``tag_allowlist`` in
+   ``normalize.py``) only the top tag keys are columns, the rest stay in the
+   residual MAP column (``resource_tags``).  The residual keys are not charted:
+   their spend coverage is measured in one pass and keys that would qualify
+   are logged, to be added to ``tag_allowlist``.
 
 2. **Minimal qualification** – a column is only considered if
 
@@ -68,6 +73,9 @@ import duckdb
 import logging
 import sys
 
+from utils.duckdb_profiler import profiled_connection, write_profile_report
+from utils.tracing import traced_duckdb
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -78,6 +86,8 @@ logging.basicConfig(
 COST_COVERAGE_THR = 0.05
 MIN_DISTINCT = 2
 DOMINANT_SLICE_THR = 0.70
+# MAP columns that keep the residual keys of hybrid tags (``TAG_MAP_COLUMNS`` of ``normalize.py``)
+RESIDUAL_MAP_COLUMNS = ("resource_tags", "cost_category")
 
 
 def _per_tag_stats(conn, table_sql, dim, cost) -> Dict[str, float]:
@@ -169,6 +179,23 @@ def _remaining_spend(conn, table_sql, dim, cost, excluded_vals) -> float:
     )
 
 
+def _residual_key_coverage(conn, table_sql, map_col, cost) -> List[tuple]:
+    """Spend coverage of every key (with a value) left in a residual MAP column, highest first."""
+    return conn.execute(
+        f"""
+        WITH x AS (
+          SELECT UNNEST([e.key FOR e IN map_entries("{map_col}") IF e.value IS NOT NULL]) AS k, "{cost}" AS c
+          FROM {table_sql}
+          WHERE "{map_col}" IS NOT NULL
+        )
+        SELECT k, SUM(c) / NULLIF((SELECT SUM("{cost}") FROM {table_sql}), 0) AS cov
+        FROM x
+        GROUP BY k
+        ORDER BY cov DESC NULLS LAST
+        """
+    ).fetchall()
+
+
 def _chart_by_cardinality(dc: int) -> str:
     if dc <= 10:
         return "pie_chart"
@@ -182,20 +209,50 @@ def select_dimension_charts(
     prefixes: List[str],
     cost_col: str = "line_item_unblended_cost",
     conn: duckdb.DuckDBPyConnection | None = None,
+    profile_dir: str | None = None,
 ) -> List[Dict]:
     owns_conn = conn is None
     if owns_conn:
-        conn = duckdb.connect(database=":memory:")
+        # a passed in connection is profiled by its owner
+        conn = traced_duckdb(
+            profiled_connection(duckdb.connect(database=":memory:"), "select_dimension_charts", profile_dir),
+            "select_dimension_charts",
+        )
 
     table_sql = f"read_parquet('{parquet.as_posix()}')"
     logging.info("🔍  analysing parquet   %s", parquet)
 
+    columns = conn.execute(f"DESCRIBE SELECT * FROM {table_sql}").fetchall()
     dims = [
         col
-        for col, *_ in conn.execute(f"DESCRIBE SELECT * FROM {table_sql}").fetchall()
-        if any(col.startswith(p) for p in prefixes)
+        for col, col_type, *_ in columns
+        if any(col.startswith(p) for p in prefixes) and not col_type.startswith("MAP(")
     ]
     logging.info("🔍  %d candidate dimensions: %s", len(dims), dims[:20])
+    names = {col for col, *_ in columns}
+
+    # residual tag MAP columns whose exploded columns would match a prefix
+    residual_maps = [
+        col
+        for col, col_type, *_ in columns
+        if col in RESIDUAL_MAP_COLUMNS
+        and col_type.startswith("MAP(")
+        and any(p.startswith(f"{col}_") or f"{col}_".startswith(p) for p in prefixes)
+    ]
+    for map_col in residual_maps:
+        # without hybrid tags the MAP keeps every key next to the exploded columns
+        coverage = [
+            (k, cov)
+            for k, cov in _residual_key_coverage(conn, table_sql, map_col, cost_col)
+            if f"{map_col}_{k}" not in names
+        ]
+        qualifying = [(k, cov) for k, cov in coverage if (cov or 0.0) >= COST_COVERAGE_THR]
+        logging.info("🔍  %d keys in residual MAP %s", len(coverage), map_col)
+        for k, cov in qualifying:
+            logging.warning(
+                "  ! %-45s (%.1f %%) is in the residual MAP, add %r to tag_allowlist to chart it",
+                f"{map_col}_{k}", 100 * cov, k,
+            )
 
     selected: List[Dict] = []
 
@@ -244,6 +301,7 @@ def select_dimension_charts(
         d.pop("top_cost_share", None)
 
     if owns_conn:
+        write_profile_report(conn)
         conn.close()
     logging.info("✓ prepared %d chart specs", len(selected))
     return selected
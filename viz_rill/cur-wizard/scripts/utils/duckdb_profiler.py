@@ -0,0 +1,233 @@
+"""
+Opt-in DuckDB profiling of the statements run by the normalizers and the chart selector.
+
+``profiled_connection`` wraps a DuckDB connection so that every statement executed through
+it is profiled with DuckDB's JSON profiler. Per statement the latency, CPU time, rows
+scanned and returned, bytes read, peak buffer memory, spilled bytes (peak temp directory
+size) and the slowest operators are kept. ``write_profile_report`` writes them, ranked by
+latency, to ``<profile_dir>/<name>_profile.json`` and ``<name>_profile.txt``.
+
+Profiling is enabled by passing a ``profile_dir`` (the ``--profile`` flags of the scripts)
+or by setting ``DUCKDB_PROFILE_DIR``; otherwise the connection is returned untouched.
+
+Example:
+
+    >>> con = profiled_connection(duckdb.connect(), "normalize_aws", "profiles")
+    >>> con.execute("SELECT ...").fetchall()
+    >>> write_profile_report(con)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+import re
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import duckdb
+
+# metrics collected on top of the default ones, see the DuckDB profiling docs
+_PROFILING_SETTINGS = {
+    "QUERY_NAME": "true",
+    "LATENCY": "true",
+    "CPU_TIME": "true",
+    "ROWS_RETURNED": "true",
+    "TOTAL_BYTES_READ": "true",
+    "SYSTEM_PEAK_BUFFER_MEMORY": "true",
+    "SYSTEM_PEAK_TEMP_DIR_SIZE": "true",
+    "OPERATOR_TYPE": "true",
+    "OPERATOR_TIMING": "true",
+    "OPERATOR_CARDINALITY": "true",
+    "OPERATOR_ROWS_SCANNED": "true",
+    "EXTRA_INFO": "true",
+}
+# slowest operators kept per statement
+TOP_OPERATORS = 5
+# statements printed at the end of a profiled run
+TOP_STATEMENTS = 10
+
+
+class ProfiledConnection:
+    """
+    A DuckDB connection whose statements are profiled, everything else is passed through.
+
+    DuckDB writes the profile of a statement when its result is released, which may only
+    happen when the next statement starts. Every statement therefore gets its own profile
+    file, and the files of finished statements are collected before the next one runs.
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, name: str, profile_dir: pathlib.Path) -> None:
+        self._con = con
+        self.name = name
+        self.profile_dir = profile_dir
+        self.statements: List[Dict[str, Any]] = []
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self._counter = 0
+        self._profile_file: pathlib.Path | None = None
+        settings = json.dumps(_PROFILING_SETTINGS).replace("'", "''")
+        con.execute("SET enable_profiling = 'json'")
+        self._next_profile_file()
+        con.execute(f"SET custom_profiling_settings = '{settings}'")
+
+    def execute(self, query: str, *args: Any, **kwargs: Any) -> "_ProfiledResult":
+        self._next_profile_file()
+        return _ProfiledResult(self._con.execute(query, *args, **kwargs))
+
+    def sql(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        self._next_profile_file()
+        return self._con.sql(query, *args, **kwargs)
+
+    def close(self) -> None:
+        self.collect()
+        self._con.close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._con, name)
+
+    def _next_profile_file(self) -> None:
+        """Points the profiler to a new file, this also releases the result of the previous statement."""
+        self._counter += 1
+        self._profile_file = self.profile_dir / f".{self.name}.{os.getpid()}.{self._counter:06d}.json"
+        self._con.execute(f"SET profiling_output = '{self._profile_file}'")
+        self._collect_finished()
+
+    def _collect_finished(self) -> None:
+        for path in sorted(self.profile_dir.glob(f".{self.name}.{os.getpid()}.*.json")):
+            if path == self._profile_file:
+                continue
+            profile = json.loads(path.read_text())
+            path.unlink()
+            if not profile.get("query_name", "").lstrip().upper().startswith("SET "):
+                self.statements.append(summarize_profile(profile))
+
+    def collect(self) -> None:
+        """Collects the profiles of all statements run so far."""
+        self._next_profile_file()
+        if self._profile_file.exists():
+            self._profile_file.unlink()
+
+
+class _ProfiledResult:
+    """
+    Result of a profiled statement.
+
+    DuckDB only writes the profile of a fully consumed result, so ``fetchone`` reads the whole
+    result first; the statements of the scripts fetch single aggregate rows with it.
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection) -> None:
+        self._con = con
+        self._rows: List[Any] | None = None
+
+    def fetchone(self) -> Any:
+        if self._rows is None:
+            self._rows = self._con.fetchall()
+        return self._rows.pop(0) if self._rows else None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._con, name)
+
+
+def _walk(node: Dict[str, Any]):
+    for child in node.get("children", []):
+        yield child
+        yield from _walk(child)
+
+
+def summarize_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Aggregates the JSON profile of one statement, operator timings are summed per operator."""
+    operators: Dict[str, Dict[str, float]] = defaultdict(lambda: dict(seconds=0.0, rows=0, rows_scanned=0))
+    for node in _walk(profile):
+        operator = operators[node.get("operator_name") or node.get("operator_type", "?")]
+        operator["seconds"] += node.get("operator_timing", 0.0)
+        operator["rows"] += node.get("operator_cardinality", 0)
+        operator["rows_scanned"] += node.get("operator_rows_scanned", 0)
+    top = sorted(operators.items(), key=lambda item: item[1]["seconds"], reverse=True)[:TOP_OPERATORS]
+    return dict(
+        sql=re.sub(r"\s+", " ", profile.get("query_name", "")).strip(),
+        latency_seconds=profile.get("latency", 0.0),
+        cpu_seconds=profile.get("cpu_time", 0.0),
+        rows_returned=profile.get("rows_returned", 0),
+        rows_scanned=sum(operator["rows_scanned"] for operator in operators.values()),
+        bytes_read=profile.get("total_bytes_read", 0),
+        peak_buffer_memory_bytes=profile.get("system_peak_buffer_memory", 0),
+        spill_bytes=profile.get("system_peak_temp_dir_size", 0),
+        operators=[dict(operator=name, **values) for name, values in top],
+    )
+
+
+def profiled_connection(
+    con: duckdb.DuckDBPyConnection, name: str, profile_dir: str | os.PathLike | None = None
+) -> Any:
+    """
+    Profiles all statements of ``con`` if a profile directory is given or set in ``DUCKDB_PROFILE_DIR``.
+
+    Returns:
+        The wrapped connection, or ``con`` itself when profiling is off.
+    """
+    profile_dir = profile_dir or os.getenv("DUCKDB_PROFILE_DIR")
+    if not profile_dir:
+        return con
+    return ProfiledConnection(con, name, pathlib.Path(profile_dir).expanduser().resolve())
+
+
+def _format_bytes(value: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+
+def format_report(statements: List[Dict[str, Any]], limit: int | None = None) -> str:
+    """Renders statements ranked by latency with their slowest operators."""
+    lines = [
+        f"{'#':>3} {'latency s':>10} {'cpu s':>8} {'rows scanned':>13} {'read':>9} {'spill':>9}  statement",
+        "-" * 100,
+    ]
+    for rank, statement in enumerate(statements[:limit], start=1):
+        lines.append(
+            f"{rank:>3} {statement['latency_seconds']:>10.3f} {statement['cpu_seconds']:>8.3f}"
+            f" {statement['rows_scanned']:>13,} {_format_bytes(statement['bytes_read']):>9}"
+            f" {_format_bytes(statement['spill_bytes']):>9}  {statement['sql'][:80]}"
+        )
+        hot = ", ".join(f"{op['operator']} {op['seconds']:.3f}s" for op in statement["operators"][:3])
+        if hot:
+            lines.append(f"{'':>48}  ↳ {hot}")
+    return "\n".join(lines)
+
+
+def write_profile_report(con: Any) -> pathlib.Path | None:
+    """
+    Writes the ranked profile of a connection from ``profiled_connection``, no-op when not profiled.
+
+    The connection may be wrapped once more by ``utils.tracing.traced_duckdb``.
+
+    Returns:
+        The path of the JSON report, None if profiling was off.
+    """
+    con = getattr(con, "wrapped", con)
+    if not isinstance(con, ProfiledConnection):
+        return None
+    con.collect()
+    statements = sorted(con.statements, key=lambda s: s["latency_seconds"], reverse=True)
+    report = dict(
+        name=con.name,
+        statements=len(statements),
+        total_latency_seconds=sum(s["latency_seconds"] for s in statements),
+        max_spill_bytes=max((s["spill_bytes"] for s in statements), default=0),
+        ranked=statements,
+    )
+    json_path = con.profile_dir / f"{con.name}_profile.json"
+    json_path.write_text(json.dumps(report, indent=2))
+    (con.profile_dir / f"{con.name}_profile.txt").write_text(format_report(statements) + "\n")
+
+    print(
+        f"🔬 Profiled {len(statements)} DuckDB statements of {con.name},"
+        f" {report['total_latency_seconds']:.2f}s in total, top {min(TOP_STATEMENTS, len(statements))}:"
+    )
+    print(format_report(statements, TOP_STATEMENTS))
+    print(f"🔬 Report written to {json_path}")
+    return json_path
@@ -0,0 +1,18 @@
+"""
+Tracing of the DuckDB statements of the normalizers and dashboard generators.
+
+Re-exports ``pipelines/helpers/tracing.py`` so the scripts emit their spans into the same
+trace as the pipeline run that started them (``TRACEPARENT``), see that module for the
+configuration. With tracing off ``traced_duckdb`` returns the connection untouched.
+"""
+
+import pathlib
+import sys
+
+_PIPELINES_DIR = pathlib.Path(__file__).resolve().parents[4] / "pipelines"
+if str(_PIPELINES_DIR) not in sys.path:
+    sys.path.insert(0, str(_PIPELINES_DIR))
+
+from helpers.tracing import span, traced_duckdb  # noqa: E402
+
+__all__ = ["span", "traced_duckdb"]